@@ -0,0 +1,255 @@
+"""
+离线的端到端性能测试：页面解析 → HLS 下载 → 合并 → 格式转换
+
+用法:
+    python benchmarks/bench_ingest.py [--clips 4] [--seconds 30] [--size 1920x1080] [--output 结果.json]
+    python benchmarks/bench_ingest.py --compare benchmarks/results/上次的结果.json [--tolerance 0.10]
+
+测试视频由 FFmpeg 的 lavfi 测试源生成，其中一个被切成 HLS 分片，和一个仿造的央视新闻页面
+一起由本地 HTTP 服务器提供，不需要联网。结果（耗时、MB/s、编码 fps、实时倍速）保存为 JSON，
+默认写入 benchmarks/results/；指定 --compare 时与之前的结果对比，任何一项变慢超过容差时退出码为 1。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# 程序通过相对路径查找 ffmpeg 和素材
+os.chdir(REPO_DIR)
+
+import engine
+from engine import (DownloadWorker, MergeWorker, ConversionWorker, PageCache, probe_media, cctv_m3u8_url,
+                    ffmpeg_path, logo_path, intro_path, outro_path)
+
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+FAKE_GUID = '0123456789abcdef0123456789abcdef'
+FAKE_TITLE = '离线性能测试新闻'
+HLS_SEGMENT_SECONDS = 4
+
+def make_clip(path, seconds, size, frequency):
+    subprocess.run([
+        ffmpeg_path, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={seconds}',
+        '-f', 'lavfi', '-i', f'sine=frequency={frequency}:sample_rate=44100:duration={seconds}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest',
+        path
+    ], check=True)
+
+def make_hls(source, folder):
+    """ Split a clip into MPEG-TS segments laid out like the CCTV CDN serves them """
+    os.makedirs(folder, exist_ok=True)
+    subprocess.run([
+        ffmpeg_path, '-y', '-v', 'error', '-i', source,
+        '-c', 'copy', '-bsf:v', 'h264_mp4toannexb',
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(folder, 'segment_%04d.ts'),
+        os.path.join(folder, '2000.m3u8')
+    ], check=True)
+
+def make_article(path):
+    """ Write a large article page with the GUID in the middle, like the real pages """
+    filler = ''.join(f'<div class="item"><a href="/news/{i}.shtml">新闻标题 {i}</a><p>正文内容</p></div>\n' for i in range(5000))
+    script = f'<script>var guid = "{FAKE_GUID}";var commentTitle = "{FAKE_TITLE}";</script>\n'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<html><head><meta charset="utf-8"><title>test</title></head><body>{filler[:len(filler) // 2]}{script}{filler}</body></html>')
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{'.shtml': 'text/html; charset=utf-8', '.m3u8': 'application/vnd.apple.mpegurl', '.ts': 'video/mp2t'})
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(root):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+def media_stats(path):
+    """ Return (duration in seconds, number of video frames) of a media file """
+    info = probe_media(path) or {}
+    duration = float(info.get('format', {}).get('duration') or 0)
+    video = next((stream for stream in info.get('streams', []) if stream.get('codec_type') == 'video'), {})
+    frames = int(video.get('nb_frames') or 0)
+    if not frames and video.get('avg_frame_rate', '0/0') != '0/0':
+        numerator, denominator = map(int, video['avg_frame_rate'].split('/'))
+        frames = int(duration * numerator / denominator) if denominator else 0
+    return duration, frames
+
+def collect_errors(worker):
+    errors = []
+    worker.error_occurred.connect(errors.append)
+    return errors
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def bench_page_extract(downloader, page_url, page_bytes, runs, cache_path):
+    samples = []
+    for _ in range(runs):
+        # 每次使用空的页面缓存，测量的是真正的下载和解析
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        downloader.page_cache = PageCache(cache_path)
+        (guid, m3u8_url, title), elapsed = timed(downloader.get_webpage_extract_guid_and_generate_m3u8_url, page_url)
+        if guid != FAKE_GUID:
+            raise RuntimeError(f"页面解析失败: {guid}")
+        samples.append(elapsed)
+    seconds = statistics.median(samples)
+    return {'seconds': seconds, 'bytes': page_bytes, 'mb_per_s': page_bytes / seconds / 1e6}, m3u8_url
+
+def bench_download(downloader, m3u8_url, page_url, segment_bytes):
+    errors = collect_errors(downloader)
+    output_file, seconds = timed(downloader.download_and_process_m3u8, FAKE_GUID, m3u8_url, 1, 1, FAKE_TITLE, page_url)
+    if not output_file:
+        raise RuntimeError('; '.join(errors) or "下载失败")
+    duration, _ = media_stats(output_file)
+    return {'seconds': seconds, 'bytes': segment_bytes, 'mb_per_s': segment_bytes / seconds / 1e6, 'realtime_factor': duration / seconds}, output_file
+
+def bench_merge(folder, clips):
+    worker = MergeWorker(folder, logo_path if os.path.exists(logo_path) else None, os.path.exists(intro_path), os.path.exists(outro_path), '不加速（CPU）')
+    errors = collect_errors(worker)
+    _, seconds = timed(worker.run)
+    output_file = os.path.join(folder, 'merged_output.mp4')
+    if errors or not os.path.exists(output_file):
+        raise RuntimeError('; '.join(errors) or "合并失败")
+    input_bytes = sum(os.path.getsize(path) for path in clips)
+    duration, frames = media_stats(output_file)
+    return {'seconds': seconds, 'bytes': input_bytes, 'mb_per_s': input_bytes / seconds / 1e6, 'encode_fps': frames / seconds, 'realtime_factor': duration / seconds}, output_file
+
+def bench_conversion(input_file, resolution, format):
+    output_file = os.path.splitext(input_file)[0] + f"_{resolution}.{format}"
+    worker = ConversionWorker(input_file, output_file, resolution, format, '不加速（CPU）')
+    errors = collect_errors(worker)
+    _, seconds = timed(worker.run)
+    if errors or not os.path.exists(output_file):
+        raise RuntimeError('; '.join(errors) or "转换失败")
+    input_bytes = os.path.getsize(input_file)
+    duration, frames = media_stats(output_file)
+    return {'seconds': seconds, 'bytes': input_bytes, 'mb_per_s': input_bytes / seconds / 1e6, 'encode_fps': frames / seconds, 'realtime_factor': duration / seconds}
+
+def environment():
+    ffmpeg_version = subprocess.run([ffmpeg_path, '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count(), 'ffmpeg': ffmpeg_version, 'commit': commit}
+
+def run_benchmarks(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 使用独立的缓存目录，测量的是没有任何缓存时的速度，也不影响平时使用的缓存
+        engine.cache_dir = os.path.join(work_dir, 'cache')
+        server_root = os.path.join(work_dir, 'server')
+        download_dir = os.path.join(work_dir, 'downloads')
+        os.makedirs(download_dir)
+
+        print(f"生成 {args.clips} 个 {args.seconds} 秒的 {args.size} 测试视频...")
+        clips = []
+        for i in range(args.clips):
+            path = os.path.join(work_dir, f'clip_{i}.mp4')
+            make_clip(path, args.seconds, args.size, 440 + i * 50)
+            clips.append(path)
+        playlist_dir = os.path.join(server_root, 'asp', 'hls', '2000', '0303000a', '3', 'default', FAKE_GUID)
+        make_hls(clips[0], playlist_dir)
+        segment_bytes = sum(os.path.getsize(os.path.join(playlist_dir, name)) for name in os.listdir(playlist_dir) if name.endswith('.ts'))
+        page_path = os.path.join(server_root, 'news', 'article.shtml')
+        make_article(page_path)
+
+        server = start_server(server_root)
+        host = f"127.0.0.1:{server.server_address[1]}"
+        # 央视的播放列表地址固定为 https，这里改为指向本地服务器
+        engine.cctv_m3u8_url = lambda cdnurl, video_id: cctv_m3u8_url(cdnurl, video_id).replace('https://', 'http://', 1)
+        page_url = f"http://{host}/news/article.shtml"
+        try:
+            downloader = DownloadWorker([page_url], host, cdn_hosts=[host], base_dir=download_dir)
+            results = {}
+            print("测试页面解析...")
+            results['page_extract'], m3u8_url = bench_page_extract(downloader, page_url, os.path.getsize(page_path), args.runs, os.path.join(work_dir, 'pages.json'))
+            print("测试 HLS 下载...")
+            results['download'], downloaded = bench_download(downloader, m3u8_url, page_url, segment_bytes)
+        finally:
+            server.shutdown()
+            engine.cctv_m3u8_url = cctv_m3u8_url
+
+        # 下载得到的视频和其余测试视频一起合并
+        merge_inputs = [downloaded]
+        for path in clips[1:]:
+            merge_inputs.append(shutil.copy(path, download_dir))
+        print("测试合并...")
+        results['merge'], merged = bench_merge(download_dir, merge_inputs)
+        print("测试格式转换...")
+        results['conversion'] = bench_conversion(merged, args.resolution, args.format)
+        return results
+
+def compare(results, baseline, tolerance):
+    """ Print each stage's time against the baseline and return the stages that slowed down beyond the tolerance """
+    regressions = []
+    print(f"{'环节':<16}{'本次(s)':>10}{'上次(s)':>10}{'变化':>10}")
+    for stage, result in results.items():
+        previous = baseline.get(stage)
+        if not previous:
+            continue
+        change = result['seconds'] / previous['seconds'] - 1
+        print(f"{stage:<16}{result['seconds']:>10.2f}{previous['seconds']:>10.2f}{change:>+10.1%}")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', type=int, default=4)
+    parser.add_argument('--seconds', type=int, default=30)
+    parser.add_argument('--size', default='1920x1080')
+    parser.add_argument('--runs', type=int, default=5, help='页面解析的重复次数')
+    parser.add_argument('--resolution', default='720p', choices=['720p', '480p', '320p'])
+    parser.add_argument('--format', default='mpg', choices=['mpg', 'avi'])
+    parser.add_argument('--output', help='结果文件，默认保存到 benchmarks/results/')
+    parser.add_argument('--compare', help='与之前的结果文件对比')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='允许变慢的比例')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    print(f"{'环节':<16}{'耗时(s)':>10}{'MB/s':>10}{'编码fps':>10}{'实时倍速':>10}")
+    for stage, result in results.items():
+        print(f"{stage:<16}{result['seconds']:>10.2f}{result['mb_per_s']:>10.1f}{result.get('encode_fps', 0):>10.1f}{result.get('realtime_factor', 0):>10.1f}")
+
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'tolerance')},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"ingest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != report['parameters']:
+            print("注意: 两次测试的参数不同，结果不能直接比较")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"变慢超过 {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
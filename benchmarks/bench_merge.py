@@ -0,0 +1,101 @@
+"""
+对比两种合并方式（逐个处理后拼接 / 单次处理）的耗时和临时文件占用的峰值磁盘空间
+
+用法:
+    python benchmarks/bench_merge.py [--clips 6] [--seconds 20] [--size 1920x1080]
+
+测试视频由 FFmpeg 的 lavfi 测试源生成，不需要联网。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# 程序通过相对路径查找 ffmpeg 和素材
+os.chdir(REPO_DIR)
+
+from engine import MergeWorker, ffmpeg_path, logo_path, intro_path, outro_path, MERGE_MODE_TWO_PASS, MERGE_MODE_SINGLE_PASS
+
+def make_clips(folder, count, seconds, size):
+    for i in range(count):
+        subprocess.run([
+            ffmpeg_path, '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={seconds}',
+            '-f', 'lavfi', '-i', f'sine=frequency={440 + i * 50}:sample_rate=44100:duration={seconds}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest',
+            os.path.join(folder, f'clip_{i}.mp4')
+        ], check=True)
+
+def folder_size(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class DiskSampler(threading.Thread):
+    """ Record the largest size the folder reaches while a merge is running """
+
+    def __init__(self, folder):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, folder_size(self.folder))
+            time.sleep(0.05)
+
+def run_merge(folder, mode):
+    # 不使用处理后视频的缓存，否则预热之后逐个处理的方式会直接复用上次的结果，临时文件也不在测试目录里
+    worker = MergeWorker(folder, logo_path, os.path.exists(intro_path), os.path.exists(outro_path), '不加速（CPU）', merge_mode=mode, clip_cache_max_bytes=0)
+    errors = []
+    worker.error_occurred.connect(errors.append)
+
+    baseline = folder_size(folder)
+    sampler = DiskSampler(folder)
+    sampler.start()
+    start = time.perf_counter()
+    worker.run()
+    elapsed = time.perf_counter() - start
+    sampler.stopped.set()
+    sampler.join()
+
+    output_file = os.path.join(folder, 'merged_output.mp4')
+    output_size = os.path.getsize(output_file) if os.path.exists(output_file) else 0
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    # 峰值占用减去原始视频和最终输出，剩下的就是临时文件
+    return elapsed, max(sampler.peak - baseline - output_size, 0)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', type=int, default=6)
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--size', default='1920x1080')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"生成 {args.clips} 个 {args.seconds} 秒的 {args.size} 测试视频...")
+        make_clips(folder, args.clips, args.seconds, args.size)
+        # 先跑一次，让片头片尾和水印缓存生效，避免影响对比
+        run_merge(folder, MERGE_MODE_TWO_PASS)
+
+        print(f"{'合并方式':<16}{'耗时(s)':>10}{'临时文件峰值(MB)':>20}")
+        for mode in (MERGE_MODE_TWO_PASS, MERGE_MODE_SINGLE_PASS):
+            elapsed, peak = run_merge(folder, mode)
+            print(f"{mode:<16}{elapsed:>10.1f}{peak / 1024 / 1024:>20.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+对比央视页面 GUID/标题提取的两种方式：流式预编译正则扫描 与 BeautifulSoup 完整解析
+
+用法:
+    python benchmarks/bench_page_extract.py [保存的页面目录]
+
+页面目录中的每个 *.html 文件都会被测试（可在浏览器中"另存为"央视新闻页面得到），
+未提供目录时使用一个合成的大页面。
+"""
+import os
+import sys
+import glob
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import extract_cctv_video_info, extract_cctv_video_info_with_bs4, CCTV_PAGE_CHUNK_SIZE
+
+REPEAT = 20
+
+def synthetic_page():
+    filler = ''.join(f'<div class="item"><a href="/news/{i}.shtml">新闻标题 {i}</a><p>正文内容 ' * 4 + '</p></div>\n' for i in range(3000))
+    script = '<script>var guid = "0123456789abcdef0123456789abcdef";var commentTitle = "合成测试页面";</script>\n'
+    return f'<html><head><title>test</title></head><body>{filler[:len(filler) // 3]}{script}{filler}</body></html>'
+
+def load_pages(folder):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(folder, '*.html'))):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+def as_chunks(text):
+    # 模拟 iter_content 按块返回的页面内容
+    return [text[i:i + CCTV_PAGE_CHUNK_SIZE] for i in range(0, len(text), CCTV_PAGE_CHUNK_SIZE)]
+
+def main():
+    pages = load_pages(sys.argv[1]) if len(sys.argv) > 1 else {}
+    if not pages:
+        pages = {'synthetic.html': synthetic_page()}
+
+    print(f"{'页面':<40}{'大小(KB)':>10}{'BeautifulSoup(ms)':>20}{'流式扫描(ms)':>16}{'加速比':>10}")
+    for name, html in pages.items():
+        chunks = as_chunks(html)
+        fast_result = extract_cctv_video_info(iter(chunks))
+        slow_result = extract_cctv_video_info_with_bs4(html)
+        if fast_result[0] != slow_result[0] or fast_result[2] != slow_result[2]:
+            print(f"警告: {name} 两种方式结果不一致: {fast_result} != {slow_result}")
+
+        slow = min(timeit.repeat(lambda: extract_cctv_video_info_with_bs4(html), number=1, repeat=REPEAT)) * 1000
+        fast = min(timeit.repeat(lambda: extract_cctv_video_info(iter(chunks)), number=1, repeat=REPEAT)) * 1000
+        print(f"{name:<40}{len(html.encode('utf-8')) / 1024:>10.0f}{slow:>20.2f}{fast:>16.3f}{slow / fast:>9.0f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+测量程序的冷启动时间：导入 engine/main 的耗时，以及从启动到窗口显示的耗时
+
+用法:
+    python benchmarks/bench_startup.py [--runs 5] [--import-budget 0.5] [--window-budget 2.0]
+    python benchmarks/bench_startup.py --executable dist/yizhong_broadcast/yizhong_broadcast.exe
+
+每次测量都启动一个新的 Python 进程，取中位数；超过预算或启动时加载了
+应当延迟导入的库（yt_dlp、bs4、requests、psutil）时退出码为 1，可用于检查改动。
+--executable 用于测量 PyInstaller 打包后的程序，只计算到进程启动后窗口出现的时间。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 这些库只在下载、回退解析或管理子进程时才需要
+LAZY_MODULES = ('yt_dlp', 'bs4', 'requests', 'psutil')
+
+IMPORT_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+'''
+
+WINDOW_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
+import main
+app = QApplication(sys.argv)
+window = main.DownloaderGUI()
+window.show()
+def shown():
+    print(json.dumps({"seconds": time.perf_counter() - start, "loaded": [m for m in %r if m in sys.modules]}))
+    app.quit()
+# 事件循环处理完第一次绘制后才会执行
+QTimer.singleShot(0, shown)
+app.exec_()
+''' % (LAZY_MODULES,)
+
+def run_probe(code):
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure(code, runs):
+    samples = [run_probe(code) for _ in range(runs)]
+    loaded = sorted({module for sample in samples for module in sample['loaded']})
+    return statistics.median(sample['seconds'] for sample in samples), loaded
+
+def measure_executable(executable, runs):
+    """ Time from launching a packaged build until its window is visible, polled with psutil """
+    import psutil
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen([executable], cwd=os.path.dirname(os.path.abspath(executable)))
+        try:
+            while not window_visible(process.pid):
+                if process.poll() is not None:
+                    raise RuntimeError(f"程序提前退出，退出码 {process.returncode}")
+                time.sleep(0.02)
+            samples.append(time.perf_counter() - start)
+        finally:
+            for child in psutil.Process(process.pid).children(recursive=True):
+                child.kill()
+            process.kill()
+            process.wait()
+    return statistics.median(samples)
+
+def window_visible(pid):
+    """ Whether the process (or a PyInstaller bootloader child of it) owns a visible top-level window; Windows only """
+    import ctypes
+    import psutil
+    from ctypes import wintypes
+    try:
+        pids = {pid} | {child.pid for child in psutil.Process(pid).children(recursive=True)}
+    except psutil.Error:
+        return False
+    found = []
+
+    def callback(hwnd, _):
+        owner = wintypes.DWORD()
+        ctypes.windll.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(owner))
+        if owner.value in pids and ctypes.windll.user32.IsWindowVisible(hwnd):
+            found.append(hwnd)
+        return True
+
+    ctypes.windll.user32.EnumWindows(ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)(callback), 0)
+    return bool(found)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget', type=float, default=0.5, help='导入 engine 的时间预算（秒）')
+    parser.add_argument('--window-budget', type=float, default=2.0, help='启动到窗口显示的时间预算（秒）')
+    parser.add_argument('--executable', help='测量打包后的程序')
+    args = parser.parse_args()
+
+    failures = []
+    if args.executable:
+        seconds = measure_executable(args.executable, args.runs)
+        print(f"{'打包程序显示窗口':<16}{seconds:>10.3f}s")
+        if seconds > args.window_budget:
+            failures.append(f"窗口显示耗时 {seconds:.3f}s 超过预算 {args.window_budget}s")
+    else:
+        checks = [
+            ('导入 engine', IMPORT_PROBE.format(module='engine', lazy=LAZY_MODULES), args.import_budget),
+            ('导入 main', IMPORT_PROBE.format(module='main', lazy=LAZY_MODULES), None),
+            ('显示窗口', WINDOW_PROBE, args.window_budget),
+        ]
+        for name, code, budget in checks:
+            seconds, loaded = measure(code, args.runs)
+            print(f"{name:<16}{seconds:>10.3f}s" + (f"  (预算 {budget}s)" if budget else ''))
+            if budget and seconds > budget:
+                failures.append(f"{name}耗时 {seconds:.3f}s 超过预算 {budget}s")
+            if loaded:
+                failures.append(f"{name}时加载了应延迟导入的库: {', '.join(loaded)}")
+
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
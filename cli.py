@@ -0,0 +1,317 @@
+"""
+命令行入口：不加载 PyQt5，使用与图形界面相同的 engine.py 下载、合并和转换视频
+
+用法:
+    python cli.py run 任务文件.json [任务文件.yaml ...]
+    python cli.py watch 任务目录 [--interval 10]
+    python cli.py download URL [URL ...] [--cdn auto] [--max-workers 4] [--output-dir 目录]
+    python cli.py merge 视频目录 [--no-watermark] [--no-intro] [--no-outro] [--merge-mode two_pass] [--deadline 07:30]
+    python cli.py merge 视频目录 --merge-output fmp4   （分片 MP4 或 ts，按播出顺序边处理边写入，可以提前开始播放）
+    python cli.py convert 输入文件 [--resolution 720p] [--format mpg] [--output 输出文件]
+    python cli.py convert 输入文件 --targets 720p:mpg 480p:mpg   （只解码一次，同时输出多个格式）
+    python cli.py convert 输入文件 --chunks 4   （在关键帧处分为 4 段同时编码，1 为整体转换）
+    python cli.py pipeline URL [URL ...] [下载、合并和转换的所有选项]
+    python cli.py pipeline URL [URL ...] --ingest [--no-raw]   （央视视频边下载边处理，--no-raw 不保存原始文件）
+    python cli.py capabilities [--refresh]   （列出 FFmpeg 在本机可用的编码器和硬件解码）
+
+进度以 JSON Lines 输出到标准输出，每行一个事件；全部任务成功时退出码为 0。
+
+任务文件是 JSON 或 YAML（需要 PyYAML）对象，字段与命令行选项相同，例如:
+    {"type": "pipeline", "urls": ["https://tv.cctv.com/..."], "resolution": "720p", "format": "mpg"}
+一个文件也可以用 {"jobs": [...]} 包含多个任务，按顺序执行。
+
+watch 模式下，放入任务目录的文件会被移到 processing/ 中执行，完成后移到 done/ 或 failed/。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from functools import partial
+
+from engine import (DownloadWorker, MergeWorker, ConversionWorker, PipelineWorker, FFmpegCapabilities, worker_signals, missing_merge_asset, logo_path,
+                    CCTV_CDN_HOSTS, DEFAULT_MAX_CONCURRENT_DOWNLOADS, ACCELERATIONS, MERGE_MODES, MERGE_MODE_TWO_PASS, MERGE_OUTPUTS, MERGE_OUTPUT_MP4, DEFAULT_MERGE_JOBS, DEFAULT_CONVERSION_CHUNKS, deadline_from_clock,
+                    CONVERSION_RESOLUTIONS, conversion_output_file)
+
+JOB_FILE_EXTENSIONS = ('.json', '.yaml', '.yml')
+# 文件修改后至少等待这么久再领取，避免读到还没写完的任务文件
+JOB_FILE_SETTLE_SECONDS = 2
+DEFAULT_WATCH_INTERVAL = 10
+
+COMPLETION_SIGNALS = {
+    'download': 'all_downloads_complete',
+    'merge': 'merge_complete',
+    'convert': 'conversion_complete',
+    'pipeline': 'pipeline_complete',
+}
+
+class ProgressReporter:
+    """ Print every worker signal as one JSON object per line """
+
+    def __init__(self, job_name, stream=None):
+        self.job_name = job_name
+        self.stream = stream or sys.stdout
+        # 下载和处理线程会同时发出信号
+        self._lock = threading.Lock()
+
+    def attach(self, stage, worker):
+        for name, signal in worker_signals(worker).items():
+            getattr(worker, name).connect(partial(self.report, stage, name, signal.names))
+
+    def report(self, stage, event, names, *args):
+        record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'job': self.job_name, 'stage': stage, 'event': event}
+        record.update(zip(names, args))
+        with self._lock:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.stream.flush()
+
+def supervision_options(job):
+    return {key: job[key] for key in ('priority', 'cpu_affinity') if job.get(key) is not None}
+
+def create_downloader(job):
+    urls = [url.strip() for url in job.get('urls') or [] if url.strip()]
+    if not urls:
+        raise ValueError("任务中没有 urls")
+    cdn = job.get('cdn') or 'auto'
+    # 自动选择时为 None，由下载线程测速决定；也可以填写 CDN 名称或域名
+    cdnurl = None if cdn == 'auto' else CCTV_CDN_HOSTS.get(cdn, cdn)
+    return DownloadWorker(urls, cdnurl, job.get('max_workers') or DEFAULT_MAX_CONCURRENT_DOWNLOADS, cdn_hosts=list(CCTV_CDN_HOSTS.values()),
+                          base_dir=job.get('output_dir'), **supervision_options(job))
+
+def acceleration_of(job):
+    acceleration = job.get('acceleration') or 'cpu'
+    if acceleration not in ACCELERATIONS:
+        raise ValueError(f"未知的加速方式: {acceleration}，可选 {', '.join(ACCELERATIONS)}")
+    return ACCELERATIONS[acceleration]
+
+def create_merger(job, folder):
+    add_watermark = job.get('watermark', True)
+    add_intro = job.get('intro', True)
+    add_ending = job.get('outro', True)
+    missing = missing_merge_asset(add_watermark, add_intro, add_ending)
+    if missing:
+        raise ValueError(missing)
+    merge_mode = job.get('merge_mode') or MERGE_MODE_TWO_PASS
+    if merge_mode not in MERGE_MODES.values():
+        raise ValueError(f"未知的合并方式: {merge_mode}，可选 {', '.join(MERGE_MODES.values())}")
+    output_mode = job.get('merge_output') or MERGE_OUTPUT_MP4
+    if output_mode not in MERGE_OUTPUTS.values():
+        raise ValueError(f"未知的输出格式: {output_mode}，可选 {', '.join(MERGE_OUTPUTS.values())}")
+    deadline = job.get('deadline')
+    if deadline:
+        try:
+            deadline = deadline_from_clock(deadline)
+        except ValueError:
+            raise ValueError(f"无效的截止时间: {deadline}，格式为 HH:MM")
+    return MergeWorker(folder, logo_path if add_watermark else None, add_intro, add_ending, acceleration_of(job), job.get('merge_jobs') or DEFAULT_MERGE_JOBS,
+                       job.get('smart_copy', True), merge_mode, deadline=deadline, output_mode=output_mode, **supervision_options(job))
+
+def conversion_targets(job):
+    """ Return the job's (resolution, format) outputs, from "targets" or else resolution and format """
+    targets = []
+    for target in job.get('targets') or [(job.get('resolution') or '720p', job.get('format') or 'mpg')]:
+        resolution, format = target.split(':') if isinstance(target, str) else target
+        if resolution not in CONVERSION_RESOLUTIONS or format not in ('mpg', 'avi'):
+            raise ValueError(f"无效的输出格式: {resolution}:{format}")
+        targets.append((resolution, format))
+    return targets
+
+def create_workers(job):
+    """ Build the worker for one job, returning it with every {stage: worker} whose signals should be reported """
+    job_type = job.get('type')
+    if job_type == 'download':
+        worker = create_downloader(job)
+        return worker, {'download': worker}
+
+    if job_type == 'merge':
+        folder = job.get('folder')
+        if not folder or not os.path.isdir(folder):
+            raise ValueError(f"无效的文件夹: {folder}")
+        worker = create_merger(job, folder)
+        return worker, {'merge': worker}
+
+    if job_type in ('convert', 'pipeline'):
+        (resolution, format), *extra_targets = conversion_targets(job)
+    if job_type == 'convert':
+        input_file = job.get('input')
+        if not input_file or not os.path.isfile(input_file):
+            raise ValueError(f"无效的视频文件: {input_file}")
+        output_file = job.get('output') or conversion_output_file(input_file, resolution, format)
+        worker = ConversionWorker(input_file, output_file, resolution, format, acceleration_of(job), extra_targets=extra_targets,
+                                  chunks=job.get('chunks') or DEFAULT_CONVERSION_CHUNKS, **supervision_options(job))
+        return worker, {'convert': worker}
+
+    if job_type == 'pipeline':
+        downloader = create_downloader(job)
+        merger = create_merger(job, downloader.base_dir)
+        worker = PipelineWorker(downloader, merger, resolution, format, extra_targets, job.get('chunks') or DEFAULT_CONVERSION_CHUNKS,
+                                job.get('ingest', False), job.get('keep_raw', True))
+        return worker, {'pipeline': worker, 'download': downloader, 'merge': merger, 'convert': worker.converter}
+
+    raise ValueError(f"未知的任务类型: {job_type}，可选 {', '.join(COMPLETION_SIGNALS)}")
+
+def run_job(job, name):
+    """ Run one job in the current thread, returning whether it completed without errors """
+    reporter = ProgressReporter(name)
+    try:
+        worker, stages = create_workers(job)
+    except Exception as e:
+        reporter.report('job', 'job_finished', ('status', 'message'), 'failed', str(e))
+        return False
+
+    completed = []
+    errors = []
+    getattr(worker, COMPLETION_SIGNALS[job['type']]).connect(lambda *args: completed.append(args))
+    for stage, stage_worker in stages.items():
+        stage_worker.error_occurred.connect(errors.append)
+        reporter.attach(stage, stage_worker)
+
+    reporter.report('job', 'job_started', ('type',), job['type'])
+    try:
+        worker.run()
+    except Exception as e:
+        # 工作线程之外的意外错误只让这个任务失败，watch 继续处理后面的任务
+        reporter.report('job', 'job_finished', ('status', 'message'), 'failed', f"{type(e).__name__}: {e}")
+        return False
+    # 完成但有部分视频出错时记为 partial
+    status = ('partial' if errors else 'ok') if completed else 'failed'
+    reporter.report('job', 'job_finished', ('status', 'errors'), status, len(errors))
+    return status == 'ok'
+
+def load_job_file(path):
+    """ Read a JSON or YAML job file, returning its list of jobs """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("读取 YAML 任务文件需要安装 PyYAML")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, dict) and 'jobs' in data:
+        return list(data['jobs'])
+    return [data]
+
+def run_job_file(path):
+    name = os.path.basename(path)
+    try:
+        jobs = load_job_file(path)
+    except Exception as e:
+        ProgressReporter(name).report('job', 'job_finished', ('status', 'message'), 'failed', f"无法读取任务文件: {e}")
+        return False
+    results = [run_job(job, name if len(jobs) == 1 else f"{name}#{i + 1}") for i, job in enumerate(jobs)]
+    return all(results)
+
+def pending_job_files(directory):
+    """ Return job files in the directory that have stopped changing, oldest first """
+    now = time.time()
+    paths = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.lower().endswith(JOB_FILE_EXTENSIONS) and now - entry.stat().st_mtime >= JOB_FILE_SETTLE_SECONDS:
+            paths.append((entry.stat().st_mtime, entry.path))
+    return [path for _, path in sorted(paths)]
+
+def watch(directory, interval=DEFAULT_WATCH_INTERVAL):
+    """ Process job files dropped into the directory until interrupted """
+    folders = {name: os.path.join(directory, name) for name in ('processing', 'done', 'failed')}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    while True:
+        for path in pending_job_files(directory):
+            name = os.path.basename(path)
+            claimed = os.path.join(folders['processing'], name)
+            try:
+                # 移动成功才算领取到任务，多个 watch 进程可以共用一个目录
+                os.replace(path, claimed)
+            except OSError:
+                continue
+            try:
+                succeeded = run_job_file(claimed)
+            except Exception as e:
+                ProgressReporter(name).report('job', 'job_finished', ('status', 'message'), 'failed', f"{type(e).__name__}: {e}")
+                succeeded = False
+            finished = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{name}"
+            os.replace(claimed, os.path.join(folders['done' if succeeded else 'failed'], finished))
+        time.sleep(interval)
+
+def print_capabilities(refresh=False):
+    """ Print the FFmpeg capability probe as JSON; the acceleration choices use the command line names """
+    capabilities = FFmpegCapabilities.load(refresh)
+    available = capabilities.available_accelerations()
+    record = capabilities.to_dict()
+    record['accelerations'] = {name: label in available for name, label in ACCELERATIONS.items()}
+    record['cpu_encoder'] = capabilities.cpu_encoder()
+    print(json.dumps(record, ensure_ascii=False, indent=2))
+
+def build_parser():
+    download_options = argparse.ArgumentParser(add_help=False)
+    download_options.add_argument('urls', nargs='+', help='视频链接')
+    download_options.add_argument('--cdn', default='auto', help='央视CDN：auto（测速后自动选择）、CDN 名称或域名')
+    download_options.add_argument('--max-workers', type=int, default=DEFAULT_MAX_CONCURRENT_DOWNLOADS, help='同时下载数')
+    download_options.add_argument('--output-dir', help='保存目录，默认为当前目录下以日期命名的文件夹')
+
+    acceleration_options = argparse.ArgumentParser(add_help=False)
+    acceleration_options.add_argument('--acceleration', default='cpu', choices=list(ACCELERATIONS), help='FFmpeg加速')
+    acceleration_options.add_argument('--priority', choices=['low', 'below_normal', 'normal', 'high'], help='FFmpeg 进程的 CPU 优先级')
+
+    merge_options = argparse.ArgumentParser(add_help=False)
+    merge_options.add_argument('--no-watermark', dest='watermark', action='store_false', help='不添加水印')
+    merge_options.add_argument('--no-intro', dest='intro', action='store_false', help='不添加片头')
+    merge_options.add_argument('--no-outro', dest='outro', action='store_false', help='不添加片尾')
+    merge_options.add_argument('--no-smart-copy', dest='smart_copy', action='store_false', help='所有视频都重新编码')
+    merge_options.add_argument('--merge-mode', default=MERGE_MODE_TWO_PASS, choices=list(MERGE_MODES.values()), help='合并方式')
+    merge_options.add_argument('--merge-output', default=MERGE_OUTPUT_MP4, choices=list(MERGE_OUTPUTS.values()), help='合并结果的格式：fmp4 和 ts 边处理边写入，写入过程中就可以播放')
+    merge_options.add_argument('--merge-jobs', type=int, default=DEFAULT_MERGE_JOBS, help='并行处理数')
+    merge_options.add_argument('--deadline', metavar='HH:MM', help='在此时间前完成，x264 预设按实测编码速度选择（逐个处理或边下载边处理时有效）')
+
+    convert_options = argparse.ArgumentParser(add_help=False)
+    convert_options.add_argument('--resolution', default='720p', choices=['720p', '480p', '320p'], help='分辨率')
+    convert_options.add_argument('--format', default='mpg', choices=['mpg', 'avi'], help='目标格式')
+    convert_options.add_argument('--chunks', type=int, default=DEFAULT_CONVERSION_CHUNKS, help='分段并行转换的段数，1 为整体转换')
+    convert_options.add_argument('--targets', nargs='+', metavar='分辨率:格式', help='同时输出多个格式，如 720p:mpg 480p:mpg，输入只解码一次')
+
+    parser = argparse.ArgumentParser(description='自贡一中新闻采集系统（命令行版）')
+    commands = parser.add_subparsers(dest='type', required=True)
+
+    run_parser = commands.add_parser('run', help='执行任务文件')
+    run_parser.add_argument('job_files', nargs='+', help='JSON 或 YAML 任务文件')
+
+    watch_parser = commands.add_parser('watch', help='持续处理放入目录的任务文件')
+    watch_parser.add_argument('directory', help='任务目录')
+    watch_parser.add_argument('--interval', type=float, default=DEFAULT_WATCH_INTERVAL, help='检查间隔（秒）')
+
+    commands.add_parser('download', parents=[download_options, acceleration_options], help='下载视频')
+    merge_parser = commands.add_parser('merge', parents=[merge_options, acceleration_options], help='合并视频')
+    merge_parser.add_argument('folder', help='包含视频文件的文件夹')
+    convert_parser = commands.add_parser('convert', parents=[convert_options, acceleration_options], help='格式转换')
+    convert_parser.add_argument('input', help='要转换的视频文件')
+    convert_parser.add_argument('--output', help='输出文件，默认与输入文件同目录')
+    pipeline_parser = commands.add_parser('pipeline', parents=[download_options, merge_options, convert_options, acceleration_options], help='下载后自动合并并转换')
+    pipeline_parser.add_argument('--ingest', action='store_true', help='央视视频边下载边处理成播出规格，不再先保存再读取')
+    pipeline_parser.add_argument('--no-raw', dest='keep_raw', action='store_false', help='配合 --ingest，不保存原始下载文件')
+    capabilities_parser = commands.add_parser('capabilities', help='列出 FFmpeg 在本机可用的编码器和硬件解码')
+    capabilities_parser.add_argument('--refresh', action='store_true', help='忽略缓存，重新检测')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        if args.type == 'run':
+            return 0 if all([run_job_file(path) for path in args.job_files]) else 1
+        if args.type == 'watch':
+            watch(args.directory, args.interval)
+            return 0
+        if args.type == 'capabilities':
+            print_capabilities(args.refresh)
+            return 0
+        job = {key: value for key, value in vars(args).items() if value is not None}
+        return 0 if run_job(job, args.type) else 1
+    except KeyboardInterrupt:
+        return 130
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3305 @@
+""" Download, merge and conversion engine shared by the GUI (main.py) and the command line (cli.py)
+
+Nothing in this module imports PyQt5. Workers report through Signal attributes, which main.py
+replaces with pyqtSignal so the same code runs inside a QThread.
+"""
+import sys
+import re
+import os
+import shutil
+import tempfile
+from urllib.parse import urljoin
+import urllib
+import subprocess
+import signal
+import threading
+import queue
+import time
+import json
+import struct
+import sqlite3
+import hashlib
+from fractions import Fraction
+from contextlib import nullcontext, contextmanager, closing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from datetime import datetime, timedelta
+# requests、bs4、psutil 和 yt_dlp 加载较慢，在第一次用到时才导入，让窗口尽快出现
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+
+    return os.path.join(base_path, relative_path)
+
+def log_to_stderr(message):
+    """ Default log of helpers used without a worker; stdout is the JSON Lines progress stream of cli.py """
+    print(message, file=sys.stderr)
+
+ffmpeg_path = resource_path("ffmpeg/ffmpeg.exe")
+ffprobe_path = resource_path("ffmpeg/ffprobe.exe")
+logo_path = resource_path("assets/logo.png")
+intro_path = resource_path("assets/intro.mp4")
+outro_path = resource_path("assets/outro.mp4")
+seal_path = resource_path("zgyz_seal.ico")
+cache_dir = os.path.join(os.getcwd(), "cache")
+# Windows 上启动 FFmpeg 时不弹出控制台窗口；其他系统没有这个标志
+NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+CCTV_GUID_PATTERN = re.compile(r'var\s+guid(?:_0)?\s*=\s*"([^"]+)"')
+CCTV_VIDEO_CENTER_ID_PATTERN = re.compile(r'videoCenterId:\s*"([^"]+)"')
+CCTV_TITLE_PATTERN = re.compile(r"var\s+(?:share|comment)Title\s*=\s*['\"]([^'\"]+)['\"];")
+# 每次读取的页面字节数，以及相邻两块之间保留的重叠字符数（防止匹配内容被切断）
+CCTV_PAGE_CHUNK_SIZE = 16 * 1024
+CCTV_SCAN_OVERLAP = 1024
+# GUID 和标题只在 <script> 标签内查找，与 BeautifulSoup 的做法一致，页面正文中的同名文字不会被误认
+CCTV_SCRIPT_START_PATTERN = re.compile(r'<script\b[^>]*>', re.IGNORECASE)
+CCTV_SCRIPT_END_PATTERN = re.compile(r'</script\s*>', re.IGNORECASE)
+# 结束标签可能被分块切断，脚本末尾留这么多字符到下一块再判断
+CCTV_SCRIPT_END_TAIL = 32
+
+def split_script_text(text, in_script):
+    """ Split page text into the parts that lie inside <script> tags
+
+    Returns (pieces, rest, in_script): pieces are (script_text, closed) with closed set where a script ends,
+    and rest is the trailing text that may hold a tag cut by the chunk boundary and is rescanned with the next chunk.
+    """
+    pieces = []
+    while True:
+        if in_script:
+            match = CCTV_SCRIPT_END_PATTERN.search(text)
+            if not match:
+                cut = max(0, len(text) - CCTV_SCRIPT_END_TAIL)
+                pieces.append((text[:cut], False))
+                return pieces, text[cut:], True
+            pieces.append((text[:match.start()], True))
+            text = text[match.end():]
+            in_script = False
+        else:
+            match = CCTV_SCRIPT_START_PATTERN.search(text)
+            if not match:
+                # 开始标签可能被切断，从最后一个 '<' 起保留
+                tag = text.rfind('<')
+                return pieces, text[tag:] if tag != -1 and len(text) - tag < CCTV_SCAN_OVERLAP else '', False
+            text = text[match.end():]
+            in_script = True
+
+def extract_cctv_video_info(chunks):
+    """ Scan CCTV page text chunk by chunk, stopping as soon as the GUID and title are found
+
+    The GUID and title are matched inside <script> tags like the BeautifulSoup path, but the first match is
+    taken instead of the last so that the scan can stop early. Returns (guid, video_center_id, title); any of them may be None.
+    """
+    guid = None
+    video_center_id = None
+    title = None
+    page_tail = ''
+    script_tail = ''
+    rest = ''
+    in_script = False
+    for chunk in chunks:
+        window = page_tail + chunk
+        if not guid and not video_center_id:
+            # videoCenterId 与原来一样在整个页面中查找
+            match = CCTV_VIDEO_CENTER_ID_PATTERN.search(window)
+            if match:
+                video_center_id = match.group(1)
+        page_tail = window[-CCTV_SCAN_OVERLAP:]
+
+        pieces, rest, in_script = split_script_text(rest + chunk, in_script)
+        for text, closed in pieces:
+            script_window = script_tail + text
+            if not guid:
+                match = CCTV_GUID_PATTERN.search(script_window)
+                if match:
+                    guid = match.group(1)
+            if not title:
+                match = CCTV_TITLE_PATTERN.search(script_window)
+                if match:
+                    title = match.group(1)
+            # 不同的 <script> 之间不拼接
+            script_tail = '' if closed else script_window[-CCTV_SCAN_OVERLAP:]
+        if guid and title:
+            break
+    return guid, video_center_id, title
+
+def extract_cctv_video_info_with_bs4(html):
+    """ Slow path: parse the whole page with BeautifulSoup and search every <script> tag """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    guid = None
+    video_center_id = None
+    title = None
+
+    for script in soup.find_all('script'):
+        if script.string:
+            guid_match = CCTV_GUID_PATTERN.search(script.string)
+            if guid_match:
+                guid = guid_match.group(1)
+
+            title_match = CCTV_TITLE_PATTERN.search(script.string)
+            if title_match:
+                title = title_match.group(1)
+
+    if not guid:
+        video_center_id_match = CCTV_VIDEO_CENTER_ID_PATTERN.search(html)
+        if video_center_id_match:
+            video_center_id = video_center_id_match.group(1)
+
+    return guid, video_center_id, title
+
+def cctv_m3u8_url(cdnurl, video_id):
+    return f"https://{cdnurl}/asp//hls/2000/0303000a/3/default/{video_id}/2000.m3u8"
+
+# 页面缓存的有效期（秒）和最多保存的页面数
+CCTV_PAGE_CACHE_TTL = 7 * 24 * 3600
+CCTV_PAGE_CACHE_MAX_ENTRIES = 1000
+# 不影响页面内容的跟踪参数
+TRACKING_QUERY_PARAMS = ('spm', 'from', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content')
+
+def canonical_page_url(url):
+    """ Normalize a page URL so that links differing only in scheme, case, fragment or tracking parameters share a cache entry """
+    parts = urllib.parse.urlsplit(url.strip())
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in TRACKING_QUERY_PARAMS]
+    scheme = 'https' if parts.scheme in ('http', 'https') else parts.scheme
+    return urllib.parse.urlunsplit((scheme, parts.netloc.lower(), parts.path, urllib.parse.urlencode(query), ''))
+
+class PageCache:
+    """ Disk-backed LRU cache of resolved CCTV pages, revalidated with conditional GETs after the TTL """
+
+    def __init__(self, path, ttl=CCTV_PAGE_CACHE_TTL, max_entries=CCTV_PAGE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, url):
+        """ Return (entry, fresh) for a cached page, or (None, False) """
+        with self._lock:
+            entry = self.entries.get(url)
+            if not entry:
+                return None, False
+            entry['last_used'] = time.time()
+            return dict(entry), time.time() - entry.get('fetched_at', 0) < self.ttl
+
+    def put(self, url, **fields):
+        with self._lock:
+            now = time.time()
+            entry = self.entries.setdefault(url, {})
+            entry.update(fields, fetched_at=now, last_used=now)
+            if len(self.entries) > self.max_entries:
+                # 淘汰最久未使用的页面
+                by_last_used = sorted(self.entries, key=lambda key: self.entries[key].get('last_used', 0))
+                for key in by_last_used[:len(self.entries) - self.max_entries]:
+                    del self.entries[key]
+            self._save()
+
+    def touch(self, url):
+        """ Mark an entry as freshly validated after a 304 Not Modified """
+        with self._lock:
+            if url in self.entries:
+                self.entries[url]['fetched_at'] = self.entries[url]['last_used'] = time.time()
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+# 已完成的分片攒够这么多个或距上次保存超过这么多秒才写一次清单，其他更新立即写入；
+# 崩溃时最多丢失这些分片的记录，续传时重新下载即可
+MANIFEST_SAVE_SEGMENTS = 32
+MANIFEST_SAVE_INTERVAL = 2.0
+
+class DownloadManifest:
+    """ On-disk record of the downloads in one dated output folder, used to skip and resume jobs """
+    FILENAME = 'download_manifest.json'
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, self.FILENAME)
+        self._lock = threading.Lock()
+        self._unsaved_segments = 0
+        self._saved_at = time.monotonic()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, url):
+        with self._lock:
+            return dict(self.entries.get(url, {}))
+
+    def update(self, url, **fields):
+        with self._lock:
+            self.entries.setdefault(url, {}).update(fields)
+            self._save()
+
+    def add_segment(self, url, index):
+        with self._lock:
+            self.entries.setdefault(url, {}).setdefault('segments_done', []).append(index)
+            self._unsaved_segments += 1
+            if self._unsaved_segments >= MANIFEST_SAVE_SEGMENTS or time.monotonic() - self._saved_at >= MANIFEST_SAVE_INTERVAL:
+                self._save()
+
+    def flush(self):
+        """ Write segments recorded since the last save """
+        with self._lock:
+            if self._unsaved_segments:
+                self._save()
+
+    def finished_file(self, url):
+        """ Return the output file of a finished download, or None if it has to be (re)downloaded """
+        entry = self.get(url)
+        if entry.get('status') == 'finished' and entry.get('file') and os.path.exists(entry['file']):
+            return entry['file']
+        return None
+
+    def _save(self):
+        # 先写临时文件再替换，避免断电或崩溃时清单损坏
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+        self._unsaved_segments = 0
+        self._saved_at = time.monotonic()
+
+# 同时进行的下载任务数上限
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 4
+# 边下载边处理成播出规格的视频保存在下载目录的这个子文件夹，合并页面扫描下载目录时不会重复处理
+INGEST_FOLDER = 'broadcast'
+
+
+CCTV_CDN_HOSTS = {
+    "CCTV HLS_NAP (中国大陆,高清)":"hlssnap.video.cctv.com",
+    "网宿国际 (海外,需代理hls.cntv.cdn20.com)":"hls.cntv.cdn20.com"
+}
+# CDN 下拉框中的自动测速选项
+CDN_AUTO_LABEL = "自动选择 (测速后使用最快的CDN)"
+# 针对单个主机的并发上限，子域名共用同一个上限
+DEFAULT_HOST_LIMITS = {
+    "hlssnap.video.cctv.com": 3,
+    "bilibili.com": 2,
+}
+
+class BoundSignal:
+    """ Per-instance list of slots behind a Signal """
+
+    def __init__(self):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def emit(self, *args):
+        for slot in list(self._slots):
+            slot(*args)
+
+class Signal:
+    """ Minimal stand-in for pyqtSignal: slots run synchronously in the emitting thread
+
+    The argument names describe the payload, so that the command line can report it as JSON.
+    """
+
+    def __init__(self, *names):
+        self.names = names
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance.__dict__.setdefault('_signal_' + self.name, BoundSignal())
+
+def worker_signals(worker):
+    """ Return {name: Signal} for every engine signal declared on the worker's class """
+    signals = {}
+    for cls in reversed(type(worker).__mro__):
+        signals.update({name: value for name, value in vars(cls).items() if isinstance(value, Signal)})
+    return signals
+
+# 进度回调的最短间隔（秒），避免长时间编码时大量信号堵塞界面线程
+PROGRESS_EMIT_INTERVAL = 0.25
+
+class JobCancelled(Exception):
+    pass
+
+class RateLimiter:
+    """ Let an action through at most once per interval """
+
+    def __init__(self, interval=PROGRESS_EMIT_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+
+    def ready(self, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            return True
+        return False
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# 子进程的 CPU 优先级
+PRIORITY_LOW = 'low'
+PRIORITY_BELOW_NORMAL = 'below_normal'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_HIGH = 'high'
+POSIX_NICE_VALUES = {PRIORITY_LOW: 19, PRIORITY_BELOW_NORMAL: 10, PRIORITY_NORMAL: 0, PRIORITY_HIGH: -5}
+
+class ProcessSupervisor:
+    """ Track the FFmpeg processes started for one job, so that only they are prioritized and cleaned up
+
+    Processes get the job's CPU priority and, optionally, are pinned to a list of CPU cores. On POSIX
+    each one leads its own session, and close() signals the whole process group. Windows has no such
+    group kill without a job object, so close() walks the process tree with psutil instead. Short
+    ffprobe calls (probe_media, stream_extents) are not tracked.
+    """
+
+    def __init__(self, priority=PRIORITY_NORMAL, cpu_affinity=None):
+        self.priority = priority
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity else None
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def spawn(self, command, **popen_kwargs):
+        if sys.platform == 'win32':
+            priority_class = {
+                PRIORITY_LOW: subprocess.IDLE_PRIORITY_CLASS,
+                PRIORITY_BELOW_NORMAL: subprocess.BELOW_NORMAL_PRIORITY_CLASS,
+                PRIORITY_NORMAL: subprocess.NORMAL_PRIORITY_CLASS,
+                PRIORITY_HIGH: subprocess.HIGH_PRIORITY_CLASS,
+            }[self.priority]
+            popen_kwargs['creationflags'] = NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP | priority_class
+        else:
+            popen_kwargs['start_new_session'] = True
+        process = subprocess.Popen(command, **popen_kwargs)
+
+        import psutil
+        try:
+            child = psutil.Process(process.pid)
+            if sys.platform != 'win32' and self.priority != PRIORITY_NORMAL:
+                child.nice(POSIX_NICE_VALUES[self.priority])
+            if self.cpu_affinity:
+                child.cpu_affinity(self.cpu_affinity)
+        except (psutil.Error, OSError):
+            # 进程已经结束或没有权限调整，不影响任务本身
+            pass
+
+        with self._lock:
+            self._processes.add(process)
+        return process
+
+    def release(self, process):
+        """ Stop tracking a process that has already exited """
+        with self._lock:
+            self._processes.discard(process)
+
+    def close(self, timeout=5):
+        """ Terminate every tracked process that is still running, killing it if it doesn't exit in time """
+        with self._lock:
+            processes = list(self._processes)
+            self._processes.clear()
+        running = [process for process in processes if process.poll() is None]
+        for process in running:
+            self._signal_group(process, kill=False)
+        for process in running:
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self._signal_group(process, kill=True)
+                process.wait()
+
+    @staticmethod
+    def _signal_group(process, kill):
+        """ Terminate (or kill) a process together with everything it started """
+        if sys.platform != 'win32':
+            # start_new_session 让进程号同时是进程组号，孙进程即使已经脱离父进程也在组内
+            try:
+                os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+                return
+            except OSError:
+                pass
+        else:
+            import psutil
+            try:
+                for child in psutil.Process(process.pid).children(recursive=True):
+                    child.kill()
+            except psutil.Error:
+                pass
+        if kill:
+            process.kill()
+        else:
+            process.terminate()
+
+class FFmpegJob:
+    """ Run one FFmpeg command and follow its -progress output without blocking on any pipe
+
+    on_progress receives a dict with out_time (seconds), fraction (0-1, None while the duration
+    is unknown), fps, speed, bitrate (kbit/s), total_size (bytes written) and done; calls are
+    coalesced to one per interval. The latest dict is always kept in progress.
+    """
+
+    def __init__(self, command, duration=None, on_progress=None, stdin=False, interval=PROGRESS_EMIT_INTERVAL, supervisor=None):
+        self.command = [command[0], '-hide_banner', '-nostats', '-progress', 'pipe:1'] + list(command[1:])
+        self.supervisor = supervisor
+        self.duration = duration
+        self.on_progress = on_progress
+        self.use_stdin = stdin
+        self.limiter = RateLimiter(interval)
+        # 只保留最后几行错误输出，用于出错时的提示
+        self.stderr_tail = deque(maxlen=20)
+        self.process = None
+        self.progress = None
+        self.cancelled = False
+        self._readers = []
+
+    @property
+    def stdin(self):
+        return self.process.stdin
+
+    def start(self):
+        pipes = dict(stdin=subprocess.PIPE if self.use_stdin else subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if self.supervisor:
+            self.process = self.supervisor.spawn(self.command, **pipes)
+        else:
+            self.process = subprocess.Popen(self.command, creationflags=NO_WINDOW, **pipes)
+        # 两个管道都由后台线程读取，任何一个写满都不会卡住 FFmpeg
+        self._readers = [threading.Thread(target=self._read_progress, daemon=True), threading.Thread(target=self._read_stderr, daemon=True)]
+        for reader in self._readers:
+            reader.start()
+        return self
+
+    def wait(self):
+        self.process.wait()
+        for reader in self._readers:
+            reader.join()
+        # 读取线程已经结束，及时关闭管道，长时间运行的 watch 不会积累句柄
+        self.process.stdout.close()
+        self.process.stderr.close()
+        if self.supervisor:
+            self.supervisor.release(self.process)
+        if self.cancelled:
+            raise JobCancelled("任务已取消")
+        if self.process.returncode != 0:
+            raise subprocess.CalledProcessError(self.process.returncode, 'ffmpeg', stderr='\n'.join(self.stderr_tail))
+
+    def run(self):
+        self.start()
+        self.wait()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def _read_progress(self):
+        values = {}
+        for raw_line in self.process.stdout:
+            key, separator, value = raw_line.decode('utf-8', 'replace').strip().partition('=')
+            if not separator:
+                continue
+            values[key] = value.strip()
+            # 每组进度信息以 progress=continue 或 progress=end 结尾
+            if key == 'progress':
+                self._report(values, done=values['progress'] == 'end')
+                values = {}
+
+    def _read_stderr(self):
+        duration_regex = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+        for raw_line in self.process.stderr:
+            line = raw_line.decode('utf-8', 'replace').rstrip()
+            self.stderr_tail.append(line)
+            if not self.duration:
+                # 未指定时长时使用输入文件的时长
+                match = duration_regex.search(line)
+                if match:
+                    hours, minutes, seconds = map(float, match.groups())
+                    self.duration = hours * 3600 + minutes * 60 + seconds
+
+    def _report(self, values, done):
+        out_time_us = parse_float(values.get('out_time_us'))
+        out_time = max(out_time_us / 1000000, 0.0) if out_time_us is not None else 0.0
+        fraction = min(out_time / self.duration, 1.0) if self.duration else None
+        self.progress = {
+            'out_time': out_time,
+            'fraction': 1.0 if done else fraction,
+            'fps': parse_float(values.get('fps')),
+            'speed': parse_float(values.get('speed', '').rstrip('x')),
+            'bitrate': parse_float(values.get('bitrate', '').replace('kbits/s', '')),
+            'total_size': parse_float(values.get('total_size')),
+            'done': done,
+        }
+        if self.on_progress and self.limiter.ready(force=done):
+            self.on_progress(self.progress)
+
+# 每个下载、处理和转换任务的耗时统计，按大小轮换
+TELEMETRY_PATH = os.path.join(os.getcwd(), "logs", "telemetry.jsonl")
+TELEMETRY_MAX_BYTES = 5 * 1024 * 1024
+TELEMETRY_BACKUPS = 5
+
+class TelemetryLog:
+    """ Append telemetry records to a JSONL file, rotating it to .1 … .N when it grows too large """
+
+    # 同一进程中的所有任务共用一把锁，记录不会交错
+    _lock = threading.Lock()
+
+    def __init__(self, path=None, max_bytes=TELEMETRY_MAX_BYTES, backups=TELEMETRY_BACKUPS):
+        self.path = path or TELEMETRY_PATH
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def write(self, record):
+        """ Append one record; raises OSError if the log can't be written """
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line.encode('utf-8')) > self.max_bytes:
+                self.rotate()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+class JobTelemetry:
+    """ Stage durations and counters for one URL or file, finished into a single record
+
+    Each stage is a dict of figures such as seconds, bytes, avg_rate/min_rate (bytes/s), retries,
+    speed and fps. Stages recorded more than once (e.g. retried) accumulate their seconds. Stages
+    added with concurrent=True are summed over several threads, so their seconds are thread time
+    rather than wall-clock time and they can't be the bottleneck.
+    """
+
+    def __init__(self, job, subject):
+        self.job = job
+        self.subject = subject
+        self.started = datetime.now()
+        self.status = None
+        self.stages = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """ Time the enclosed block as a stage; the yielded dict can be filled with more figures """
+        fields = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.add(name, time.perf_counter() - start, **fields)
+
+    def add(self, name, seconds=0.0, concurrent=False, **fields):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0})
+            stage['seconds'] = round(stage['seconds'] + seconds, 3)
+            if concurrent:
+                stage['concurrent'] = True
+            stage.update((key, value) for key, value in fields.items() if value is not None)
+
+    def add_ffmpeg(self, name, seconds, job, **fields):
+        """ Record an FFmpeg stage with the encode speed, fps and output size from its last progress report """
+        progress = job.progress or {}
+        self.add(name, seconds, speed=progress.get('speed'), fps=progress.get('fps'), bytes=progress.get('total_size'), **fields)
+
+    def finish(self, status, **fields):
+        # 多个线程累加的等待时间可能超过总时长，不能和其他环节比较
+        timed = [name for name, stage in self.stages.items() if not stage.get('concurrent')]
+        record = {
+            'time': self.started.isoformat(timespec='seconds'),
+            'job': self.job,
+            'subject': self.subject,
+            'status': self.status or status,
+            'seconds': round(time.perf_counter() - self._start, 3),
+            'stages': self.stages,
+            'bottleneck': max(timed, key=lambda name: self.stages[name]['seconds']) if timed else None,
+        }
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        return record
+
+def publish_telemetry(worker, telemetry, status, **fields):
+    """ Finish a job's telemetry, append it to the worker's log and emit it on telemetry_recorded """
+    record = telemetry.finish(status, **fields)
+    try:
+        worker.telemetry_log.write(record)
+    except OSError as e:
+        # 统计只用于分析，写不进去也不影响任务，只提示一下
+        worker.report_status(f"写入统计记录时出错: {e}")
+    worker.telemetry_recorded.emit(record)
+    return record
+
+def summarize_telemetry(record):
+    """ Reduce a record to the figures shown in the summary table; missing figures are None """
+    stages = record.get('stages', {}).values()
+
+    def values(key):
+        return [stage[key] for stage in stages if stage.get(key) is not None]
+
+    return {
+        'seconds': record.get('seconds'),
+        'bottleneck': record.get('bottleneck'),
+        'bytes': sum(values('bytes')) if values('bytes') else None,
+        'avg_rate': min(values('avg_rate'), default=None),
+        'min_rate': min(values('min_rate'), default=None),
+        'speed': min(values('speed'), default=None),
+        'fps': min(values('fps'), default=None),
+        'retries': sum(values('retries')),
+    }
+
+# HLS 分片并行下载的线程数、重试次数和超时（秒）
+HLS_SEGMENT_WORKERS = 8
+HLS_SEGMENT_RETRIES = 3
+HLS_REQUEST_TIMEOUT = 15
+# CDN 测速时读取的字节数；从同一 CDN 下载的总速度低于下限（字节/秒）时切换到下一个 CDN，
+# 多个分片同时下载时每个连接只需达到下限除以连接数
+CDN_PROBE_BYTES = 512 * 1024
+CDN_MIN_THROUGHPUT = 256 * 1024
+# 小于此大小的分片下载速度主要受延迟影响，不用来判断 CDN 快慢
+CDN_MIN_MEASURED_SEGMENT = 256 * 1024
+
+def create_http_session(pool_size=HLS_SEGMENT_WORKERS, retries=HLS_SEGMENT_RETRIES):
+    """ Create a keep-alive requests session with a connection pool and automatic retries """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class HostFetchCounter:
+    """ Number of segment transfers in flight per CDN host, shared by all downloads of a batch """
+
+    def __init__(self):
+        self._active = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def active(self, host):
+        with self._lock:
+            self._active[host] = self._active.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[host] -= 1
+
+    def count(self, host):
+        with self._lock:
+            return self._active.get(host, 0)
+
+class HLSDownloader:
+    """ Fetch the segments of an HLS playlist in parallel and remux them into MP4 with FFmpeg """
+
+    def __init__(self, session, workers=HLS_SEGMENT_WORKERS, retries=HLS_SEGMENT_RETRIES, cdn_hosts=None, min_throughput=CDN_MIN_THROUGHPUT, log=log_to_stderr, supervisor=None,
+                 fetches=None):
+        self.session = session
+        self.supervisor = supervisor
+        self.workers = max(1, workers)
+        self.retries = retries
+        # 按优先级排列的 CDN 主机，分片失败或速度过慢时依次切换
+        self.cdn_hosts = list(cdn_hosts or [])
+        self.cdn_index = 0
+        self.min_throughput = min_throughput
+        # 同一 CDN 上正在进行的分片下载数，整批下载共用时按总速度判断 CDN 是否过慢
+        self.fetches = fetches or HostFetchCounter()
+        self.log = log
+        self.served_by = {}
+        # 下载统计：字节数、分片数、续传复用的分片数、重试次数和最慢分片的速度（字节/秒）
+        self.stats = {'bytes': 0, 'segments': 0, 'reused': 0, 'retries': 0, 'min_rate': None}
+        self._cdn_lock = threading.Lock()
+
+    def current_host(self):
+        with self._cdn_lock:
+            return self.cdn_hosts[self.cdn_index] if self.cdn_hosts else None
+
+    def switch_host(self, failed_host, reason):
+        """ Move on to the next CDN, unless another segment has already switched away from failed_host """
+        with self._cdn_lock:
+            if len(self.cdn_hosts) < 2 or self.cdn_hosts[self.cdn_index] != failed_host:
+                return
+            self.cdn_index = (self.cdn_index + 1) % len(self.cdn_hosts)
+            next_host = self.cdn_hosts[self.cdn_index]
+        self.log(f"CDN {failed_host} {reason}，切换到 {next_host}")
+
+    def on_host(self, url, host):
+        """ Point a segment URL at another CDN host with the same path layout """
+        parts = urllib.parse.urlsplit(url)
+        if not host or parts.netloc not in self.cdn_hosts:
+            return url
+        return urllib.parse.urlunsplit(parts._replace(netloc=host))
+
+    def probe(self, m3u8_urls):
+        """ Measure playlist latency and short-burst segment throughput for each URL, fastest first """
+        def probe_one(m3u8_url):
+            result = {'url': m3u8_url, 'host': urllib.parse.urlsplit(m3u8_url).netloc, 'latency': None, 'throughput': 0.0}
+            try:
+                start = time.monotonic()
+                segments = self.fetch_playlist(m3u8_url)
+                result['latency'] = time.monotonic() - start
+                if segments:
+                    received = 0
+                    start = time.monotonic()
+                    with self.session.get(segments[0], stream=True, timeout=HLS_REQUEST_TIMEOUT) as response:
+                        response.raise_for_status()
+                        for chunk in response.iter_content(chunk_size=64 * 1024):
+                            received += len(chunk)
+                            if received >= CDN_PROBE_BYTES:
+                                break
+                    result['throughput'] = received / max(time.monotonic() - start, 1e-6)
+            except Exception as e:
+                result['error'] = str(e)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, len(m3u8_urls))) as executor:
+            results = list(executor.map(probe_one, m3u8_urls))
+        return sorted(results, key=lambda r: ('error' in r, -r['throughput'], r['latency'] or 0))
+
+    def fetch_playlist(self, m3u8_url):
+        """ Return the segment URLs of the playlist, or None if it uses features we don't support """
+        response = self.session.get(m3u8_url, timeout=HLS_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        lines = [line.strip() for line in response.text.splitlines() if line.strip()]
+        if not lines or lines[0] != '#EXTM3U':
+            raise ValueError(f"不是有效的 m3u8 播放列表: {m3u8_url}")
+
+        variants = []
+        segments = []
+        variant_bandwidth = None
+        for line in lines:
+            if line.startswith('#EXT-X-STREAM-INF'):
+                match = re.search(r'BANDWIDTH=(\d+)', line)
+                variant_bandwidth = int(match.group(1)) if match else 0
+            elif line.startswith('#EXT-X-KEY') and 'METHOD=NONE' not in line:
+                # 加密的流交给 FFmpeg 处理
+                return None
+            elif line.startswith('#EXT-X-MAP'):
+                # fMP4 分片无法直接按字节拼接
+                return None
+            elif not line.startswith('#'):
+                uri = urljoin(m3u8_url, line)
+                if variant_bandwidth is not None:
+                    variants.append((variant_bandwidth, uri))
+                    variant_bandwidth = None
+                else:
+                    segments.append(uri)
+
+        if variants:
+            # 主播放列表，选择码率最高的子播放列表
+            return self.fetch_playlist(max(variants)[1])
+        return segments
+
+    def download(self, segments, segment_dir, output_file, progress_callback=None, completed=(), segment_callback=None, command=None):
+        """ Download all segments and remux them into output_file, reporting (done, total) per segment
+
+        Segments listed in completed whose files are still in segment_dir are reused instead of
+        fetched again, and segment_callback(index) is called after each newly saved segment.
+        command replaces the remux with another FFmpeg command reading the stream from pipe:0.
+        Returns the finished FFmpeg job.
+        """
+        os.makedirs(segment_dir, exist_ok=True)
+        total = len(segments)
+        paths = [os.path.join(segment_dir, f"{i:05d}.ts") for i in range(total)]
+        completed = set(completed)
+        done = 0
+        done_lock = threading.Lock()
+
+        def fetch(index):
+            nonlocal done
+            if index not in completed or not os.path.exists(paths[index]):
+                self.fetch_segment(segments[index], paths[index])
+                if segment_callback:
+                    segment_callback(index)
+            else:
+                with self._cdn_lock:
+                    self.stats['reused'] += 1
+            with done_lock:
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
+
+        # 分片是 MPEG-TS，按顺序写入 FFmpeg 的标准输入即可拼接，边下载边封装
+        remux_command = command or [
+            ffmpeg_path,
+            '-y',
+            '-f', 'mpegts',
+            '-i', 'pipe:0',
+            '-c', 'copy',
+            '-bsf:a', 'aac_adtstoasc',
+            output_file
+        ]
+        job = FFmpegJob(remux_command, stdin=True, supervisor=self.supervisor).start()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(fetch, i) for i in range(total)]
+            for future, path in zip(futures, paths):
+                future.result()
+                with open(path, 'rb') as f:
+                    try:
+                        shutil.copyfileobj(f, job.stdin)
+                    except BrokenPipeError:
+                        # FFmpeg 已经退出（例如硬件编码失败），由下面的 wait() 报告它的错误
+                        break
+            try:
+                job.stdin.close()
+            except BrokenPipeError:
+                pass
+            job.wait()
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            job.cancel()
+            raise
+        executor.shutdown()
+
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        return job
+
+    def fetch_segment(self, url, path):
+        """ Download one segment to path, retrying interrupted transfers and failing over between CDNs """
+        import requests
+        part_path = path + '.part'
+        for attempt in range(self.retries + 1):
+            host = self.current_host()
+            try:
+                received = 0
+                # 传输期间同一 CDN 上平均有多少个连接
+                connections = []
+                start = time.monotonic()
+                with self.fetches.active(host):
+                    with self.session.get(self.on_host(url, host), stream=True, timeout=HLS_REQUEST_TIMEOUT) as response:
+                        response.raise_for_status()
+                        with open(part_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=64 * 1024):
+                                f.write(chunk)
+                                received += len(chunk)
+                                connections.append(self.fetches.count(host))
+                sharing = sum(connections) / len(connections) if connections else 1
+                elapsed = max(time.monotonic() - start, 1e-6)
+                os.replace(part_path, path)
+                with self._cdn_lock:
+                    self.served_by[host] = self.served_by.get(host, 0) + 1
+                    self.stats['bytes'] += received
+                    self.stats['segments'] += 1
+                    if received >= CDN_MIN_MEASURED_SEGMENT:
+                        rate = received / elapsed
+                        self.stats['min_rate'] = rate if self.stats['min_rate'] is None else min(self.stats['min_rate'], rate)
+                # 带宽由同时进行的下载平分，按连接数折算成总速度再比较
+                if received >= CDN_MIN_MEASURED_SEGMENT and received / elapsed * sharing < self.min_throughput:
+                    self.switch_host(host, f"下载速度过低 ({received / elapsed / 1024:.0f} KB/s × {sharing:.0f} 个连接)")
+                return
+            except requests.RequestException as e:
+                self.switch_host(host, f"分片下载失败 ({e})")
+                if attempt == self.retries:
+                    raise
+                with self._cdn_lock:
+                    self.stats['retries'] += 1
+                time.sleep(2 ** attempt)
+
+class DownloadWorker:
+    progress_update = Signal('current_video', 'total_videos', 'current_segment', 'total_segments')
+    download_complete = Signal('output_file')
+    all_downloads_complete = Signal()
+    error_occurred = Signal('message')
+    status_message = Signal('message')
+    telemetry_recorded = Signal('record')
+
+    def __init__(self, urls, cdnurl, max_workers=DEFAULT_MAX_CONCURRENT_DOWNLOADS, host_limits=None, cdn_hosts=None, priority=PRIORITY_NORMAL, cpu_affinity=None, base_dir=None):
+        super().__init__()
+        self.urls = urls
+        self.supervisor = ProcessSupervisor(priority, cpu_affinity)
+        # cdnurl 为 None 时，对 cdn_hosts 中的每个 CDN 测速后自动选择
+        self.cdn_hosts = list(cdn_hosts or [cdnurl])
+        self.auto_cdn = cdnurl is None
+        self.cdnurl = cdnurl or self.cdn_hosts[0]
+        self.max_workers = max(1, max_workers)
+        self.host_limits = dict(DEFAULT_HOST_LIMITS if host_limits is None else host_limits)
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+        self.hls_session = create_http_session(pool_size=HLS_SEGMENT_WORKERS * self.max_workers)
+        self.cdn_fetches = HostFetchCounter()
+        self.base_dir = base_dir or os.path.join(os.getcwd(), datetime.now().strftime("%Y-%m-%d"))
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.manifest = DownloadManifest(self.base_dir)
+        self.catalog = MediaCatalog()
+        self.page_session = create_http_session(pool_size=self.max_workers)
+        self.page_cache = PageCache(os.path.join(cache_dir, 'cctv_pages.json'))
+        # 每个下载线程一个 YoutubeDL，整批链接复用；进度按链接分发给对应的视频
+        self._ytdlp_sessions = {}
+        self._ytdlp_contexts = {}
+        self._ytdlp_lock = threading.Lock()
+        # 直接处理模式下的 (merger, threads, watermark)，见 enable_ingest()
+        self.ingest = None
+        self.keep_raw = True
+        self.ingest_dir = os.path.join(self.base_dir, INGEST_FOLDER)
+        self.telemetry_log = TelemetryLog()
+
+    def enable_ingest(self, merger, threads, watermark=None, keep_raw=True):
+        """ Normalize CCTV streams with merger's settings while they download, instead of saving a copy to normalize later
+
+        The broadcast clips go to ingest_dir; keep_raw=False skips the stream-copied original.
+        """
+        self.ingest = (merger, threads, watermark)
+        self.keep_raw = keep_raw
+
+    def report_status(self, message):
+        self.status_message.emit(message)
+
+    def is_ingested(self, path):
+        """ Whether path is a clip that was normalized while downloading """
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.ingest_dir)
+
+    def ingest_settings(self):
+        merger, _, watermark = self.ingest
+        return merger.clip_settings(watermark)
+
+    def ingest_command(self, input_stream, output_file, raw_file, hardware=True, input_format=None, preset=None):
+        """ The FFmpeg command that writes the broadcast clip, and raw_file if given, from input_stream """
+        merger, threads, watermark = self.ingest
+        return merger.build_ingest_args(input_stream, output_file, threads, watermark, raw_file, hardware, input_format, preset)
+
+    @contextmanager
+    def ingest_preset(self, current_video):
+        """ Count an ingest encode in the merger's deadline plan while it runs, yielding the x264 preset to use, or None without a plan """
+        merger = self.ingest[0]
+        # 与合并时的处理相同，只有 x264 的预设可以按截止时间调整
+        if not merger.planner or merger.video_encoder() != 'libx264':
+            yield None
+            return
+        # 编码速度受下载速度限制，不用来测量编码速度，也还不知道时长
+        index = current_video - 1
+        preset = merger.planner.start(index, None)
+        merger.announce_preset(preset)
+        try:
+            yield preset
+        finally:
+            merger.planner.finish(index)
+
+    def finished_ingest(self, url):
+        """ The broadcast clip an earlier ingest with the same settings made for url, or None """
+        if not self.ingest:
+            return None
+        entry = self.manifest.get(url)
+        path = entry.get('broadcast_file')
+        if entry.get('status') == 'finished' and path and os.path.exists(path) and entry.get('broadcast_settings') == self.ingest_settings():
+            return path
+        return None
+
+    def run(self):
+        total_videos = len(self.urls)
+        workers = min(self.max_workers, total_videos) or 1
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self.process_url, url, i+1, total_videos): url for i, url in enumerate(self.urls)}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.error_occurred.emit(f"Error downloading {futures[future]}: {str(e)}")
+        finally:
+            self.close_ytdlp_sessions()
+            self.supervisor.close()
+            self.manifest.flush()
+
+        # 所有下载完成后发送信号
+        self.all_downloads_complete.emit()
+
+    def process_url(self, url, current_video, total_videos):
+        """ Download one URL, returning the output file or None if it failed """
+        telemetry = JobTelemetry('download', url)
+        output_file = None
+        try:
+            output_file = self.download_url(url, current_video, total_videos, telemetry)
+            return output_file
+        finally:
+            publish_telemetry(self, telemetry, 'ok' if output_file else 'failed', file=output_file)
+
+    def download_url(self, url, current_video, total_videos, telemetry):
+        finished_file = self.finished_ingest(url) or self.manifest.finished_file(url)
+        if finished_file:
+            # 清单中已记录下载完成，跳过
+            telemetry.status = 'skipped'
+            self.progress_update.emit(current_video, total_videos, 100, 100)
+            self.download_complete.emit(finished_file)
+            return finished_file
+
+        if 'cctv.cn' in url or 'cctv.com' in url:
+            with telemetry.stage('page') as page_stats:
+                guid, m3u8_url, title = self.get_webpage_extract_guid_and_generate_m3u8_url(url, page_stats)
+            if guid and m3u8_url:
+                return self.download_and_process_m3u8(guid, m3u8_url, current_video, total_videos, title, url, telemetry)
+            self.error_occurred.emit(f"无法获取 GUID 或生成 m3u8 URL: {url}")
+            return None
+        queued = time.perf_counter()
+        with self.host_slot(urllib.parse.urlsplit(url).hostname or ''):
+            telemetry.add('wait_slot', time.perf_counter() - queued)
+            return self.download_with_ytdlp(url, current_video, total_videos, telemetry)
+
+    def host_slot(self, host):
+        """ Return a context manager that holds one of the per-host download slots """
+        host = host.lower()
+        for limited_host, limit in self.host_limits.items():
+            if host == limited_host or host.endswith('.' + limited_host):
+                with self._host_lock:
+                    if limited_host not in self._host_semaphores:
+                        self._host_semaphores[limited_host] = threading.BoundedSemaphore(max(1, limit))
+                    return self._host_semaphores[limited_host]
+        return nullcontext()
+
+    def download_with_ytdlp(self, url, current_video, total_videos, telemetry=None):
+        base_dir = self.base_dir
+        telemetry = telemetry or JobTelemetry('download', url)
+        # yt-dlp 每收到一块数据就回调一次，限制进度信号的频率
+        limiter = RateLimiter()
+        stats = {'bytes': 0, 'min_rate': None}
+
+        try:
+            self.manifest.update(url, status='downloading')
+            session = self.ytdlp_session()
+            with self._ytdlp_lock:
+                self._ytdlp_contexts[url] = (current_video, total_videos, limiter, stats)
+            info = None
+            start = time.perf_counter()
+            try:
+                info = session.extract_info(url, download=True)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._ytdlp_lock:
+                    self._ytdlp_contexts.pop(url, None)
+                telemetry.add('ytdlp', elapsed, bytes=stats['bytes'], avg_rate=stats['bytes'] / elapsed if stats['bytes'] else None, min_rate=stats['min_rate'],
+                              format=(info or {}).get('format_id'))
+            fields = {'status': 'finished'}
+            if info:
+                fields['id'] = f"{info.get('extractor_key')} {info.get('id')}"
+                downloads = info.get('requested_downloads') or [{}]
+                if downloads[0].get('filepath'):
+                    fields['file'] = downloads[0]['filepath']
+                elif session.in_download_archive(info):
+                    # 下载记录中已有这个视频，yt-dlp 不会重复下载
+                    telemetry.status = 'skipped'
+                    self.status_message.emit(f"下载记录中已有此视频，跳过: {info.get('title') or url}")
+            self.manifest.update(url, **fields)
+            if fields.get('file'):
+                self.catalog.record_source(fields['file'], url, fields.get('id'))
+            self.download_complete.emit(fields.get('file') or f"Downloaded video from {url}")
+            return fields.get('file')
+        except Exception as e:
+            self.error_occurred.emit(f"Error downloading {url}: {str(e)}")
+            return None
+
+    def ytdlp_options(self):
+        return {
+            'format': YTDLP_FORMAT,
+            'format_sort': YTDLP_FORMAT_SORT,
+            'concurrent_fragment_downloads': YTDLP_CONCURRENT_FRAGMENTS,
+            'outtmpl': os.path.join(self.base_dir, '%(title)s.%(ext)s'),
+            'merge_output_format': 'mp4',
+            'ffmpeg_location': ffmpeg_path,
+            'download_archive': os.path.join(self.base_dir, 'ytdlp_archive.txt'),
+            'progress_hooks': [self.ytdlp_session_hook],
+        }
+
+    def ytdlp_session(self):
+        """ The calling thread's YoutubeDL, created on first use and reused for the rest of the batch """
+        thread = threading.get_ident()
+        with self._ytdlp_lock:
+            session = self._ytdlp_sessions.get(thread)
+        if session is None:
+            import yt_dlp
+            session = yt_dlp.YoutubeDL(self.ytdlp_options())
+            with self._ytdlp_lock:
+                self._ytdlp_sessions[thread] = session
+        return session
+
+    def close_ytdlp_sessions(self):
+        with self._ytdlp_lock:
+            sessions = list(self._ytdlp_sessions.values())
+            self._ytdlp_sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def ytdlp_session_hook(self, d):
+        """ Pass a progress report of the shared sessions on with the context of the URL it belongs to """
+        # 同时下载多个分片时，回调可能来自 yt-dlp 内部的线程，所以按链接而不是按线程查找
+        info = d.get('info_dict') or {}
+        with self._ytdlp_lock:
+            context = self._ytdlp_contexts.get(info.get('original_url')) or self._ytdlp_contexts.get(info.get('webpage_url'))
+        if context:
+            self.ytdlp_progress_hook(d, *context)
+
+    def ytdlp_progress_hook(self, d, current_video, total_videos, limiter=None, stats=None):
+        if stats is not None:
+            if d['status'] == 'downloading' and d.get('speed'):
+                stats['min_rate'] = d['speed'] if stats['min_rate'] is None else min(stats['min_rate'], d['speed'])
+            elif d['status'] == 'finished':
+                # 视频和音频分别下载时，每个文件完成时各回调一次
+                stats['bytes'] += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+        if d['status'] == 'downloading':
+            if limiter and not limiter.ready():
+                return
+            percent = d.get('_percent_str', '0%')
+            # 移除 ANSI 颜色代码
+            percent = re.sub(r'\x1b\[[0-9;]*m', '', percent)
+            percent = percent.replace('%', '').strip()
+            try:
+                progress = float(percent)
+                self.progress_update.emit(current_video, total_videos, int(progress), 100)
+            except ValueError:
+                # 如果无法转换为浮点数，就不更新进度
+                pass
+        elif d['status'] == 'finished':
+            self.progress_update.emit(current_video, total_videos, 100, 100)
+
+    def get_webpage_extract_guid_and_generate_m3u8_url(self, url, stats=None):
+        """ Return (video_id, m3u8_url, title) for a CCTV page; stats, if given, receives cache and bytes """
+        stats = {} if stats is None else stats
+        cache_key = canonical_page_url(url)
+        cached, fresh = self.page_cache.get(cache_key)
+        if cached and fresh:
+            stats['cache'] = 'fresh'
+            return cached['video_id'], cctv_m3u8_url(self.cdnurl, cached['video_id']), cached.get('title')
+
+        headers = {}
+        if cached:
+            # 缓存已过期，带上校验信息询问页面是否变化
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            response = self.page_session.get(url, headers=headers, proxies={'http': None, 'https': None}, stream=True, timeout=HLS_REQUEST_TIMEOUT)
+            response.encoding = 'utf-8'  # 明确指定编码为 UTF-8
+            with response:
+                if response.status_code == 304 and cached:
+                    stats['cache'] = 'revalidated'
+                    self.page_cache.touch(cache_key)
+                    return cached['video_id'], cctv_m3u8_url(self.cdnurl, cached['video_id']), cached.get('title')
+                if response.status_code != 200:
+                    return None, None, None
+
+                # 边接收边扫描，找到 GUID 和标题后立即停止读取
+                received = []
+                def chunks():
+                    for chunk in response.iter_content(chunk_size=CCTV_PAGE_CHUNK_SIZE, decode_unicode=True):
+                        received.append(chunk)
+                        yield chunk
+
+                stats['cache'] = 'miss'
+                guid, video_center_id, title = extract_cctv_video_info(chunks())
+                if not guid and not video_center_id:
+                    # 快速扫描已读完整个页面仍未找到，改用 BeautifulSoup 解析
+                    stats['fallback'] = True
+                    guid, video_center_id, title = extract_cctv_video_info_with_bs4(''.join(received))
+                stats['bytes'] = sum(len(chunk.encode('utf-8')) for chunk in received)
+
+            video_id = guid or video_center_id
+            if not video_id:
+                return None, None, None
+
+            m3u8_url = cctv_m3u8_url(self.cdnurl, video_id)
+            self.page_cache.put(cache_key, video_id=video_id, title=title, m3u8_url=m3u8_url,
+                                etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+            return video_id, m3u8_url, title
+        except Exception as e:
+            self.status_message.emit(f"读取页面出错: {url}: {e}")
+            return None, None, None
+
+    def download_and_process_m3u8(self, guid, m3u8_url, current_video, total_videos, title, url=None, telemetry=None):
+        url = url or m3u8_url
+        telemetry = telemetry or JobTelemetry('download', url)
+
+        # 手动选择的 CDN 优先，其余作为备用
+        hosts = [self.cdnurl] + [host for host in self.cdn_hosts if host != self.cdnurl]
+        log = lambda message: self.status_message.emit(f"[{title or guid}] {message}")
+        if self.auto_cdn and len(hosts) > 1:
+            with telemetry.stage('cdn_probe'):
+                results = HLSDownloader(self.hls_session).probe([cctv_m3u8_url(host, guid) for host in hosts])
+            for result in results:
+                if 'error' in result:
+                    log(f"CDN 测速 {result['host']}: 失败 ({result['error']})")
+                else:
+                    log(f"CDN 测速 {result['host']}: 延迟 {result['latency'] * 1000:.0f} ms，速度 {result['throughput'] / 1024:.0f} KB/s")
+            hosts = [result['host'] for result in results]
+            self.manifest.update(url, cdn_probe=results)
+
+        segments = None
+        with telemetry.stage('playlist') as playlist_stats:
+            for i, host in enumerate(hosts):
+                try:
+                    m3u8_url = cctv_m3u8_url(host, guid)
+                    segments = HLSDownloader(self.hls_session).fetch_playlist(m3u8_url)
+                    # 能取到播放列表的 CDN 排到最前
+                    hosts = hosts[i:] + hosts[:i]
+                    playlist_stats['host'] = host
+                    break
+                except Exception as e:
+                    playlist_stats['retries'] = i + 1
+                    log(f"从 CDN {host} 获取播放列表时出错: {e}")
+        if not segments:
+            m3u8_url = cctv_m3u8_url(hosts[0], guid)
+            log("改用 FFmpeg 直接下载")
+
+        # 测速或获取播放列表后才知道从哪个 CDN 下载，占用这个 CDN 的名额；下载途中切换 CDN 时不再更换名额
+        queued = time.perf_counter()
+        with self.host_slot(hosts[0]):
+            # 等待同一 CDN 的下载名额所用的时间
+            telemetry.add('wait_slot', time.perf_counter() - queued)
+            return self.fetch_m3u8(guid, m3u8_url, segments, hosts, current_video, total_videos, title, url, telemetry, log)
+
+    def fetch_m3u8(self, guid, m3u8_url, segments, hosts, current_video, total_videos, title, url, telemetry, log):
+        """ Download the chosen playlist from hosts, or with FFmpeg when segments is None, and name the result after title """
+        base_dir = self.base_dir
+        # 使用 GUID 作为临时文件名
+        temp_output_file = os.path.join(base_dir, f"{guid}.mp4")
+
+        # 直接处理模式：下载的流直接处理成播出规格的视频，原始文件可以不保存
+        ingest_file = os.path.join(self.ingest_dir, f"{guid}.part.mp4") if self.ingest else None
+        raw_file = temp_output_file if not self.ingest or self.keep_raw else None
+        if self.ingest:
+            os.makedirs(self.ingest_dir, exist_ok=True)
+            acceleration = self.ingest[0].acceleration
+        encoder = None
+        # 直接处理的编码与合并的处理任务共用名额，同时编码的数量不超过 merger.jobs（显卡加速时也不超过显卡的会话上限）
+        encode_slot = self.ingest[0].encode_slots if self.ingest else nullcontext()
+        ingest_preset = self.ingest_preset(current_video) if self.ingest else nullcontext()
+
+        if segments:
+            hls = HLSDownloader(self.hls_session, cdn_hosts=hosts, log=log, supervisor=self.supervisor, fetches=self.cdn_fetches)
+            log(f"使用 CDN {hosts[0]} 下载 {len(segments)} 个分片")
+            segment_dir = os.path.join(base_dir, f"{guid}_segments")
+            entry = self.manifest.get(url)
+            # 分片数量不一致说明播放列表已变化，不能续传
+            completed = entry.get('segments_done', []) if entry.get('id') == guid and entry.get('segments_total') == len(segments) else []
+            self.manifest.update(url, id=guid, status='downloading', segments_total=len(segments), segments_done=completed)
+
+            def download(command=None):
+                # 硬件编码失败后重新运行时，已经下载的分片直接复用
+                return hls.download(segments, segment_dir, temp_output_file,
+                                    lambda done, total: self.progress_update.emit(current_video, total_videos, done, total),
+                                    completed=self.manifest.get(url).get('segments_done', []),
+                                    segment_callback=lambda index: self.manifest.add_segment(url, index),
+                                    command=command)
+
+            queued = time.perf_counter()
+            with encode_slot, ingest_preset as preset:
+                if self.ingest:
+                    telemetry.add('wait_encode_slot', time.perf_counter() - queued)
+                start = time.perf_counter()
+                try:
+                    if self.ingest:
+                        _, hardware = run_with_cpu_fallback(download, partial(self.ingest_command, 'pipe:0', ingest_file, raw_file, input_format='mpegts', preset=preset),
+                                                            acceleration, log)
+                        encoder = encoding_plan(acceleration, hardware)[1]
+                    else:
+                        download()
+                except Exception as e:
+                    error_message = f"下载过程中发生错误: {str(e)}\n"
+                    error_message += f"URL: {m3u8_url}\n"
+                    self.error_occurred.emit(error_message)
+                    if ingest_file and os.path.exists(ingest_file):
+                        os.remove(ingest_file)
+                    return None
+                finally:
+                    self.manifest.update(url, cdn_served=hls.served_by)
+                    # 分片边下载边封装（或编码），这一段同时包含了 FFmpeg 的处理时间
+                    elapsed = time.perf_counter() - start
+                    telemetry.add('segments', elapsed, avg_rate=hls.stats['bytes'] / elapsed if hls.stats['bytes'] else None, encoder=encoder,
+                                  **({'preset': preset} if preset else {}), **hls.stats)
+        else:
+            queued = time.perf_counter()
+            with encode_slot, ingest_preset as preset:
+                if self.ingest:
+                    telemetry.add('wait_encode_slot', time.perf_counter() - queued)
+                build = partial(self.ingest_command, m3u8_url, ingest_file, raw_file, preset=preset) if self.ingest else None
+                downloaded = self.download_m3u8_with_ffmpeg(m3u8_url, temp_output_file, current_video, total_videos, telemetry, build)
+            if not downloaded:
+                if ingest_file and os.path.exists(ingest_file):
+                    os.remove(ingest_file)
+                return None
+
+        # 下载成功，尝试重命名文件
+        # 下载成功后再命名是为了不让FFmpeg出错
+        # 解码 URL 编码的字符串并移除非法字符
+        safe_title = re.sub(r'[\\/*?:"<>|]', "", urllib.parse.unquote(title)) if title else None
+        output_file = None
+        if raw_file and safe_title:
+            final_filename = f"{safe_title}.mp4"
+            final_output_file = os.path.join(base_dir, final_filename)
+            try:
+                os.rename(temp_output_file, final_output_file)
+                output_file = final_output_file
+            except Exception as rename_error:
+                self.status_message.emit(f"重命名文件时出错: {rename_error}")
+                output_file = temp_output_file
+        elif raw_file:
+            output_file = temp_output_file
+
+        self.manifest.update(url, id=guid, status='finished', file=output_file, segments_done=[])
+        if output_file:
+            self.catalog.record_source(output_file, url, guid)
+        if self.ingest:
+            # 交给后续步骤的是处理好的视频
+            output_file = os.path.join(self.ingest_dir, f"{safe_title or guid}.mp4")
+            os.replace(ingest_file, output_file)
+            self.manifest.update(url, broadcast_file=output_file, broadcast_settings=self.ingest_settings())
+
+        # 确保最后一个视频下载完成时显示100%进度
+        self.progress_update.emit(current_video, total_videos, 100, 100)
+        self.download_complete.emit(output_file)
+        return output_file
+
+    def download_m3u8_with_ffmpeg(self, m3u8_url, temp_output_file, current_video, total_videos, telemetry=None, build=None):
+        """ Let FFmpeg fetch the playlist itself, used when the built-in HLS engine can't handle it
+
+        build(hardware), if given, makes the command that normalizes the stream while downloading.
+        """
+        ffmpeg_command = [
+            ffmpeg_path,
+            "-i", m3u8_url,
+            "-c", "copy",
+            temp_output_file,
+            "-y"
+        ]
+
+        def report(progress):
+            if progress['fraction'] is not None:
+                self.progress_update.emit(current_video, total_videos, int(progress['fraction'] * 100), 100)
+
+        job = None
+
+        def run(command):
+            nonlocal job, ffmpeg_command
+            ffmpeg_command = command
+            job = FFmpegJob(command, on_progress=report, supervisor=self.supervisor)
+            job.run()
+
+        start = time.perf_counter()
+        try:
+            if build:
+                _, hardware = run_with_cpu_fallback(run, build, self.ingest[0].acceleration, self.status_message.emit)
+                if telemetry:
+                    telemetry.add('ffmpeg_download', encoder=encoding_plan(self.ingest[0].acceleration, hardware)[1])
+            else:
+                run(ffmpeg_command)
+            return True
+
+        except subprocess.CalledProcessError as e:
+            error_message = f"下载失败: FFmpeg 进程返回错误码 {e.returncode}\n"
+            error_message += f"命令: {' '.join(ffmpeg_command)}\n"
+            error_message += e.stderr or ''
+            self.error_occurred.emit(error_message)
+
+        except Exception as e:
+            # 出错时确保进程被关闭
+            if job:
+                job.cancel()
+            error_message = f"下载过程中发生错误: {str(e)}\n"
+            error_message += f"命令: {' '.join(ffmpeg_command)}\n"
+            self.error_occurred.emit(error_message)
+
+        finally:
+            if job and telemetry:
+                telemetry.add_ffmpeg('ffmpeg_download', time.perf_counter() - start, job)
+
+        return False
+
+# 同时进行的视频处理（重新编码）任务数，默认每两个 CPU 核心一个任务
+DEFAULT_MERGE_JOBS = max(1, min(4, (os.cpu_count() or 2) // 2))
+# 合并方式：逐个处理后拼接，或在一次 FFmpeg 运行中完成全部处理
+MERGE_MODE_TWO_PASS = 'two_pass'
+MERGE_MODE_SINGLE_PASS = 'single_pass'
+MERGE_MODES = {
+    "逐个处理后拼接": MERGE_MODE_TWO_PASS,
+    "单次处理 (不生成临时文件)": MERGE_MODE_SINGLE_PASS,
+}
+# 合并结果的封装：普通 MP4 要全部完成、写入 moov 后才能播放；
+# 分片 MP4 和 MPEG-TS 按播出顺序边处理边写入，写入过程中就可以开始播放
+MERGE_OUTPUT_MP4 = 'mp4'
+MERGE_OUTPUT_FRAGMENTED = 'fmp4'
+MERGE_OUTPUT_TS = 'ts'
+MERGE_OUTPUTS = {
+    "MP4 (全部完成后才能播放)": MERGE_OUTPUT_MP4,
+    "分片 MP4 (边处理边播放)": MERGE_OUTPUT_FRAGMENTED,
+    "MPEG-TS (边处理边播放，用于 MPG 转换)": MERGE_OUTPUT_TS,
+}
+# 分片 MP4：开头只有空的 moov，每个关键帧开始一个分片，分片内的偏移相对于各自的 moof，可以直接追加
+FRAGMENTED_MP4_FLAGS = '+frag_keyframe+empty_moov+default_base_moof'
+# 分片只带数据，SPS/PPS 等编码参数（extradata）和时间基准只在第一个视频的 moov 里，之后的视频必须完全相同才能直接追加
+FRAGMENT_APPEND_FIELDS = ('codec_type', 'codec_name', 'width', 'height', 'pix_fmt', 'sample_rate', 'channels', 'time_base', 'extradata_hash')
+# MPEG-TS 在每个关键帧前都带有 SPS/PPS，时间基准固定为 1/90000，只需流的组成和画面、声音规格相同
+TS_APPEND_FIELDS = ('codec_type', 'codec_name', 'width', 'height', 'pix_fmt', 'sample_rate', 'channels')
+# 边处理边写入时，第一个视频的时间戳从这里开始，给 B 帧的解码时间戳和 AAC 的前导样本留出余地，不会出现负数
+PROGRESSIVE_START_OFFSET = 0.2
+# 写入过程中 mvex 里先用同样大小的 free 盒子占位，全部写完才改成带总时长的 mehd，边写边播时不会读到错误的时长
+FRAGMENT_DURATION_SIZE = 20
+# 显卡编码器同时支持的编码会话有限
+GPU_MAX_PARALLEL_ENCODES = 2
+
+# 校园电视台播出规格，符合规格的视频流可以直接复制而不重新编码；
+# 复制的视频要和重新编码的视频用 -c copy 拼接，所以 H.264 的档次、级别、像素宽高比和时间基也必须一致
+BROADCAST_PROFILE = {
+    'width': 1280,
+    'height': 720,
+    'fps': 25,
+    'video_codec': 'h264',
+    'video_profile': 'High',
+    'level': 31,
+    'sar': '1:1',
+    'timescale': 12800,
+    'pix_fmt': 'yuv420p',
+    'audio_codec': 'aac',
+    'audio_profile': 'LC',
+    'sample_rate': 48000,
+    'channels': 2,
+}
+WATERMARK_HEIGHT = int(BROADCAST_PROFILE['height'] * 0.10)
+# 可以指定档次和级别的编码器，其他 CPU 编码器的输出不会与规格相符，视频都会重新编码
+PROFILE_LEVEL_ENCODERS = ('libx264', 'h264_nvenc', 'h264_amf')
+
+# yt-dlp 选择格式时优先不超过播出分辨率和帧率、H.264/AAC 的版本，这样合并时可以直接复制；最高不超过 1080p
+YTDLP_FORMAT = 'bv*[height<=1080]+ba/b[height<=1080]/bv*+ba/b'
+YTDLP_FORMAT_SORT = [f"res:{BROADCAST_PROFILE['height']}", f"fps:{BROADCAST_PROFILE['fps']}", 'vcodec:h264', 'acodec:aac']
+# 每个视频同时下载的分片数（HLS/DASH）
+YTDLP_CONCURRENT_FRAGMENTS = 4
+
+def probe_media(path):
+    """ Return ffprobe's JSON description (streams and format) of a media file, or None if it can't be read """
+    probe = subprocess.run([ffprobe_path, '-v', 'error', '-show_streams', '-show_format', '-of', 'json', path], capture_output=True, text=True, creationflags=NO_WINDOW)
+    if probe.returncode != 0:
+        return None
+    try:
+        return json.loads(probe.stdout)
+    except ValueError:
+        return None
+
+def stream_parameters(path, fields):
+    """ Return the given ffprobe fields of every stream as a list of tuples in stream order, or None if the file can't be read """
+    probe = subprocess.run([ffprobe_path, '-v', 'error', '-show_data_hash', 'CRC32', '-show_entries', 'stream=' + ','.join(fields), '-of', 'json', path],
+                           capture_output=True, text=True, creationflags=NO_WINDOW)
+    if probe.returncode != 0:
+        return None
+    try:
+        streams = json.loads(probe.stdout).get('streams', [])
+    except ValueError:
+        return None
+    return [tuple(stream.get(field) for field in fields) for stream in streams]
+
+class MediaCatalog:
+    """ SQLite index of ffprobe results and download sources, keyed by path and revalidated by size and mtime """
+
+    # 更新一行时，只有大小和修改时间都没变，列中按旧内容得到的结果才保留（SET 右侧的列名是更新前的值）
+    KEEP_IF_UNCHANGED = '{column} = CASE WHEN size IS excluded.size AND mtime IS excluded.mtime THEN {column} END'
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir, 'media_catalog.sqlite3')
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS media (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, probe TEXT, source_url TEXT, guid TEXT)')
+        return connection
+
+    @staticmethod
+    def key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def probe(self, path):
+        """ Return the ffprobe JSON of a file, running ffprobe only if the file is new or has changed """
+        key = self.key(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT size, mtime, probe FROM media WHERE path = ?', (key,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime and row[2]:
+            return json.loads(row[2])
+
+        info = probe_media(path)
+        if info is None:
+            return None
+        loudness = replaygain_of(info)
+        if loudness is not None:
+            info['loudness'] = loudness
+        with closing(self.connect()) as connection, connection:
+            # 文件被替换后，原来记录的下载来源也不再成立
+            connection.execute('INSERT INTO media (path, size, mtime, probe) VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, probe = excluded.probe, '
+                               + self.KEEP_IF_UNCHANGED.format(column='source_url') + ', ' + self.KEEP_IF_UNCHANGED.format(column='guid'),
+                               (key, stat.st_size, stat.st_mtime, json.dumps(info, ensure_ascii=False)))
+        return info
+
+    def duration(self, path):
+        """ Duration in seconds, or None if the file can't be probed """
+        info = self.probe(path)
+        if not info:
+            return None
+        return float(info.get('format', {}).get('duration') or 0)
+
+    def record_source(self, path, source_url, guid=None):
+        """ Remember where a downloaded file came from, along with its size and mtime at that moment """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with closing(self.connect()) as connection, connection:
+            connection.execute('INSERT INTO media (path, size, mtime, source_url, guid) VALUES (?, ?, ?, ?, ?) '
+                               'ON CONFLICT(path) DO UPDATE SET source_url = excluded.source_url, guid = excluded.guid, '
+                               + self.KEEP_IF_UNCHANGED.format(column='probe') + ', size = excluded.size, mtime = excluded.mtime',
+                               (self.key(path), stat.st_size, stat.st_mtime, source_url, guid))
+
+    def guids(self, paths):
+        """ Map each path that has a recorded GUID or extractor id to it, ignoring files changed since they were recorded """
+        keys = {self.key(path): path for path in paths}
+        with closing(self.connect()) as connection:
+            rows = connection.execute('SELECT path, size, mtime, guid FROM media WHERE guid IS NOT NULL').fetchall()
+        guids = {}
+        for key, size, mtime, guid in rows:
+            if key not in keys:
+                continue
+            try:
+                stat = os.stat(keys[key])
+            except OSError:
+                continue
+            if size == stat.st_size and mtime == stat.st_mtime:
+                guids[keys[key]] = guid
+        return guids
+
+def replaygain_of(info):
+    """ Track loudness in dB from ReplayGain tags, if the file carries them """
+    tag_sources = [info.get('format', {}).get('tags', {})]
+    tag_sources.extend(stream.get('tags', {}) for stream in info.get('streams', []))
+    for tags in tag_sources:
+        for name, value in tags.items():
+            if name.upper() == 'REPLAYGAIN_TRACK_GAIN':
+                match = re.match(r'\s*([-+]?\d+(?:\.\d+)?)', value)
+                if match:
+                    return float(match.group(1))
+    return None
+
+def matches_broadcast_profile(info):
+    """ Return (video_matches, audio_matches) comparing the first video and audio streams with BROADCAST_PROFILE """
+    streams = info.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+    try:
+        fps = Fraction(video.get('r_frame_rate', '0/1')) if video else 0
+    except (ValueError, ZeroDivisionError):
+        fps = 0
+
+    video_matches = bool(video) and (
+        video.get('codec_name') == BROADCAST_PROFILE['video_codec']
+        and video.get('profile') == BROADCAST_PROFILE['video_profile']
+        and video.get('level') == BROADCAST_PROFILE['level']
+        and video.get('width') == BROADCAST_PROFILE['width']
+        and video.get('height') == BROADCAST_PROFILE['height']
+        and video.get('sample_aspect_ratio') == BROADCAST_PROFILE['sar']
+        and video.get('pix_fmt') == BROADCAST_PROFILE['pix_fmt']
+        and video.get('time_base') == f"1/{BROADCAST_PROFILE['timescale']}"
+        and fps == BROADCAST_PROFILE['fps']
+    )
+    audio_matches = bool(audio) and (
+        audio.get('codec_name') == BROADCAST_PROFILE['audio_codec']
+        and audio.get('profile') == BROADCAST_PROFILE['audio_profile']
+        and int(audio.get('sample_rate', 0)) == BROADCAST_PROFILE['sample_rate']
+        and audio.get('channels') == BROADCAST_PROFILE['channels']
+        and audio.get('time_base') == f"1/{BROADCAST_PROFILE['sample_rate']}"
+    )
+    return video_matches, audio_matches
+
+def file_digest(path, extra=''):
+    """ Short content hash of a file, salted with the settings used to process it """
+    digest = hashlib.sha256(extra.encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+# 已处理视频缓存的容量上限（字节），超出后删除最久未使用的视频
+PROCESSED_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+class ProcessedClipCache:
+    """ Content-addressed store of normalized clips with a size limit and LRU eviction """
+
+    def __init__(self, folder, max_bytes=PROCESSED_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f"{key}.mp4")
+
+    def lookup(self, key):
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        # 用修改时间记录最近一次使用
+        os.utime(path)
+        return path
+
+    def store(self, key, file):
+        path = self.path_for(key)
+        os.replace(file, path)
+        return path
+
+    def evict(self, keep=()):
+        """ Delete the least recently used clips until the cache fits its size limit """
+        keep = {os.path.abspath(path) for path in keep}
+        try:
+            names = [name for name in os.listdir(self.folder) if name.endswith('.mp4')]
+        except OSError:
+            return
+        clips = []
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            clips.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in clips)
+        for _, size, path in sorted(clips):
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+def format_speed(progress):
+    """ Describe FFmpeg's encoding speed for the status text """
+    parts = []
+    if progress.get('speed'):
+        parts.append(f"速度 {progress['speed']:.2f}x")
+    if progress.get('fps'):
+        parts.append(f"{progress['fps']:.0f} fps")
+    if progress.get('bitrate'):
+        parts.append(f"{progress['bitrate']:.0f} kbit/s")
+    return f" ({', '.join(parts)})" if parts else ''
+
+ACCELERATIONS = {
+    'cpu': '不加速（CPU）',
+    'nvidia': '英伟达（Nvidia）',
+    'amd': 'AMD',
+}
+# 各加速选项使用的显卡编码器，以及可以配合使用的硬件解码方式（按优先顺序）
+HARDWARE_ENCODERS = {ACCELERATIONS['nvidia']: 'h264_nvenc', ACCELERATIONS['amd']: 'h264_amf'}
+HARDWARE_DECODERS = {ACCELERATIONS['nvidia']: ('cuda',), ACCELERATIONS['amd']: ('d3d11va', 'dxva2')}
+# 没有可用的显卡编码器时使用的 CPU 编码器，按速度和画质排列
+CPU_H264_ENCODERS = ('libx264', 'libopenh264', 'mpeg4')
+# 选择了显卡加速却只能用 CPU 编码时使用更快的预设，让速度接近显卡编码
+CPU_FALLBACK_PRESET = 'veryfast'
+CAPABILITIES_PROBE_TIMEOUT = 20
+CAPABILITIES_CACHE_TTL = 7 * 24 * 3600
+
+class FFmpegCapabilities:
+    """ Encoders and hardware decoders that the bundled FFmpeg offers and that actually work on this machine
+
+    FFmpeg builds list NVENC and AMF even without the hardware, so every hardware encoder and
+    decoder is tried on a few generated frames. The result is cached in cache/ffmpeg_capabilities.json
+    until the ffmpeg binary changes or the cache expires; load() probes at most once per process.
+    """
+    _loaded = None
+    _lock = threading.Lock()
+
+    def __init__(self, encoders=None, hwaccels=None, ffmpeg=None, fingerprint=None, probed_at=None):
+        # 名称 -> 是否可用；未列出的编码器和解码方式不可用
+        self.encoders = dict(encoders or {})
+        self.hwaccels = dict(hwaccels or {})
+        self.ffmpeg = ffmpeg
+        self.fingerprint = fingerprint
+        self.probed_at = probed_at
+
+    @classmethod
+    def load(cls, refresh=False):
+        """ Return this process's capabilities, reading the cache file or probing the first time """
+        with cls._lock:
+            if cls._loaded is None or refresh:
+                capabilities = None if refresh else cls.read_cache()
+                if capabilities is None:
+                    capabilities = cls.probe()
+                    capabilities.write_cache()
+                cls._loaded = capabilities
+            return cls._loaded
+
+    @staticmethod
+    def cache_path():
+        return os.path.join(cache_dir, 'ffmpeg_capabilities.json')
+
+    @staticmethod
+    def fingerprint_of(ffmpeg):
+        try:
+            stat = os.stat(ffmpeg)
+        except OSError:
+            return None
+        return [os.path.abspath(ffmpeg), stat.st_size, stat.st_mtime]
+
+    @classmethod
+    def read_cache(cls):
+        try:
+            with open(cls.cache_path(), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        fingerprint = cls.fingerprint_of(ffmpeg_path)
+        if not fingerprint or data.get('fingerprint') != fingerprint or time.time() - data.get('probed_at', 0) > CAPABILITIES_CACHE_TTL:
+            return None
+        return cls(data.get('encoders'), data.get('hwaccels'), data.get('ffmpeg'), data.get('fingerprint'), data.get('probed_at'))
+
+    def write_cache(self):
+        # 找不到 FFmpeg 时不缓存，放入 FFmpeg 后重新检测
+        if not self.fingerprint:
+            return
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_file = self.cache_path() + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.cache_path())
+        except OSError:
+            pass
+
+    def to_dict(self):
+        return {'ffmpeg': self.ffmpeg, 'fingerprint': self.fingerprint, 'probed_at': self.probed_at, 'encoders': self.encoders, 'hwaccels': self.hwaccels}
+
+    @classmethod
+    def probe(cls, ffmpeg=None):
+        """ List FFmpeg's encoders and hardware decoders, then test the hardware ones """
+        ffmpeg = ffmpeg or ffmpeg_path
+        fingerprint = cls.fingerprint_of(ffmpeg)
+        if not fingerprint:
+            return cls(ffmpeg=ffmpeg, probed_at=time.time())
+
+        listing = cls.run_probe([ffmpeg, '-hide_banner', '-encoders'])
+        # 例如 " V....D libx264              libx264 H.264 / AVC ..."
+        encoders = {match.group(1): True for match in re.finditer(r'^\s*[VAS][A-Z.]{5}\s+(\S+)', listing.stdout if listing else '', re.MULTILINE)}
+        encoders.pop('=', None)
+        listing = cls.run_probe([ffmpeg, '-hide_banner', '-hwaccels'])
+        hwaccels = {line.strip(): True for line in (listing.stdout if listing else '').splitlines()[1:] if line.strip()}
+
+        capabilities = cls(encoders, hwaccels, ffmpeg, fingerprint, time.time())
+        for encoder in HARDWARE_ENCODERS.values():
+            if encoder in encoders:
+                capabilities.encoders[encoder] = cls.works([ffmpeg, '-f', 'lavfi', '-i', 'color=c=black:s=640x360:r=25:d=0.2', '-c:v', encoder, '-f', 'null', '-'])
+
+        candidates = [name for names in HARDWARE_DECODERS.values() for name in names if name in hwaccels]
+        if candidates:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                sample = os.path.join(temp_dir, 'sample.mp4')
+                created = cls.works([ffmpeg, '-f', 'lavfi', '-i', 'testsrc=s=640x360:r=25:d=0.2', '-c:v', capabilities.cpu_encoder(), '-pix_fmt', 'yuv420p', sample])
+                for name in candidates:
+                    capabilities.hwaccels[name] = created and cls.works([ffmpeg, '-hwaccel', name, '-i', sample, '-f', 'null', '-'])
+        return capabilities
+
+    @staticmethod
+    def run_probe(command):
+        try:
+            return subprocess.run(command, capture_output=True, text=True, errors='replace', timeout=CAPABILITIES_PROBE_TIMEOUT, creationflags=NO_WINDOW)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+
+    @classmethod
+    def works(cls, command):
+        result = cls.run_probe([command[0], '-hide_banner', '-v', 'error', '-y'] + command[1:])
+        return bool(result) and result.returncode == 0
+
+    def has_encoder(self, name):
+        return self.encoders.get(name, False)
+
+    def has_hwaccel(self, name):
+        return self.hwaccels.get(name, False)
+
+    def mark_failed(self, *names):
+        """ Stop using an encoder or hardware decoder that failed during a job, for the rest of this process """
+        for name in names:
+            if name in self.encoders:
+                self.encoders[name] = False
+            if name in self.hwaccels:
+                self.hwaccels[name] = False
+
+    def cpu_encoder(self):
+        """ The best H.264 CPU encoder in this build; libx264 if nothing could be listed """
+        return next((name for name in CPU_H264_ENCODERS if self.has_encoder(name)), CPU_H264_ENCODERS[0])
+
+    def available_accelerations(self):
+        """ The acceleration choices whose hardware encoder works here """
+        return [label for label in ACCELERATIONS.values() if label not in HARDWARE_ENCODERS or self.has_encoder(HARDWARE_ENCODERS[label])]
+
+def encoding_plan(acceleration, hardware=True):
+    """ Return (hwaccel, encoder, preset) for an acceleration choice, falling back to the fastest working CPU encoder
+
+    hwaccel is None when decoding on the CPU; hardware=False skips the hardware encoder, e.g. after it failed.
+    """
+    capabilities = FFmpegCapabilities.load()
+    encoder = HARDWARE_ENCODERS.get(acceleration)
+    if hardware and encoder and capabilities.has_encoder(encoder):
+        hwaccel = next((name for name in HARDWARE_DECODERS[acceleration] if capabilities.has_hwaccel(name)), None)
+        return hwaccel, encoder, 'medium'
+    return None, capabilities.cpu_encoder(), CPU_FALLBACK_PRESET if encoder else 'medium'
+
+def run_with_cpu_fallback(run, build, acceleration, on_fallback=None):
+    """ Run the command build(True) makes; if it used the hardware and failed, run build(False) on the CPU instead
+
+    Returns (result of run, whether the hardware was used). The failed encoder and decoder are not
+    tried again in this process.
+    """
+    command = build(True)
+    hardware = [name for name in (HARDWARE_ENCODERS.get(acceleration), *HARDWARE_DECODERS.get(acceleration, ())) if name and name in command]
+    if not hardware:
+        return run(command), False
+    try:
+        return run(command), True
+    except subprocess.CalledProcessError as e:
+        FFmpegCapabilities.load().mark_failed(*hardware)
+        if on_fallback:
+            reason = ''.join((e.stderr or '').strip().splitlines()[-1:])
+            on_fallback(f"{acceleration} 硬件编码失败，改用 CPU 编码: {reason}")
+        return run(build(False)), False
+
+class CapabilityProbeWorker:
+    """ Load the FFmpeg capabilities off the GUI thread at startup, so the first job doesn't wait for the probe """
+    capabilities_ready = Signal('capabilities')
+
+    def run(self):
+        self.capabilities_ready.emit(FFmpegCapabilities.load())
+
+# 按截止时间选择的 x264 预设，从快到慢；更慢的预设画质提升有限，耗时却成倍增加
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow')
+# 各预设相对 medium 的大致编码速度，某个预设下实测的速度按这个比例换算到其他预设
+X264_PRESET_SPEED = {'ultrafast': 6.0, 'superfast': 4.5, 'veryfast': 3.0, 'faster': 1.9, 'fast': 1.4, 'medium': 1.0, 'slow': 0.6}
+# 还没有实测速度时使用的预设，避免开始得晚时第一批视频就已经赶不上
+DEADLINE_INITIAL_PRESET = 'veryfast'
+# 每个视频编码开始后多少秒读取速度
+DEADLINE_PROBE_SECONDS = 5
+# 只计划用掉剩余时间的这个比例，留给拼接、转换和速度波动
+DEADLINE_TIME_BUDGET = 0.85
+
+def deadline_from_clock(clock, now=None):
+    """ The next time (epoch seconds) the clock shows "HH:MM"; a time already past today means tomorrow """
+    hour, minute = (int(part) for part in clock.split(':'))
+    now = datetime.fromtimestamp(now if now is not None else time.time())
+    deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return deadline.timestamp()
+
+class DeadlinePresetPlanner:
+    """ Choose the slowest x264 preset that still finishes the remaining clips before a deadline
+
+    FFmpeg's speed= a few seconds into each clip is converted to the equivalent medium-preset
+    speed, so a measurement at any preset predicts all of them. The plan is recomputed whenever a
+    clip starts, is measured or finishes; clips not yet known (still downloading) and clips started
+    without a duration (encoded while downloading) are assumed to be as long as the average known clip.
+    """
+
+    def __init__(self, deadline, jobs, total_clips):
+        self.deadline = deadline
+        self.jobs = max(1, jobs)
+        self.total_clips = total_clips
+        self.durations = {}
+        self.fractions = {}
+        self.finished = set()
+        self.measured = set()
+        self.medium_speed = None
+        self.preset = DEADLINE_INITIAL_PRESET
+        self._lock = threading.Lock()
+
+    def start(self, index, duration):
+        """ Register a clip that is about to be encoded, duration None if not known yet, and return the preset to use """
+        with self._lock:
+            self.durations[index] = duration
+            self.fractions[index] = 0.0
+            return self.plan()
+
+    def observe(self, index, preset, progress, elapsed):
+        """ Follow a clip's progress, measuring its speed once DEADLINE_PROBE_SECONDS have passed """
+        with self._lock:
+            self.fractions[index] = progress['fraction'] or 0.0
+            if index in self.measured or elapsed < DEADLINE_PROBE_SECONDS or not progress['speed']:
+                return
+            self.measured.add(index)
+            speed = progress['speed'] / X264_PRESET_SPEED[preset]
+            # 平均最近的测量，单个视频的速度波动不会让计划大起大落
+            self.medium_speed = speed if self.medium_speed is None else (self.medium_speed + speed) / 2
+            self.plan()
+
+    def finish(self, index):
+        with self._lock:
+            self.finished.add(index)
+            self.fractions[index] = 1.0
+            self.plan()
+
+    def skip(self, index):
+        """ Stop counting a clip that won't be encoded, e.g. one that failed to download; clips already started stay counted """
+        with self._lock:
+            if index in self.durations:
+                return
+            self.total_clips -= 1
+            self.plan()
+
+    def remaining_seconds(self):
+        """ Seconds of video still to encode, including an estimate for clips not registered yet """
+        known = [duration for duration in self.durations.values() if duration]
+        average = sum(known) / len(known) if known else 0.0
+        remaining = sum((duration or average) * (1.0 - self.fractions.get(index, 0.0)) for index, duration in self.durations.items() if index not in self.finished)
+        unseen = self.total_clips - len(self.durations)
+        if unseen > 0:
+            remaining += unseen * average
+        return remaining
+
+    def plan(self):
+        if self.medium_speed is None:
+            return self.preset
+        available = (self.deadline - time.time()) * DEADLINE_TIME_BUDGET
+        unfinished = self.total_clips - len(self.finished)
+        throughput = self.medium_speed * min(self.jobs, max(1, unfinished))
+        remaining = self.remaining_seconds()
+        preset = X264_PRESETS[0]
+        for candidate in X264_PRESETS:
+            if available > 0 and remaining <= available * throughput * X264_PRESET_SPEED[candidate]:
+                preset = candidate
+        self.preset = preset
+        return preset
+
+def merged_output_file(folder, output_mode=MERGE_OUTPUT_MP4):
+    """ Path of the merged video for an output mode """
+    return os.path.join(folder, 'merged_output.ts' if output_mode == MERGE_OUTPUT_TS else 'merged_output.mp4')
+
+def output_format_args(output_mode):
+    """ FFmpeg output options that make a merged video which can be played while it is being written """
+    if output_mode == MERGE_OUTPUT_FRAGMENTED:
+        return ['-movflags', FRAGMENTED_MP4_FLAGS]
+    if output_mode == MERGE_OUTPUT_TS:
+        return ['-f', 'mpegts']
+    return []
+
+def mp4_box(box_type, payload):
+    """ Wrap payload in an MP4 box header """
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def read_mp4_box(source):
+    """ Read the whole top-level box at the current position of source, returning (type, box) """
+    header = source.read(8)
+    if len(header) < 8:
+        raise ValueError(f"MP4 文件不完整: {source.name}")
+    size, box_type = struct.unpack('>I4s', header)
+    if size == 1:
+        header += source.read(8)
+        size = struct.unpack('>Q', header[8:])[0]
+    if size < len(header):
+        raise ValueError(f"MP4 盒子大小无效: {source.name}")
+    box = header + source.read(size - len(header))
+    if len(box) < size:
+        raise ValueError(f"MP4 文件不完整: {source.name}")
+    return box_type, box
+
+def mp4_children(box):
+    """ Split a container box (moov, mvex, mfra...) into its child boxes, returning (type, box) pairs """
+    children = []
+    position = 8
+    while position + 8 <= len(box):
+        size, box_type = struct.unpack_from('>I4s', box, position)
+        if size < 8 or position + size > len(box):
+            raise ValueError("MP4 盒子大小无效")
+        children.append((box_type, box[position:position + size]))
+        position += size
+    return children
+
+def reserve_fragment_duration(moov):
+    """ Return the moov with a placeholder for an mehd box at the start of its mvex, the placeholder's offset in it and the movie timescale """
+    timescale = None
+    placeholder = None
+    boxes = []
+    for box_type, box in mp4_children(moov):
+        if box_type == b'mvhd':
+            timescale = struct.unpack_from('>I', box, 28 if box[8] == 1 else 20)[0]
+        elif box_type == b'mvex':
+            placeholder = 8 + sum(len(b) for b in boxes) + 8
+            children = b''.join(child for child_type, child in mp4_children(box) if child_type != b'mehd')
+            box = mp4_box(b'mvex', mp4_box(b'free', bytes(FRAGMENT_DURATION_SIZE - 8)) + children)
+        boxes.append(box)
+    if timescale is None or placeholder is None:
+        raise ValueError("不是分片 MP4 文件")
+    return mp4_box(b'moov', b''.join(boxes)), placeholder, timescale
+
+def fragment_duration_box(duration):
+    """ The mehd box giving the duration of the whole fragmented file, FRAGMENT_DURATION_SIZE bytes long """
+    return mp4_box(b'mehd', struct.pack('>B3xQ', 1, duration))
+
+def read_mp4_fragment_index(source):
+    """ Read the mfra box at the end of a fragmented MP4, returning {track ID: [(time, moof offset, traf, trun, sample)]}; empty if it has none """
+    index = {}
+    end = source.seek(0, os.SEEK_END)
+    if end < 16:
+        return index
+    source.seek(end - 16)
+    mfro = source.read(16)
+    size = struct.unpack_from('>I', mfro, 12)[0]
+    if mfro[4:8] != b'mfro' or size > end:
+        return index
+    source.seek(end - size)
+    box_type, mfra = read_mp4_box(source)
+    if box_type != b'mfra':
+        return index
+    for box_type, tfra in mp4_children(mfra):
+        if box_type != b'tfra':
+            continue
+        track_id, sizes, count = struct.unpack_from('>III', tfra, 12)
+        times = '>QQ' if tfra[8] == 1 else '>II'
+        # 低 6 位依次是 traf、trun、sample 序号所占的字节数减一
+        number_sizes = [((sizes >> shift) & 3) + 1 for shift in (4, 2, 0)]
+        position = 24
+        entries = index.setdefault(track_id, [])
+        for _ in range(count):
+            entry = list(struct.unpack_from(times, tfra, position))
+            position += struct.calcsize(times)
+            for number_size in number_sizes:
+                entry.append(int.from_bytes(tfra[position:position + number_size], 'big'))
+                position += number_size
+            entries.append(tuple(entry))
+    return index
+
+def mp4_fragment_index(index):
+    """ Build an mfra box (a tfra per track and the closing mfro) from {track ID: [(time, moof offset, traf, trun, sample)]} """
+    tfras = b''
+    for track_id, entries in sorted(index.items()):
+        # 时间和偏移用 64 位，三个序号各占 4 字节
+        payload = struct.pack('>B3xIII', 1, track_id, 0x3F, len(entries))
+        payload += b''.join(struct.pack('>QQIII', *entry) for entry in entries)
+        tfras += mp4_box(b'tfra', payload)
+    return mp4_box(b'mfra', tfras + mp4_box(b'mfro', struct.pack('>4xI', 8 + len(tfras) + 16)))
+
+def copy_mp4_boxes(source, target, keep):
+    """ Copy the top-level MP4 boxes whose type is in keep from source to target, returning {offset in source: offset in target} of the moof boxes copied """
+    fragments = {}
+    while True:
+        position = source.tell()
+        header = source.read(8)
+        if len(header) < 8:
+            return fragments
+        size, box_type = struct.unpack('>I4s', header)
+        if size == 1:
+            header += source.read(8)
+            size = struct.unpack('>Q', header[8:])[0]
+        elif size == 0:
+            # 最后一个盒子一直延续到文件末尾
+            size = os.fstat(source.fileno()).st_size - source.tell() + len(header)
+        remaining = size - len(header)
+        if box_type not in keep:
+            source.seek(remaining, os.SEEK_CUR)
+            continue
+        if box_type == b'moof':
+            fragments[position] = target.tell()
+        target.write(header)
+        while remaining > 0:
+            chunk = source.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise ValueError(f"MP4 文件不完整: {source.name}")
+            target.write(chunk)
+            remaining -= len(chunk)
+
+class ProgressiveOutput:
+    """ Write the merged video as fragmented MP4 or MPEG-TS in playout order while later clips are still processing
+
+    add(position, path) may be called from any thread in any order; a clip is appended once every
+    clip before it has arrived, and None (a clip that failed) is skipped. Each clip is stream-copied
+    into a piece whose timestamps continue where the previous clip ended, and only whole pieces are
+    appended, so the file can be played at any time and never ends in half a clip.
+
+    A piece whose stream parameters differ from the first one can't be appended; from then on the
+    clips are only collected and finish() joins them all with a regular concat instead. Otherwise
+    finish() gives a fragmented MP4 its duration (mehd) and a seek index (mfra) for the whole file.
+    """
+    # 第一个视频带上文件头，之后的视频只追加分片；每个视频末尾的 mfra 索引合并成整个文件的索引，完成时写在最后
+    HEADER_BOXES = (b'ftyp', b'moov')
+    FRAGMENT_BOXES = (b'moof', b'mdat')
+
+    def __init__(self, merger, output_file, output_mode, temp_dir, total, log=None):
+        self.merger = merger
+        self.output_file = output_file
+        self.fragmented = output_mode == MERGE_OUTPUT_FRAGMENTED
+        self.append_fields = FRAGMENT_APPEND_FIELDS if self.fragmented else TS_APPEND_FIELDS
+        self.temp_dir = temp_dir
+        self.piece_file = os.path.join(temp_dir, 'progressive_piece' + os.path.splitext(output_file)[1])
+        self.total = total
+        self.log = log or log_to_stderr
+        self.pending = {}
+        self.next_position = 0
+        self.clips = []
+        self.parameters = None
+        self.mismatch = None
+        self.offset = PROGRESSIVE_START_OFFSET
+        self.fragment_index = 1
+        self.index = {}
+        self.duration_at = None
+        self.timescale = None
+        self.appended = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        # 覆盖上次合并留下的文件
+        open(output_file, 'wb').close()
+
+    def add(self, position, path):
+        """ Hand over the clip for position, or None if it failed, and append every clip that is now in order """
+        with self._lock:
+            self.pending[position] = path
+            self._flush()
+
+    def finish(self):
+        """ Append anything still waiting, check that every position arrived and finalize the file, which is complete afterwards """
+        with self._lock:
+            self._flush()
+            if self.next_position < self.total:
+                raise Exception(f"合并视频缺少第 {self.next_position + 1} 个片段")
+            if not self.clips:
+                raise Exception("没有可以合并的视频")
+            start = time.perf_counter()
+            if self.mismatch:
+                # 已经写入的部分作废，整个文件重新合并（分片 MP4 此时合并成普通 MP4）
+                self.log(f"重新合并 {os.path.basename(self.output_file)}...")
+                self.merger.concat_files(self.clips, self.output_file, self.temp_dir)
+            elif self.fragmented:
+                self._write_index()
+            self.seconds += time.perf_counter() - start
+
+    def _flush(self):
+        while self.next_position in self.pending:
+            path = self.pending.pop(self.next_position)
+            self.next_position += 1
+            if path:
+                self.clips.append(path)
+                if not self.mismatch:
+                    self._append(path)
+
+    def _append(self, path):
+        start = time.perf_counter()
+        duration = self.merger.catalog.duration(path)
+        if duration is None:
+            raise Exception(f"无法读取视频信息: {path}")
+        ffmpeg_args = [
+            ffmpeg_path, '-y',
+            '-i', path,
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            '-c', 'copy',
+            # 时间戳接在上一个视频之后，原样写入，不再各自从零开始
+            '-output_ts_offset', f'{self.offset:.6f}',
+            '-avoid_negative_ts', 'disabled',
+        ]
+        if self.fragmented:
+            ffmpeg_args.extend(['-movflags', FRAGMENTED_MP4_FLAGS + '+frag_discont', '-fragment_index', str(self.fragment_index), '-f', 'mp4'])
+        else:
+            ffmpeg_args.extend(['-mpegts_flags', '+initial_discontinuity', '-f', 'mpegts'])
+        ffmpeg_args.append(self.piece_file)
+
+        try:
+            self.merger.run_ffmpeg(ffmpeg_args, duration)
+            parameters = stream_parameters(self.piece_file, self.append_fields)
+            if parameters is None:
+                raise Exception(f"无法读取视频信息: {path}")
+            if self.parameters is not None and parameters != self.parameters:
+                # 例如直接复制的片头、改用 CPU 编码或不同预设编码的视频，追加后解码器会用错编码参数
+                self.mismatch = path
+                self.log(f"{os.path.basename(path)} 的编码参数与前面的视频不同，不能直接追加，全部处理完后重新合并")
+                return
+            index = {}
+            with open(self.piece_file, 'rb') as source, open(self.output_file, 'ab') as target:
+                size = target.tell()
+                try:
+                    if self.fragmented:
+                        index = self._copy_fragments(source, target)
+                    else:
+                        shutil.copyfileobj(source, target)
+                    target.flush()
+                    os.fsync(target.fileno())
+                except BaseException:
+                    # 去掉写了一半的片段，文件仍然以完整的视频结尾
+                    target.truncate(size)
+                    raise
+        finally:
+            if os.path.exists(self.piece_file):
+                os.remove(self.piece_file)
+
+        for track_id, entries in index.items():
+            self.index.setdefault(track_id, []).extend(entries)
+        self.parameters = parameters
+        self.offset += duration
+        self.appended += 1
+        self.seconds += time.perf_counter() - start
+        self.log(f"已写入 {self.appended} 个片段，{os.path.basename(self.output_file)} 可以开始播放")
+
+    def _copy_fragments(self, source, target):
+        """ Copy the piece's fragments (and for the first piece its header) to target, returning its mfra entries moved to their offsets in target """
+        entries = read_mp4_fragment_index(source)
+        source.seek(0)
+        if not self.appended:
+            box_type = None
+            while box_type != b'moov':
+                box_type, box = read_mp4_box(source)
+                if box_type == b'moov':
+                    box, placeholder, self.timescale = reserve_fragment_duration(box)
+                    self.duration_at = target.tell() + placeholder
+                if box_type in self.HEADER_BOXES:
+                    target.write(box)
+        moved = copy_mp4_boxes(source, target, self.FRAGMENT_BOXES)
+        self.fragment_index += len(moved)
+        return {track_id: [(time, moved[moof], *numbers) for time, moof, *numbers in track_entries if moof in moved]
+                for track_id, track_entries in entries.items()}
+
+    def _write_index(self):
+        """ Replace the mehd placeholder with the file's duration and end the file with an mfra covering every fragment """
+        with open(self.output_file, 'r+b') as target:
+            target.seek(self.duration_at)
+            target.write(fragment_duration_box(round(self.offset * self.timescale)))
+            target.seek(0, os.SEEK_END)
+            target.write(mp4_fragment_index(self.index))
+            target.flush()
+            os.fsync(target.fileno())
+
+def missing_merge_asset(add_watermark, add_intro, add_ending):
+    """ Return an error message for the first required asset that doesn't exist, or None """
+    if add_watermark and not os.path.exists(logo_path):
+        return "找不到水印图片(logo.png)"
+    if add_intro and not os.path.exists(intro_path):
+        return "找不到片头视频 (intro.mp4)"
+    if add_ending and not os.path.exists(outro_path):
+        return "找不到片尾视频 (outro.mp4)"
+    return None
+
+class MergeWorker:
+    progress_update = Signal('current', 'total', 'message')
+    merge_complete = Signal('output_file')
+    error_occurred = Signal('message')
+    telemetry_recorded = Signal('record')
+
+    def __init__(self, folder, watermark_image, add_intro, add_ending, acceleration, jobs=DEFAULT_MERGE_JOBS, smart_copy=True, merge_mode=MERGE_MODE_TWO_PASS, clip_cache_max_bytes=PROCESSED_CACHE_MAX_BYTES,
+                 priority=PRIORITY_BELOW_NORMAL, cpu_affinity=None, deadline=None, output_mode=MERGE_OUTPUT_MP4):
+        super().__init__()
+        # 编码占满 CPU 时，较低的优先级让界面和下载保持流畅
+        self.supervisor = ProcessSupervisor(priority, cpu_affinity)
+        self.merge_mode = merge_mode
+        self.output_mode = output_mode
+        self.folder = folder
+        self.watermark_image = watermark_image
+        self.add_intro = add_intro
+        self.add_ending = add_ending
+        self.acceleration = acceleration
+        self.smart_copy = smart_copy
+        # 截止时间（时间戳）；设置后 x264 的预设按实测速度选择，而不是固定的 medium
+        self.deadline = deadline
+        self.planner = None
+        self.asset_cache_dir = os.path.join(cache_dir, 'assets')
+        self.catalog = MediaCatalog()
+        # 容量为 0 时不缓存，处理结果只放在临时目录中
+        self.clip_cache = ProcessedClipCache(os.path.join(cache_dir, 'processed'), clip_cache_max_bytes) if clip_cache_max_bytes > 0 else None
+        self.jobs = max(1, jobs)
+        if acceleration in HARDWARE_ENCODERS:
+            self.jobs = min(self.jobs, GPU_MAX_PARALLEL_ENCODES)
+        # 同时进行的编码数；流水线中边下载边处理的编码也占用这些名额
+        self.encode_slots = threading.BoundedSemaphore(self.jobs)
+        self.clip_progress = []
+        self._progress_lock = threading.Lock()
+        self._jobs = set()
+        self.cancelled = False
+        self._emit_limiter = RateLimiter()
+        self.telemetry_log = TelemetryLog()
+
+    def run(self):
+        # 上次合并的结果也在这个文件夹中，不能作为输入：它会被当作片段复制或缓存，而写入新结果时又会被截断
+        merged_outputs = {os.path.basename(merged_output_file(self.folder, mode)) for mode in MERGE_OUTPUTS.values()}
+        video_files = [f for f in os.listdir(self.folder) if f.endswith('.mp4') and f not in merged_outputs]
+        total_videos = len(video_files)
+        if not video_files:
+            self.error_occurred.emit("所选文件夹中没有找到 MP4 文件")
+            return
+
+        video_files = self.skip_duplicates(video_files)
+
+        output_file = merged_output_file(self.folder, self.output_mode)
+        temp_dir = os.path.join(self.folder, 'temp_processed')
+        # 每个编码任务分到的线程数，避免多个 x264 进程抢占同一批核心
+        threads = max(1, (os.cpu_count() or 1) // self.jobs)
+        telemetry = JobTelemetry('merge', self.folder)
+        status = 'failed'
+
+        try:
+            if self.merge_mode == MERGE_MODE_SINGLE_PASS:
+                self.merge_single_pass(video_files, output_file, telemetry)
+            else:
+                os.makedirs(temp_dir, exist_ok=True)
+                self.merge_two_pass(video_files, output_file, temp_dir, threads, telemetry)
+
+            status = 'ok'
+            self.merge_complete.emit(output_file)
+
+        except subprocess.CalledProcessError as e:
+            self.error_occurred.emit(f"处理视频时出错: {e}\n{e.stderr or ''}")
+        except JobCancelled:
+            status = 'cancelled'
+            self.error_occurred.emit("已取消合并")
+        except Exception as e:
+            self.error_occurred.emit(f"发生错误: {e}")
+        finally:
+            # 只清理本次合并启动的 FFmpeg，不影响同时进行的下载和转换
+            self.supervisor.close()
+            publish_telemetry(self, telemetry, status, clips=len(video_files), mode=self.merge_mode, output=self.output_mode)
+            
+            if os.path.isdir(temp_dir):
+                try:
+                    shutil.rmtree(temp_dir)
+                except Exception as e:
+                    self.error_occurred.emit(f"删除临时目录时出错: {e}")
+
+    def skip_duplicates(self, video_files):
+        """ Drop files that the catalog knows to be another copy of the same source video """
+        paths = [os.path.join(self.folder, video) for video in video_files]
+        guids = self.catalog.guids(paths)
+        seen = set()
+        unique_files = []
+        for video, path in zip(video_files, paths):
+            guid = guids.get(path)
+            if guid and guid in seen:
+                self.progress_update.emit(0, 100, f"跳过重复的视频: {video}")
+                continue
+            seen.add(guid)
+            unique_files.append(video)
+        return unique_files
+
+    def merge_two_pass(self, video_files, output_file, temp_dir, threads, telemetry=None):
+        """ Normalize every clip into temp_dir, then join them with a stream-copy concat """
+        telemetry = telemetry or JobTelemetry('merge', self.folder)
+        total_videos = len(video_files)
+        processed_files = []
+
+        self.clip_progress = [0.0] * total_videos
+        progressive = self.start_progressive_output(output_file, temp_dir, total_videos)
+        first_clip = 1 if self.add_intro else 0
+
+        if self.add_intro or self.add_ending or self.watermark_image:
+            self.progress_update.emit(0, 100, "准备片头、片尾和水印...")
+        with telemetry.stage('prepare'):
+            watermark = self.prepare_watermark() if self.watermark_image else None
+            if self.add_intro:
+                processed_files.append(self.prepare_asset(intro_path, threads))
+        if progressive and self.add_intro:
+            progressive.add(0, processed_files[0])
+
+        outputs = [os.path.join(temp_dir, f"processed_{i}.mp4") for i in range(total_videos)]
+        self.start_deadline_plan(total_videos)
+        executor = ThreadPoolExecutor(max_workers=self.jobs)
+        # 每个视频的处理另有单独的统计记录，这里记录并行处理的总时间
+        with telemetry.stage('normalize', jobs=self.jobs):
+            try:
+                futures = [executor.submit(self.normalize_clip, i, os.path.join(self.folder, video), outputs[i], threads, watermark)
+                           for i, video in enumerate(video_files)]
+                positions = {future: first_clip + i for i, future in enumerate(futures)}
+                for future in as_completed(futures):
+                    result = future.result()
+                    if progressive:
+                        progressive.add(positions[future], result)
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.terminate_processes()
+                raise
+            executor.shutdown()
+
+        # 符合规格且无需水印的视频直接使用原文件
+        processed_files.extend(future.result() for future in futures)
+
+        if self.add_ending:
+            with telemetry.stage('prepare'):
+                processed_files.append(self.prepare_asset(outro_path, threads))
+
+        if self.clip_cache:
+            self.clip_cache.evict(keep=processed_files)
+
+        if progressive:
+            if self.add_ending:
+                progressive.add(first_clip + total_videos, processed_files[-1])
+            progressive.finish()
+            telemetry.add('append', progressive.seconds, clips=progressive.appended)
+            return
+
+        start = time.perf_counter()
+        job = self.concat_files(processed_files, output_file, temp_dir)
+        telemetry.add_ffmpeg('concat', time.perf_counter() - start, job)
+
+    def start_progressive_output(self, output_file, temp_dir, total_videos):
+        """ Return a ProgressiveOutput for intro, total_videos clips and outro, or None when writing a regular MP4 at the end """
+        if self.output_mode == MERGE_OUTPUT_MP4:
+            return None
+        total = total_videos + (1 if self.add_intro else 0) + (1 if self.add_ending else 0)
+        return ProgressiveOutput(self, output_file, self.output_mode, temp_dir, total, self.report_status)
+
+    def concat_files(self, processed_files, output_file, temp_dir):
+        """ Join clips that already share the broadcast profile with a stream-copy concat """
+        with open(os.path.join(temp_dir, 'processed_list.txt'), 'w') as f:
+            for file in processed_files:
+                f.write(f"file '{file}'\n")
+
+        merge_args = [
+            ffmpeg_path,
+            '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', os.path.join(temp_dir, 'processed_list.txt'),
+            '-c', 'copy',
+            output_file
+        ]
+        # 只复制数据流，不解码也不编码，硬件加速没有作用
+        return self.run_ffmpeg(merge_args, None)
+
+    def merge_single_pass(self, video_files, output_file, telemetry=None):
+        """ Scale, watermark and concatenate everything in one FFmpeg run, without intermediate files """
+        telemetry = telemetry or JobTelemetry('merge', self.folder)
+        inputs = []
+        if self.add_intro:
+            inputs.append((intro_path, False))
+        inputs.extend((os.path.join(self.folder, video), True) for video in video_files)
+        if self.add_ending:
+            inputs.append((outro_path, False))
+
+        total_duration = 0.0
+        with telemetry.stage('probe'):
+            for path, _ in inputs:
+                duration = self.catalog.duration(path)
+                if duration is None:
+                    raise Exception(f"无法读取视频信息: {path}")
+                total_duration += duration
+
+        filter_complex = []
+        watermarked = sum(1 for _, watermark in inputs if watermark) if self.watermark_image else 0
+        if watermarked:
+            # 水印只解码一次，再分给每个需要加水印的视频
+            margin = int(WATERMARK_HEIGHT * 0.5)
+            labels = ''.join(f'[wm{k}]' for k in range(watermarked))
+            filter_complex.append(f'[{len(inputs)}:v]scale=-1:{WATERMARK_HEIGHT},split={watermarked}{labels}')
+
+        concat_inputs = []
+        next_watermark = 0
+        for k, (_, watermark) in enumerate(inputs):
+            scale = f"[{k}:v]scale={BROADCAST_PROFILE['width']}:{BROADCAST_PROFILE['height']},fps={BROADCAST_PROFILE['fps']},setsar=1,format={BROADCAST_PROFILE['pix_fmt']}"
+            if watermark and watermarked:
+                filter_complex.append(f'{scale}[s{k}]')
+                filter_complex.append(f'[s{k}][wm{next_watermark}]overlay=W-w-{margin}:{margin}[v{k}]')
+                next_watermark += 1
+            else:
+                filter_complex.append(f'{scale}[v{k}]')
+            filter_complex.append(f"[{k}:a]aresample={BROADCAST_PROFILE['sample_rate']},aformat=channel_layouts=stereo[a{k}]")
+            concat_inputs.append(f'[v{k}][a{k}]')
+        filter_complex.append(f"{''.join(concat_inputs)}concat=n={len(inputs)}:v=1:a=1[outv][outa]")
+
+        def build(hardware):
+            hwaccel, encoder, preset = encoding_plan(self.acceleration, hardware)
+            ffmpeg_args = [ffmpeg_path, '-y']
+            for path, _ in inputs:
+                # -hwaccel 是输入选项，必须放在对应的 -i 之前
+                if hwaccel:
+                    ffmpeg_args.extend(['-hwaccel', hwaccel])
+                ffmpeg_args.extend(['-i', path])
+            if watermarked:
+                ffmpeg_args.extend(['-i', self.watermark_image])
+            ffmpeg_args.extend([
+                '-filter_complex', ';'.join(filter_complex),
+                '-map', '[outv]',
+                '-map', '[outa]',
+                '-c:v', encoder,
+                '-crf', '23',
+                '-preset', preset,
+                '-c:a', 'aac',
+                '-b:a', '128k',
+                # 一次运行按播出顺序输出，分片 MP4 和 MPEG-TS 在写入过程中就可以播放
+                *output_format_args(self.output_mode),
+                output_file
+            ])
+            return ffmpeg_args
+
+        def report(progress):
+            percent = int((progress['fraction'] or 0.0) * 100)
+            self.progress_update.emit(percent, 100, f"单次合并处理中，当前进度: {percent}%{format_speed(progress)}")
+
+        start = time.perf_counter()
+        job, hardware = run_with_cpu_fallback(lambda args: self.run_ffmpeg(args, total_duration, report), build, self.acceleration, self.report_fallback)
+        telemetry.add_ffmpeg('encode', time.perf_counter() - start, job, encoder=self.video_encoder(hardware))
+
+    def normalize_clip(self, i, input_video, output_video, threads, watermark=None):
+        """ Bring one clip to the broadcast profile with the watermark, returning the file to concatenate """
+        telemetry = JobTelemetry('normalize', input_video)
+        status = 'failed'
+        preset = None
+        try:
+            with telemetry.stage('probe'):
+                info = self.catalog.probe(input_video)
+            if not info:
+                raise Exception(f"无法读取视频信息: {input_video}")
+
+            video_matches, audio_matches = matches_broadcast_profile(info) if self.smart_copy else (False, False)
+            # 加水印必须重新编码画面
+            copy_video = video_matches and not watermark
+            if copy_video and audio_matches:
+                status = 'unchanged'
+                self.report_clip_progress(i, 1.0)
+                return input_video
+
+            if self.clip_cache:
+                # 同样的内容和处理参数只编码一次，之后直接复用
+                with telemetry.stage('cache_lookup'):
+                    key = file_digest(input_video, self.clip_settings(watermark))
+                    cached_file = self.clip_cache.lookup(key)
+                if cached_file:
+                    status = 'cached'
+                    self.report_clip_progress(i, 1.0)
+                    return cached_file
+                os.makedirs(self.clip_cache.folder, exist_ok=True)
+                output_video = self.clip_cache.path_for(key) + '.part.mp4'
+
+            duration = float(info.get('format', {}).get('duration') or 0)
+            # 只有 x264 的预设可以按截止时间调整
+            preset = self.planner.start(i, duration) if self.planner and not copy_video and self.video_encoder() == 'libx264' else None
+            if preset:
+                self.announce_preset(preset)
+            start = time.perf_counter()
+
+            def report(progress):
+                if preset:
+                    self.planner.observe(i, preset, progress, time.perf_counter() - start)
+                self.report_clip_progress(i, progress['fraction'] or 0.0, progress['speed'])
+
+            try:
+                with self.encode_slots:
+                    job, hardware = run_with_cpu_fallback(
+                        lambda args: self.run_ffmpeg(args, duration, report),
+                        lambda hardware: self.build_normalize_args(input_video, output_video, threads, watermark, copy_video, audio_matches, hardware, preset),
+                        self.acceleration, self.report_fallback)
+            except BaseException:
+                # 不留下处理了一半的文件
+                if os.path.exists(output_video):
+                    os.remove(output_video)
+                raise
+            finally:
+                if preset:
+                    self.planner.finish(i)
+            telemetry.add_ffmpeg('remux' if copy_video else 'encode', time.perf_counter() - start, job,
+                                 encoder=None if copy_video else self.video_encoder(hardware), duration=duration,
+                                 **({'preset': preset} if preset else {}))
+            if self.clip_cache:
+                output_video = self.clip_cache.store(key, output_video)
+            status = 'ok'
+            self.report_clip_progress(i, 1.0)
+            return output_video
+        except JobCancelled:
+            status = 'cancelled'
+            raise
+        finally:
+            if self.planner and not preset:
+                # 直接复制、取自缓存或不用 x264 编码的视频不占用截止时间前的编码时间
+                self.planner.skip(i)
+            publish_telemetry(self, telemetry, status)
+
+    def clip_settings(self, watermark):
+        """ Everything besides the input content that affects a normalized clip """
+        _, encoder, preset = encoding_plan(self.acceleration)
+        if self.deadline and encoder == 'libx264':
+            # 按截止时间选择的预设每次不同，这些视频彼此复用
+            preset = 'deadline'
+        return json.dumps({
+            'profile': BROADCAST_PROFILE,
+            # 缓存的水印文件名中包含原图的哈希值
+            'watermark': os.path.basename(watermark) if watermark else None,
+            'encoder': encoder,
+            'crf': 23,
+            'preset': preset,
+            'audio_bitrate': '128k',
+            'smart_copy': self.smart_copy,
+        }, sort_keys=True)
+
+    def video_encoder(self, hardware=True):
+        """ The H.264 encoder used for the chosen acceleration; hardware=False gives the CPU fallback """
+        return encoding_plan(self.acceleration, hardware)[1]
+
+    def report_fallback(self, message):
+        self.progress_update.emit(0, 100, message)
+
+    def start_deadline_plan(self, total_clips):
+        """ Start planning presets for total_clips clips if a deadline is set """
+        if self.deadline:
+            self.planner = DeadlinePresetPlanner(self.deadline, self.jobs, total_clips)
+            finish_by = datetime.fromtimestamp(self.deadline).strftime('%H:%M')
+            self.progress_update.emit(0, 100, f"将在 {finish_by} 前完成，编码预设按实测速度调整")
+        self._announced_preset = None
+
+    def announce_preset(self, preset):
+        with self._progress_lock:
+            if preset == self._announced_preset:
+                return
+            self._announced_preset = preset
+        self.report_status(f"按截止时间选择编码预设: {preset}")
+
+    def report_status(self, message):
+        """ Show a message without moving the progress bar """
+        overall_progress = int(sum(self.clip_progress) / len(self.clip_progress) * 100) if self.clip_progress else 0
+        self.progress_update.emit(overall_progress, 100, message)
+
+    def build_normalize_args(self, input_video, output_video, threads, watermark=None, copy_video=False, copy_audio=False, hardware=True, preset=None, input_format=None):
+        """ FFmpeg arguments that bring one clip to the broadcast profile; preset overrides the x264 preset """
+        hwaccel, encoder, default_preset = encoding_plan(self.acceleration, hardware)
+        preset = preset if preset and encoder == 'libx264' else default_preset
+        ffmpeg_args = [ffmpeg_path, '-y']
+        # -hwaccel 是输入选项，必须放在 -i 之前；只复制画面时不需要解码
+        if hwaccel and not copy_video:
+            ffmpeg_args.extend(['-hwaccel', hwaccel])
+        if input_format:
+            ffmpeg_args.extend(['-f', input_format])
+        ffmpeg_args.extend(['-i', input_video])
+
+        if copy_video:
+            ffmpeg_args.extend(['-map', '0:v:0', '-c:v', 'copy'])
+        else:
+            filter_complex = []
+
+            filter_complex.append(f"[0:v]scale={BROADCAST_PROFILE['width']}:{BROADCAST_PROFILE['height']},fps={BROADCAST_PROFILE['fps']},setsar=1[scaled]")
+
+            if watermark:
+                # 水印图片已经预先缩放到目标高度
+                ffmpeg_args.extend(['-i', watermark])
+                margin = int(WATERMARK_HEIGHT * 0.5)
+                filter_complex.append(f'[scaled][1:v]overlay=W-w-{margin}:{margin}[out]')
+            else:
+                filter_complex.append('[scaled]copy[out]')
+
+            ffmpeg_args.extend([
+                '-filter_complex', ';'.join(filter_complex),
+                '-map', '[out]',
+                '-c:v', encoder,
+                '-crf', '23',
+                '-preset', preset,
+                '-pix_fmt', BROADCAST_PROFILE['pix_fmt'],
+                '-threads', str(threads),
+            ])
+            if encoder in PROFILE_LEVEL_ENCODERS:
+                # 与直接复制的视频保持相同的档次和级别，拼接后才能正常解码
+                ffmpeg_args.extend(['-profile:v', BROADCAST_PROFILE['video_profile'].lower(), '-level:v', f"{BROADCAST_PROFILE['level'] / 10:.1f}"])
+
+        ffmpeg_args.extend(['-map', '0:a'])
+        if copy_audio:
+            ffmpeg_args.extend(['-c:a', 'copy'])
+        else:
+            ffmpeg_args.extend([
+                '-c:a', 'aac',
+                '-b:a', '128k',
+                '-ar', str(BROADCAST_PROFILE['sample_rate']),
+                '-ac', str(BROADCAST_PROFILE['channels']),
+            ])
+        ffmpeg_args.extend(['-video_track_timescale', str(BROADCAST_PROFILE['timescale']), output_video])
+        return ffmpeg_args
+
+    def build_ingest_args(self, input_stream, output_video, threads, watermark=None, raw_file=None, hardware=True, input_format=None, preset=None):
+        """ FFmpeg arguments that normalize a stream while it downloads, optionally stream-copying it to raw_file in the same run """
+        ffmpeg_args = self.build_normalize_args(input_stream, output_video, threads, watermark, hardware=hardware, preset=preset, input_format=input_format)
+        if raw_file:
+            # 第二个输出：与普通下载相同的原始文件，不重新编码
+            ffmpeg_args.extend(['-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-bsf:a', 'aac_adtstoasc', raw_file])
+        return ffmpeg_args
+
+    def run_ffmpeg(self, ffmpeg_args, duration, progress_callback=None):
+        """ Run one FFmpeg job that cancel() can stop, passing its progress dicts to progress_callback; returns the finished job """
+        job = FFmpegJob(ffmpeg_args, duration, progress_callback, supervisor=self.supervisor)
+        with self._progress_lock:
+            if self.cancelled:
+                raise JobCancelled("任务已取消")
+            self._jobs.add(job)
+        try:
+            job.run()
+        finally:
+            with self._progress_lock:
+                self._jobs.discard(job)
+        return job
+
+    def prepare_asset(self, path, threads):
+        """ Return a copy of the intro/outro that matches the broadcast profile, normalizing it at most once """
+        info = self.catalog.probe(path)
+        if not info:
+            raise Exception(f"无法读取视频信息: {path}")
+        video_matches, audio_matches = matches_broadcast_profile(info)
+        if video_matches and audio_matches:
+            return path
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        cached_file = os.path.join(self.asset_cache_dir, f"{name}_{file_digest(path, json.dumps(BROADCAST_PROFILE, sort_keys=True))}.mp4")
+        if not os.path.exists(cached_file):
+            os.makedirs(self.asset_cache_dir, exist_ok=True)
+            temp_file = cached_file + '.part.mp4'
+            run_with_cpu_fallback(lambda args: self.run_ffmpeg(args, 0), lambda hardware: self.build_normalize_args(path, temp_file, threads, None, video_matches, audio_matches, hardware),
+                                  self.acceleration, self.report_fallback)
+            os.replace(temp_file, cached_file)
+        return cached_file
+
+    def prepare_watermark(self):
+        """ Return the watermark scaled to its on-screen height, cached by the hash of the source image """
+        cached_file = os.path.join(self.asset_cache_dir, f"logo_{WATERMARK_HEIGHT}_{file_digest(self.watermark_image)}.png")
+        if not os.path.exists(cached_file):
+            os.makedirs(self.asset_cache_dir, exist_ok=True)
+            temp_file = cached_file + '.part.png'
+            self.run_ffmpeg([ffmpeg_path, '-y', '-i', self.watermark_image, '-vf', f'scale=-1:{WATERMARK_HEIGHT}', temp_file], 0)
+            os.replace(temp_file, cached_file)
+        return cached_file
+
+    def report_clip_progress(self, i, fraction, speed=None):
+        with self._progress_lock:
+            self.clip_progress[i] = fraction
+            total_videos = len(self.clip_progress)
+            finished = sum(1 for p in self.clip_progress if p >= 1.0)
+            overall_progress = int(sum(self.clip_progress) / total_videos * 100)
+            # 多个编码任务同时汇报时合并成固定频率的界面更新
+            if not self._emit_limiter.ready(force=fraction >= 1.0):
+                return
+        message = f"处理视频 已完成 {finished}/{total_videos}，总进度: {overall_progress}%"
+        if speed:
+            message += f"，编码速度 {speed:.2f}x"
+        self.progress_update.emit(overall_progress, 100, message)
+
+    def terminate_processes(self):
+        with self._progress_lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+
+    def cancel(self):
+        """ Stop every FFmpeg job of this merge; run() then reports the cancellation """
+        with self._progress_lock:
+            self.cancelled = True
+        self.terminate_processes()
+
+CONVERSION_RESOLUTIONS = {
+    '720p': '1280:720',
+    '480p': '854:480',
+    '320p': '480:320',
+}
+# 两个校区每天需要的格式：汇北校区 720p MPG，新街校区 480p MPG
+CAMPUS_TARGETS = [('720p', 'mpg'), ('480p', 'mpg')]
+
+# 分段并行转换：把长视频在关键帧处切成几段同时编码，mpeg2video/mpeg4 编码器自身用不满多核
+DEFAULT_CONVERSION_CHUNKS = max(1, min(8, (os.cpu_count() or 2) // 2))
+# 每段至少这么长，更短的视频整体转换
+CHUNK_MIN_SECONDS = 60
+# 拼接结果与原视频的画面、声音时长和音画偏移允许的误差（秒）
+CHUNK_SYNC_TOLERANCE = 0.1
+
+def conversion_output_file(input_file, resolution, format):
+    return os.path.splitext(input_file)[0] + f"_{resolution}.{format}"
+
+def stream_extents(path):
+    """ Map 'video' and 'audio' to (start, end) in seconds of the first stream of each type, from its packet timestamps """
+    info = probe_media(path)
+    if not info:
+        return None
+    kinds = {}
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') in ('video', 'audio') and stream.get('codec_type') not in kinds.values():
+            kinds[stream['index']] = stream['codec_type']
+    packets = subprocess.run([ffprobe_path, '-v', 'error', '-show_entries', 'packet=stream_index,pts_time,duration_time', '-of', 'compact=p=0', path],
+                             capture_output=True, text=True, creationflags=NO_WINDOW)
+    if packets.returncode != 0:
+        return None
+    extents = {}
+    for line in packets.stdout.splitlines():
+        fields = dict(field.partition('=')[::2] for field in line.split('|'))
+        kind = kinds.get(int(fields.get('stream_index', -1)))
+        pts = parse_float(fields.get('pts_time'))
+        if kind is None or pts is None:
+            continue
+        end = pts + (parse_float(fields.get('duration_time')) or 0.0)
+        start, last = extents.get(kind, (pts, end))
+        extents[kind] = (min(start, pts), max(last, end))
+    return extents
+
+def timing_mismatch(expected, actual, tolerance=CHUNK_SYNC_TOLERANCE):
+    """ Describe how a converted file's video/audio timing differs from its source, or None if it matches """
+    if not expected or not actual:
+        return "无法读取时间戳"
+    names = {'video': '画面', 'audio': '声音'}
+    for kind, name in names.items():
+        if (kind in expected) != (kind in actual):
+            return f"{name}流缺失"
+        if kind in expected:
+            want = expected[kind][1] - expected[kind][0]
+            got = actual[kind][1] - actual[kind][0]
+            if abs(want - got) > tolerance:
+                return f"{name}时长 {got:.3f}s，原视频 {want:.3f}s"
+    if len(expected) == 2:
+        want = expected['audio'][0] - expected['video'][0]
+        got = actual['audio'][0] - actual['video'][0]
+        if abs(want - got) > tolerance:
+            return f"音画偏移 {got:+.3f}s，原视频 {want:+.3f}s"
+    return None
+
+class ConversionWorker:
+    progress_update = Signal('current', 'total', 'message')
+    conversion_complete = Signal('output_file')
+    error_occurred = Signal('message')
+    telemetry_recorded = Signal('record')
+
+    def __init__(self, input_file, output_file, resolution, format, acceleration, priority=PRIORITY_BELOW_NORMAL, cpu_affinity=None, extra_targets=(),
+                 chunks=DEFAULT_CONVERSION_CHUNKS):
+        super().__init__()
+        self.supervisor = ProcessSupervisor(priority, cpu_affinity)
+        self.input_file = input_file
+        self.output_file = output_file
+        self.resolution = resolution
+        self.format = format
+        self.acceleration = acceleration
+        # 额外的 (分辨率, 格式)，与主输出在同一次 FFmpeg 运行中生成，输入只解码一次
+        self.targets = [(output_file, resolution, format)]
+        for extra_resolution, extra_format in extra_targets:
+            if (extra_resolution, extra_format) != (resolution, format):
+                self.targets.append((conversion_output_file(input_file, extra_resolution, extra_format), extra_resolution, extra_format))
+        # 同时编码的段数，1 表示整体转换
+        self.chunks = max(1, chunks)
+        self.job = None
+        self._jobs = set()
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self.telemetry_log = TelemetryLog()
+
+    @property
+    def output_files(self):
+        return [output_file for output_file, _, _ in self.targets]
+
+    def run(self):
+        try:
+            if self.convert():
+                for output_file in self.output_files:
+                    self.conversion_complete.emit(output_file)
+            else:
+                self.error_occurred.emit("转换过程中出错")
+
+        except JobCancelled:
+            self.error_occurred.emit("已取消转换")
+        except Exception as e:
+            self.error_occurred.emit(f"发生错误: {str(e)}")
+        finally:
+            self.supervisor.close()
+
+    def convert(self):
+        """ Run the conversion, returning whether FFmpeg succeeded """
+        telemetry = JobTelemetry('convert', self.input_file)
+        status = 'failed'
+        try:
+            if self.encode(telemetry):
+                status = 'ok'
+                return True
+            return False
+        except JobCancelled:
+            status = 'cancelled'
+            raise
+        finally:
+            publish_telemetry(self, telemetry, status, output=self.output_files if len(self.targets) > 1 else self.output_file)
+
+    def encode(self, telemetry):
+        with telemetry.stage('probe'):
+            duration = MediaCatalog().duration(self.input_file)
+        if duration is None:
+            raise Exception(f"无法读取视频信息: {self.input_file}")
+
+        # 在第一个 FFmpeg 任务开始前取消时，不再切分或转换
+        self.check_cancelled()
+        if self.should_chunk(duration):
+            try:
+                if self.encode_chunked(duration, telemetry):
+                    return True
+            except subprocess.CalledProcessError as e:
+                self.check_cancelled()
+                self.progress_update.emit(0, 100, f"分段转换出错，改为整体转换: {''.join((e.stderr or '').strip().splitlines()[-1:])}")
+
+        def report(progress):
+            percent = int((progress['fraction'] or 0.0) * 100)
+            outputs = f" ({len(self.targets)} 个格式同时输出)" if len(self.targets) > 1 else ''
+            self.progress_update.emit(percent, 100, f"转换进度{outputs}: {percent}%{format_speed(progress)}")
+
+        def run(command):
+            self.job = self.run_job(command, duration, report)
+            return self.job
+
+        self.check_cancelled()
+        start = time.perf_counter()
+        try:
+            run_with_cpu_fallback(run, self.build_command, self.acceleration, lambda message: self.progress_update.emit(0, 100, message))
+        except subprocess.CalledProcessError:
+            return False
+        finally:
+            if self.job:
+                # 记录实际使用的编码器（硬件编码失败时为 CPU 编码器）
+                encoders = ','.join(arg for previous, arg in zip(self.job.command, self.job.command[1:]) if previous == '-c:v')
+                telemetry.add_ffmpeg('encode', time.perf_counter() - start, self.job, encoder=encoders, outputs=len(self.targets), duration=duration)
+        return True
+
+    def run_job(self, command, duration=None, progress_callback=None):
+        """ Run one FFmpeg job that cancel() can stop; returns the finished job """
+        job = FFmpegJob(command, duration, progress_callback, supervisor=self.supervisor)
+        with self._lock:
+            self.check_cancelled()
+            self._jobs.add(job)
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._jobs.discard(job)
+        return job
+
+    def report_status(self, message):
+        # 与切分、改用 CPU 编码等提示一样，进度显示为 0
+        self.progress_update.emit(0, 100, message)
+
+    def check_cancelled(self):
+        """ Raise JobCancelled once cancel() has been called """
+        if self.cancelled:
+            raise JobCancelled("任务已取消")
+
+    def should_chunk(self, duration):
+        """ Whether to encode in parallel chunks: long enough, and only CPU encoders (graphics cards are fast enough whole) """
+        return (self.chunks > 1 and duration >= 2 * CHUNK_MIN_SECONDS
+                and not any(self.codecs(format)[0] in HARDWARE_ENCODERS.values() for _, _, format in self.targets))
+
+    def encode_chunked(self, duration, telemetry):
+        """ Split the video at keyframes, encode the pieces in parallel and stitch them with a stream-copy concat
+
+        The audio is encoded once from the whole input while stitching, so it can't drift at the joins.
+        Returns False if the result's timing doesn't match the input; the caller then converts in one pass.
+        """
+        count = min(self.chunks, int(duration // CHUNK_MIN_SECONDS))
+        work_dir = tempfile.mkdtemp(prefix='chunks_', dir=os.path.dirname(os.path.abspath(self.output_file)))
+        try:
+            self.progress_update.emit(0, 100, f"在关键帧处把视频分为 {count} 段...")
+            with telemetry.stage('split', chunks=count):
+                # 只复制数据流，切分点落在每个时间之后的第一个关键帧
+                split_times = ','.join(f'{duration * k / count:.3f}' for k in range(1, count))
+                self.run_job([ffmpeg_path, '-y', '-i', self.input_file, '-map', '0:v:0', '-c', 'copy', '-f', 'segment', '-segment_times', split_times,
+                              '-segment_format', 'matroska', '-reset_timestamps', '1', os.path.join(work_dir, 'source_%03d.mkv')])
+            sources = sorted(os.path.join(work_dir, name) for name in os.listdir(work_dir) if name.startswith('source_'))
+            if len(sources) < 2:
+                # 关键帧太少，切不开
+                return False
+
+            chunk_outputs = [[os.path.join(work_dir, f'chunk_{k:03d}_{i}.mkv') for i in range(len(self.targets))] for k in range(len(sources))]
+            threads = max(1, (os.cpu_count() or 1) // len(sources))
+            out_times = [0.0] * len(sources)
+            limiter = RateLimiter()
+
+            def report(k, progress):
+                with self._lock:
+                    out_times[k] = progress['out_time']
+                    if not limiter.ready():
+                        return
+                    percent = int(min(sum(out_times) / duration, 1.0) * 95)
+                self.progress_update.emit(percent, 100, f"分段转换 ({len(sources)} 段同时编码): {percent}%")
+
+            encoders = ','.join(self.codecs(format, False)[0] for _, _, format in self.targets)
+            with telemetry.stage('encode', chunks=len(sources), encoder=encoders, outputs=len(self.targets), duration=duration) as fields:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+                    futures = [executor.submit(self.run_job, self.build_chunk_command(source, outputs, threads), None, partial(report, k))
+                               for k, (source, outputs) in enumerate(zip(sources, chunk_outputs))]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    except BaseException:
+                        self.terminate_jobs()
+                        raise
+                fields['speed'] = round(duration / max(time.perf_counter() - start, 0.001), 2)
+
+            self.progress_update.emit(95, 100, "拼接各段并编码声音...")
+            with telemetry.stage('stitch'):
+                for i, (output_file, _, format) in enumerate(self.targets):
+                    list_file = os.path.join(work_dir, f'list_{i}.txt')
+                    with open(list_file, 'w') as f:
+                        for outputs in chunk_outputs:
+                            f.write(f"file '{outputs[i]}'\n")
+                    self.run_job([ffmpeg_path, '-y', '-f', 'concat', '-safe', '0', '-i', list_file, '-i', self.input_file,
+                                  '-map', '0:v:0', '-map', '1:a:0?', '-c:v', 'copy', '-c:a', self.codecs(format, False)[1], '-b:a', '192k', output_file])
+
+            with telemetry.stage('verify'):
+                expected = stream_extents(self.input_file)
+                for output_file in self.output_files:
+                    problem = timing_mismatch(expected, stream_extents(output_file))
+                    if problem:
+                        self.progress_update.emit(0, 100, f"分段转换的结果与原视频不一致（{problem}），改为整体转换")
+                        return False
+            return True
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def build_chunk_command(self, source, outputs, threads):
+        """ Encode the video of one chunk to every target, without audio """
+        command = [ffmpeg_path, '-y', '-i', source, '-filter_complex', self.filter_graph()]
+        for i, (_, _, format) in enumerate(self.targets):
+            command.extend(['-map', f'[out{i}]', '-c:v', self.codecs(format, False)[0], '-b:v', '4M', '-threads', str(threads), outputs[i]])
+        return command
+
+    def codecs(self, format, hardware=True):
+        """ Return the (video, audio) encoders for a target format; AVI uses the graphics card's H.264 encoder when it works """
+        video_codec = 'mpeg2video' if format == 'mpg' else 'mpeg4'
+        if format != 'mpg':
+            _, encoder, _ = encoding_plan(self.acceleration, hardware)
+            if encoder in HARDWARE_ENCODERS.values():
+                video_codec = encoder
+        return video_codec, 'mp2' if format == 'mpg' else 'mp3'
+
+    def filter_graph(self):
+        """ Split the decoded video into one scale per size, each feeding [outN] for every format of that size """
+        sizes = list(dict.fromkeys(resolution for _, resolution, _ in self.targets))
+        filter_complex = []
+        if len(sizes) > 1:
+            filter_complex.append(f"[0:v]split={len(sizes)}" + ''.join(f'[size{k}]' for k in range(len(sizes))))
+        for k, size in enumerate(sizes):
+            source = f'[size{k}]' if len(sizes) > 1 else '[0:v]'
+            outputs = [f'[out{i}]' for i, (_, resolution, _) in enumerate(self.targets) if resolution == size]
+            scale = f"{source}scale={CONVERSION_RESOLUTIONS.get(size, CONVERSION_RESOLUTIONS['320p'])}"
+            filter_complex.append(f"{scale},split={len(outputs)}{''.join(outputs)}" if len(outputs) > 1 else f"{scale}{outputs[0]}")
+        return ';'.join(filter_complex)
+
+    def build_command(self, hardware=True):
+        """ Decode the input once and encode every target from it """
+        hwaccel, _, _ = encoding_plan(self.acceleration, hardware)
+        command = [ffmpeg_path]
+        # -hwaccel 是输入选项，必须放在 -i 之前
+        if hwaccel:
+            command.extend(['-hwaccel', hwaccel])
+        command.extend([
+            '-i', self.input_file,
+            '-filter_complex', self.filter_graph(),
+            '-y',
+        ])
+        for i, (output_file, _, format) in enumerate(self.targets):
+            video_codec, audio_codec = self.codecs(format, hardware)
+            command.extend([
+                '-map', f'[out{i}]',
+                '-map', '0:a:0?',
+                '-c:v', video_codec,
+                '-c:a', audio_codec,
+                '-b:v', '4M',
+                '-b:a', '192k',
+                output_file
+            ])
+        return command
+
+    def terminate_jobs(self):
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+        self.terminate_jobs()
+
+class PipelineWorker:
+    """ Download, normalize, merge and convert in one go, normalizing each clip as soon as it arrives
+
+    The stage workers are the regular download, merge and conversion workers; their signals are
+    emitted as usual, so the GUI can connect them to the same handlers as the separate tabs.
+    """
+    stage_changed = Signal('message')
+    pipeline_complete = Signal('output_file')
+    error_occurred = Signal('message')
+    telemetry_recorded = Signal('record')
+    converter_class = ConversionWorker
+
+    def __init__(self, downloader, merger, resolution, format, extra_targets=(), chunks=DEFAULT_CONVERSION_CHUNKS, ingest=False, keep_raw=True):
+        super().__init__()
+        self.downloader = downloader
+        self.merger = merger
+        # 央视视频边下载边处理成播出规格，keep_raw 决定是否同时保存原始文件
+        self.ingest = ingest
+        self.keep_raw = keep_raw
+        self.resolution = resolution
+        self.format = format
+        self.output_file = merged_output_file(merger.folder, merger.output_mode)
+        converted_file = conversion_output_file(self.output_file, resolution, format)
+        self.converter = self.converter_class(self.output_file, converted_file, resolution, format, merger.acceleration, extra_targets=extra_targets, chunks=chunks)
+        self.telemetry_log = TelemetryLog()
+
+    def report_status(self, message):
+        self.stage_changed.emit(message)
+
+    def run(self):
+        urls = self.downloader.urls
+        total_videos = len(urls)
+        merger = self.merger
+        temp_dir = os.path.join(merger.folder, 'temp_processed')
+        threads = max(1, (os.cpu_count() or 1) // merger.jobs)
+        processed = [None] * total_videos
+        merger.clip_progress = [0.0] * total_videos
+        merger.start_deadline_plan(total_videos)
+        telemetry = JobTelemetry('pipeline', merger.folder)
+        status = 'failed'
+
+        try:
+            self.stage_changed.emit("下载并处理视频...")
+            os.makedirs(temp_dir, exist_ok=True)
+            progressive = merger.start_progressive_output(self.output_file, temp_dir, total_videos)
+            first_clip = 1 if merger.add_intro else 0
+            intro = None
+            with telemetry.stage('prepare'):
+                watermark = merger.prepare_watermark() if merger.watermark_image else None
+                # 边处理边写入时先写好片头，第一个视频处理完就可以开始播放
+                if progressive and merger.add_intro:
+                    intro = merger.prepare_asset(intro_path, threads)
+            if intro:
+                progressive.add(0, intro)
+            if self.ingest:
+                self.downloader.enable_ingest(merger, threads, watermark, self.keep_raw)
+            append_errors = []
+
+            def output_clip(index):
+                """ Pass a finished or failed clip to the progressive output, which writes it in playout order """
+                if not progressive:
+                    return
+                try:
+                    progressive.add(first_clip + index, processed[index])
+                except Exception as e:
+                    append_errors.append(e)
+
+            # 队列满时下载线程会等待，处理跟不上时不再开始新的下载
+            ready = queue.Queue(maxsize=merger.jobs)
+
+            def normalize_worker():
+                while True:
+                    # 处理线程空等下载的时间长，说明瓶颈在下载
+                    with telemetry.stage('normalizer_idle', concurrent=True):
+                        item = ready.get()
+                    if item is None:
+                        return
+                    index, input_video = item
+                    output_video = os.path.join(temp_dir, f"processed_{index}.mp4")
+                    try:
+                        processed[index] = merger.normalize_clip(index, input_video, output_video, threads, watermark)
+                    except Exception as e:
+                        merger.report_clip_progress(index, 1.0)
+                        merger.error_occurred.emit(f"处理视频时出错 {input_video}: {e}")
+                    output_clip(index)
+
+            def skip_clip(index):
+                """ Count a clip that won't be normalized here as done, so the deadline plan and later clips don't wait for it """
+                if merger.planner:
+                    merger.planner.skip(index)
+                merger.report_clip_progress(index, 1.0)
+                output_clip(index)
+
+            def download_worker(index, url):
+                input_video = self.downloader.process_url(url, index + 1, total_videos)
+                if self.downloader.is_ingested(input_video):
+                    # 下载时已经处理成播出规格
+                    processed[index] = input_video
+                    skip_clip(index)
+                elif input_video and os.path.exists(input_video):
+                    # 下载线程等待队列空位的时间长，说明瓶颈在处理
+                    with telemetry.stage('queue_full_wait', concurrent=True):
+                        ready.put((index, input_video))
+                else:
+                    skip_clip(index)
+
+            normalizers = [threading.Thread(target=normalize_worker, daemon=True) for _ in range(merger.jobs)]
+            for worker in normalizers:
+                worker.start()
+            download_start = time.perf_counter()
+            try:
+                with ThreadPoolExecutor(max_workers=min(self.downloader.max_workers, total_videos) or 1) as executor:
+                    futures = {executor.submit(download_worker, i, url): i for i, url in enumerate(urls)}
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            self.downloader.error_occurred.emit(f"下载过程中发生错误: {e}")
+                            skip_clip(futures[future])
+                self.downloader.all_downloads_complete.emit()
+            finally:
+                for _ in normalizers:
+                    ready.put(None)
+                for worker in normalizers:
+                    worker.join()
+                telemetry.add('download_normalize', time.perf_counter() - download_start)
+
+            clips = [path for path in processed if path]
+            if not clips:
+                raise Exception("没有成功下载并处理的视频")
+            if append_errors:
+                raise append_errors[0]
+
+            # 按输入链接的顺序播出
+            self.stage_changed.emit("合并视频...")
+            processed_files = []
+            with telemetry.stage('prepare'):
+                if merger.add_intro:
+                    processed_files.append(intro or merger.prepare_asset(intro_path, threads))
+                processed_files.extend(clips)
+                if merger.add_ending:
+                    processed_files.append(merger.prepare_asset(outro_path, threads))
+            if merger.clip_cache:
+                merger.clip_cache.evict(keep=processed_files)
+            if progressive:
+                if merger.add_ending:
+                    progressive.add(first_clip + total_videos, processed_files[-1])
+                progressive.finish()
+                telemetry.add('append', progressive.seconds, clips=progressive.appended)
+            else:
+                start = time.perf_counter()
+                job = merger.concat_files(processed_files, self.output_file, temp_dir)
+                telemetry.add_ffmpeg('concat', time.perf_counter() - start, job)
+            merger.merge_complete.emit(self.output_file)
+
+            self.stage_changed.emit("转换格式...")
+            # 转换另有单独的统计记录
+            with telemetry.stage('convert'):
+                converted = self.converter.convert()
+            if not converted:
+                raise Exception("转换过程中出错")
+            status = 'ok'
+            for output_file in self.converter.output_files:
+                self.converter.conversion_complete.emit(output_file)
+            self.pipeline_complete.emit(self.converter.output_file)
+
+        except subprocess.CalledProcessError as e:
+            self.error_occurred.emit(f"处理视频时出错: {e}")
+        except Exception as e:
+            self.error_occurred.emit(f"发生错误: {e}")
+        finally:
+            publish_telemetry(self, telemetry, status, clips=total_videos)
+            self.downloader.close_ytdlp_sessions()
+            # 下载由流水线直接调用，不经过 DownloadWorker.run，这里写入还没保存的分片记录，失败或取消的视频可以续传
+            self.downloader.manifest.flush()
+            for supervisor in (self.downloader.supervisor, merger.supervisor, self.converter.supervisor):
+                supervisor.close()
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir, ignore_errors=True)
@@ -1,431 +1,73 @@
 import sys
-import requests
-from bs4 import BeautifulSoup
-import re
 import os
-import shutil
-import psutil
-from urllib.parse import urljoin
-import urllib
 import subprocess
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPlainTextEdit, QTextEdit, QPushButton, QProgressBar, QComboBox, QFileDialog, QTabWidget, QCheckBox, QDesktopWidget, QMenuBar, QAction, QMessageBox
+import json
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPlainTextEdit, QTextEdit, QPushButton, QProgressBar, QComboBox, QFileDialog, QTabWidget, QCheckBox, QDesktopWidget, QMenuBar, QAction, QMessageBox, QSpinBox, QTableWidget, QTableWidgetItem, QHeaderView, QTimeEdit
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import QThread, pyqtSignal, QProcess
-from datetime import datetime
-import yt_dlp
-
-def resource_path(relative_path):
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-
-    return os.path.join(base_path, relative_path)
-
-ffmpeg_path = resource_path("ffmpeg/ffmpeg.exe")
-ffprobe_path = resource_path("ffmpeg/ffprobe.exe")
-logo_path = resource_path("assets/logo.png")
-intro_path = resource_path("assets/intro.mp4")
-outro_path = resource_path("assets/outro.mp4")
-seal_path = resource_path("zgyz_seal.ico")
-
-class DownloadThread(QThread):
+from PyQt5.QtCore import QThread, QTime, pyqtSignal
+from engine import (DownloadWorker, MergeWorker, ConversionWorker, PipelineWorker, CapabilityProbeWorker, CCTV_CDN_HOSTS, CDN_AUTO_LABEL, DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+                    ACCELERATIONS, MERGE_MODES, MERGE_OUTPUTS, DEFAULT_MERGE_JOBS, DEFAULT_CONVERSION_CHUNKS, deadline_from_clock, missing_merge_asset, logo_path, seal_path, TELEMETRY_PATH, summarize_telemetry,
+                    CAMPUS_TARGETS, conversion_output_file)
+
+# 界面使用的线程：任务逻辑在 engine.py 中，这里把信号换成 pyqtSignal，跨线程安全地更新界面
+class DownloadThread(DownloadWorker, QThread):
     progress_update = pyqtSignal(int, int, int, int)
     download_complete = pyqtSignal(str)
     all_downloads_complete = pyqtSignal()
     error_occurred = pyqtSignal(str)
+    status_message = pyqtSignal(str)
+    telemetry_recorded = pyqtSignal(dict)
 
-    def __init__(self, urls, cdnurl):
-        super().__init__()
-        self.urls = urls
-        self.cdnurl = cdnurl
-
-    def run(self):
-        for i, url in enumerate(self.urls):
-            if 'cctv.cn' in url or 'cctv.com' in url:
-                guid, m3u8_url, title = self.get_webpage_extract_guid_and_generate_m3u8_url(url)
-                if guid and m3u8_url:
-                    self.download_and_process_m3u8(guid, m3u8_url, i+1, len(self.urls), title)
-                else:
-                    self.error_occurred.emit(f"无法获取 GUID 或生成 m3u8 URL: {url}")
-            else:
-                self.download_with_ytdlp(url, i+1, len(self.urls))
-        
-        # 所有下载完成后发送信号
-        self.all_downloads_complete.emit()
-
-    def download_with_ytdlp(self, url, current_video, total_videos):
-        base_dir = os.path.join(os.getcwd(), datetime.now().strftime("%Y-%m-%d"))
-        os.makedirs(base_dir, exist_ok=True)
-
-        ydl_opts = {
-            'format': 'bestvideo+bestaudio/best',
-            'outtmpl': os.path.join(base_dir, '%(title)s.%(ext)s'),
-            'merge_output_format': 'mp4',
-            'ffmpeg_location':ffmpeg_path,
-            'progress_hooks': [lambda d: self.ytdlp_progress_hook(d, current_video, total_videos)],
-        }
-
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            self.download_complete.emit(f"Downloaded video from {url}")
-        except Exception as e:
-            self.error_occurred.emit(f"Error downloading {url}: {str(e)}")
-
-    def ytdlp_progress_hook(self, d, current_video, total_videos):
-        if d['status'] == 'downloading':
-            percent = d.get('_percent_str', '0%')
-            # 移除 ANSI 颜色代码
-            percent = re.sub(r'\x1b\[[0-9;]*m', '', percent)
-            percent = percent.replace('%', '').strip()
-            try:
-                progress = float(percent)
-                self.progress_update.emit(current_video, total_videos, int(progress), 100)
-            except ValueError:
-                # 如果无法转换为浮点数，就不更新进度
-                pass
-        elif d['status'] == 'finished':
-            self.progress_update.emit(current_video, total_videos, 100, 100)
-
-    def get_webpage_extract_guid_and_generate_m3u8_url(self, url):
-        try:
-            response = requests.get(url, proxies={'http': None, 'https': None})
-            response.encoding = 'utf-8'  # 明确指定编码为 UTF-8
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                guid_pattern = r'var\s+guid(?:_0)?\s*=\s*"([^"]+)"'
-                video_center_id_pattern = r'videoCenterId:\s*"([^"]+)"'
-                title_pattern = r"var\s+(?:share|comment)Title\s*=\s*['\"]([^'\"]+)['\"];"
-                
-                script_tags = soup.find_all('script')
-                guid = None
-                video_center_id = None
-                title = None
-
-                for script in script_tags:
-                    if script.string:
-                        guid_match = re.search(guid_pattern, script.string)
-                        if guid_match:
-                            guid = guid_match.group(1)
-                        
-                        title_match = re.search(title_pattern, script.string)
-                        if title_match:
-                            title = title_match.group(1)
-
-                if not guid:
-                    video_center_id_match = re.search(video_center_id_pattern, response.text)
-                    if video_center_id_match:
-                        video_center_id = video_center_id_match.group(1)
-
-                if guid:
-                    m3u8_url = f"https://{self.cdnurl}/asp//hls/2000/0303000a/3/default/{guid}/2000.m3u8"
-                elif video_center_id:
-                    m3u8_url = f"https://{self.cdnurl}/asp//hls/2000/0303000a/3/default/{video_center_id}/2000.m3u8"
-                else:
-                    return None, None, None
-
-                return guid or video_center_id, m3u8_url, title
-
-            return None, None, None
-        except Exception as e:
-            print(f"Error: {e}")
-            return None, None, None
-
-    def download_and_process_m3u8(self, guid, m3u8_url, current_video, total_videos, title):
-        base_dir = os.path.join(os.getcwd(), datetime.now().strftime("%Y-%m-%d"))
-        os.makedirs(base_dir, exist_ok=True)
-        
-        # 使用 GUID 作为临时文件名
-        temp_filename = f"{guid}.mp4"
-        temp_output_file = os.path.join(base_dir, temp_filename)
-
-        ffmpeg_command = [
-            ffmpeg_path,
-            "-i", m3u8_url,
-            "-c", "copy",
-            temp_output_file,
-            "-y"
-        ]
-
-        try:
-            process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-            duration_regex = re.compile(r"Duration: (\d{2}):(\d{2}):(\d{2}\.\d{2})")
-            time_regex = re.compile(r"time=(\d{2}):(\d{2}):(\d{2}\.\d{2})")
-            duration = None
-
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    if not duration:
-                        match = duration_regex.search(output)
-                        if match:
-                            duration = self.time_to_seconds(match.groups())
-
-                    match = time_regex.search(output)
-                    if match and duration:
-                        current_time = self.time_to_seconds(match.groups())
-                        progress = int((current_time / duration) * 100)
-                        self.progress_update.emit(current_video, total_videos, progress, 100)
-
-            if process.returncode == 0:
-                # 下载成功，尝试重命名文件
-                # 下载成功后再命名是为了不让FFmpeg出错
-                if title:
-                    # 解码 URL 编码的字符串并移除非法字符
-                    safe_title = re.sub(r'[\\/*?:"<>|]', "", urllib.parse.unquote(title))
-                    final_filename = f"{safe_title}.mp4"
-                    final_output_file = os.path.join(base_dir, final_filename)
-                    try:
-                        os.rename(temp_output_file, final_output_file)
-                        output_file = final_output_file
-                    except Exception as rename_error:
-                        print(f"重命名文件时出错: {rename_error}")
-                        output_file = temp_output_file
-                else:
-                    output_file = temp_output_file
-
-                # 确保最后一个视频下载完成时显示100%进度
-                self.progress_update.emit(current_video, total_videos, 100, 100)
-                self.download_complete.emit(output_file)
-            else:
-                error_message = f"下载失败: FFmpeg 进程返回错误码 {process.returncode}\n"
-                error_message += f"命令: {' '.join(ffmpeg_command)}\n"
-                self.error_occurred.emit(error_message)
-
-        except Exception as e:
-            error_message = f"下载过程中发生错误: {str(e)}\n"
-            error_message += f"命令: {' '.join(ffmpeg_command)}\n"
-            self.error_occurred.emit(error_message)
-
-        finally:
-            # 确保进程被正确关闭
-            if process.poll() is None:
-                process.terminate()
-                process.wait()
-                
-    def time_to_seconds(self, time_tuple):
-        hours, minutes, seconds = map(float, time_tuple)
-        return hours * 3600 + minutes * 60 + seconds
-
-class MergeThread(QThread):
+class MergeThread(MergeWorker, QThread):
     progress_update = pyqtSignal(int, int, str)
     merge_complete = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
+    telemetry_recorded = pyqtSignal(dict)
 
-    def __init__(self, folder, watermark_image, add_intro, add_ending, acceleration):
-        super().__init__()
-        self.folder = folder
-        self.watermark_image = watermark_image
-        self.add_intro = add_intro
-        self.add_ending = add_ending
-        self.acceleration = acceleration
-
-    def run(self):
-        video_files = [f for f in os.listdir(self.folder) if f.endswith('.mp4')]
-        total_videos = len(video_files)
-        if not video_files:
-            self.error_occurred.emit("所选文件夹中没有找到 MP4 文件")
-            return
-
-        output_file = os.path.join(self.folder, "merged_output.mp4")
-        temp_dir = os.path.join(self.folder, 'temp_processed')
-        os.makedirs(temp_dir, exist_ok=True)
-
-        try:
-            processed_files = []
-            
-            if self.add_intro:
-                processed_files.append(intro_path)
-
-            for i, video in enumerate(video_files):
-                input_video = os.path.join(self.folder, video)
-                output_video = os.path.join(temp_dir, f"processed_{i}.mp4")
-
-                ffmpeg_args = [
-                    '-y',
-                    '-i', input_video,
-                ]
-
-                if self.acceleration == "英伟达（Nvidia）":
-                    ffmpeg_args.extend(['-hwaccel', 'cuda'])
-                elif self.acceleration == "AMD":
-                    ffmpeg_args.extend(['-hwaccel', 'amf'])
-
-                filter_complex = []
-
-                filter_complex.append('[0:v]scale=1280:720,fps=25[scaled]')
-
-                if self.watermark_image:
-                    ffmpeg_args.extend(['-i', self.watermark_image])
-                    watermark_height = int(720 * 0.10)
-                    margin = int(watermark_height * 0.5)
-                    filter_complex.extend([
-                        f'[1:v]scale=-1:{watermark_height}[watermark]',
-                        f'[scaled][watermark]overlay=W-w-{margin}:{margin}[out]'
-                    ])
-                else:
-                    filter_complex.append('[scaled]copy[out]')
-
-                filter_complex =';'.join(filter_complex)
-                ffmpeg_args.extend([
-                    '-filter_complex', filter_complex,
-                    '-map', '[out]',
-                    '-map', '0:a',
-                    '-c:v', 'h264_nvenc' if self.acceleration == "英伟达（Nvidia）" else ('h264_amf' if self.acceleration == "AMD" else 'libx264'),
-                    '-crf', '23',
-                    '-preset', 'medium',
-                    '-c:a', 'aac',
-                    '-b:a', '128k',
-                    output_video
-                ])
-
-                ffmpeg_process = QProcess()
-                ffmpeg_process.setProcessChannelMode(QProcess.MergedChannels)
-                ffmpeg_process.start(ffmpeg_path, ffmpeg_args)
-
-                probe = subprocess.run([ffprobe_path, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_video], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                duration = float(probe.stdout)
-
-                while ffmpeg_process.state() != QProcess.NotRunning:
-                    ffmpeg_process.waitForReadyRead(100)
-                    output = ffmpeg_process.readAllStandardOutput().data().decode()
-                    time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2}\.\d{2})', output)
-                    if time_match:
-                        hours, minutes, seconds = map(float, time_match.groups())
-                        current_time = hours * 3600 + minutes * 60 + seconds
-                        progress = int((current_time / duration) * 100)
-                        overall_progress = int(((i + progress /100) / total_videos) * 100)
-                        self.progress_update.emit(overall_progress,100, f"处理视频 {i+1}/{total_videos}，当前进度: {progress}%")
-
-                if ffmpeg_process.exitCode() != 0:
-                    raise subprocess.CalledProcessError(ffmpeg_process.exitCode(),'ffmpeg')
-
-                processed_files.append(output_video)
-
-            if self.add_ending:
-                processed_files.append(outro_path)
-
-            with open(os.path.join(temp_dir, 'processed_list.txt'), 'w') as f:
-                for file in processed_files:
-                    f.write(f"file '{file}'\n")
-
-            merge_process = QProcess()
-            merge_process.setProcessChannelMode(QProcess.MergedChannels)
-            merge_args = [
-                '-y',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', os.path.join(temp_dir, 'processed_list.txt'),
-                '-c', 'copy',
-                output_file
-            ]
-            if self.acceleration == "英伟达（Nvidia）":
-                merge_args.extend(['-hwaccel', 'cuda'])
-            elif self.acceleration == "AMD":
-                merge_args.extend(['-hwaccel', 'amf'])
-            merge_process.start(ffmpeg_path, merge_args)
-            merge_process.waitForFinished(-1)
-
-            if merge_process.exitCode() != 0:
-                raise subprocess.CalledProcessError(merge_process.exitCode(), 'ffmpeg')
-
-            self.merge_complete.emit(output_file)
-
-        except subprocess.CalledProcessError as e:
-            self.error_occurred.emit(f"处理视频时出错: {e}")
-        except Exception as e:
-            self.error_occurred.emit(f"发生错误: {e}")
-        finally:
-            for proc in psutil.process_iter(['name']):
-                if proc.info['name'] == 'ffmpeg':
-                    proc.kill()
-            
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                self.error_occurred.emit(f"删除临时目录时出错: {e}")
-
-class ConversionThread(QThread):
+class ConversionThread(ConversionWorker, QThread):
     progress_update = pyqtSignal(int, int, str)
     conversion_complete = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
+    telemetry_recorded = pyqtSignal(dict)
 
-    def __init__(self, input_file, output_file, resolution, format, acceleration):
-        super().__init__()
-        self.input_file = input_file
-        self.output_file = output_file
-        self.resolution = resolution
-        self.format = format
-        self.acceleration = acceleration
-
-    def run(self):
-        try:
-            probe = subprocess.run([ffprobe_path, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', self.input_file], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-            duration = float(probe.stdout)
-
-            if self.resolution == '720p':
-                resolution = '1280:720'
-            elif self.resolution == '480p':
-                resolution = '854:480'
-            else:# 320p
-                resolution = '480:320'
-
-            command = [
-                ffmpeg_path,
-                '-i', self.input_file,
-                '-vf', f'scale={resolution}',
-                '-c:v', 'mpeg2video' if self.format == 'mpg' else 'mpeg4',
-                '-c:a', 'mp2' if self.format == 'mpg' else 'mp3',
-                '-b:v', '4M',
-                '-b:a', '192k',
-                '-y',
-                self.output_file
-            ]
-
-            if self.acceleration == "英伟达（Nvidia）":
-                command.extend(['-hwaccel', 'cuda'])
-                if self.format != 'mpg':
-                    command[command.index('-c:v') + 1] = 'h264_nvenc'
-            elif self.acceleration == "AMD":
-                command.extend(['-hwaccel', 'amf'])
-                if self.format != 'mpg':
-                    command[command.index('-c:v') + 1] = 'h264_amf'
-
-            process = subprocess.Popen(command, stderr=subprocess.PIPE, universal_newlines=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-            for line in process.stderr:
-                if 'time=' in line:
-                    time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2}.\d{2})', line)
-                    if time_match:
-                        hours, minutes, seconds = map(float, time_match.groups())
-                        current_time = hours * 3600 + minutes * 60 + seconds
-                        progress = int((current_time / duration) * 100)
-                        self.progress_update.emit(progress, 100, f"转换进度: {progress}%")
-
-            process.wait()
-
-            if process.returncode == 0:
-                self.conversion_complete.emit(self.output_file)
-            else:
-                self.error_occurred.emit("转换过程中出错")
-
-        except Exception as e:
-            self.error_occurred.emit(f"发生错误: {str(e)}")
+class PipelineThread(PipelineWorker, QThread):
+    stage_changed = pyqtSignal(str)
+    pipeline_complete = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    telemetry_recorded = pyqtSignal(dict)
+    converter_class = ConversionThread
+
+class CapabilityProbeThread(CapabilityProbeWorker, QThread):
+    capabilities_ready = pyqtSignal(object)
+
+# 统计表中显示的名称
+TELEMETRY_JOB_LABELS = {'download': '下载', 'normalize': '处理', 'merge': '合并', 'convert': '转换', 'pipeline': '流水线'}
+TELEMETRY_STATUS_LABELS = {'ok': '成功', 'failed': '失败', 'cancelled': '已取消', 'skipped': '已下载过', 'cached': '使用缓存', 'unchanged': '无需处理'}
+TELEMETRY_STAGE_LABELS = {
+    'page': '获取页面', 'wait_slot': '等待下载名额', 'cdn_probe': 'CDN测速', 'playlist': '获取播放列表', 'segments': '下载分片',
+    'ffmpeg_download': 'FFmpeg下载', 'ytdlp': 'yt-dlp下载', 'probe': '读取视频信息', 'cache_lookup': '查找缓存', 'encode': '编码',
+    'remux': '封装', 'prepare': '准备片头片尾和水印', 'normalize': '处理视频', 'concat': '拼接', 'convert': '转换格式',
+    'download_normalize': '下载并处理', 'normalizer_idle': '等待下载', 'queue_full_wait': '等待处理',
+    'split': '切分', 'stitch': '拼接各段', 'verify': '检查音画同步',
+}
+# 多格式输出时可勾选的格式
+MULTI_TARGET_OPTIONS = {
+    '720p MPG (汇北校区)': ('720p', 'mpg'),
+    '480p MPG (新街校区)': ('480p', 'mpg'),
+    '720p AVI': ('720p', 'avi'),
+}
+
+TELEMETRY_COLUMNS = ['时间', '类型', '对象', '状态', '总耗时', '最慢环节', '数据量', '平均速度', '最低速度', '编码速度', '重试']
 
 class DownloaderGUI(QWidget):
     def __init__(self):
         super().__init__()
-        self.cdn_urls = {
-            "CCTV HLS_NAP (中国大陆,高清)":"hlssnap.video.cctv.com",
-            "网宿国际 (海外,需代理hls.cntv.cdn20.com)":"hls.cntv.cdn20.com"
-        }
+        self.cdn_urls = CCTV_CDN_HOSTS
         self.initUI()
+        # 在后台检测 FFmpeg 支持的硬件编码，不拖慢窗口显示
+        self.capability_thread = CapabilityProbeThread()
+        self.capability_thread.capabilities_ready.connect(self.update_accelerations)
+        self.capability_thread.start()
 
     def initUI(self):
         layout = QVBoxLayout()
@@ -447,14 +89,17 @@ class DownloaderGUI(QWidget):
         acceleration_layout = QHBoxLayout()
         acceleration_layout.addWidget(QLabel('FFmpeg加速:'))
         self.acceleration_combo = QComboBox()
-        self.acceleration_combo.addItems(['不加速（CPU）', '英伟达（Nvidia）', 'AMD'])
+        self.acceleration_combo.addItems(list(ACCELERATIONS.values()))
         acceleration_layout.addWidget(self.acceleration_combo)
+        self.acceleration_status = QLabel('正在检测硬件编码...')
+        acceleration_layout.addWidget(self.acceleration_status)
         layout.addLayout(acceleration_layout)
 
         self.tab_widget = QTabWidget()
         self.tab_widget.addTab(self.create_download_tab(), "下载视频")
         self.tab_widget.addTab(self.create_merge_tab(), "合并视频")
         self.tab_widget.addTab(self.create_conversion_tab(), "格式转换")
+        self.tab_widget.addTab(self.create_telemetry_tab(), "运行统计")
 
         layout.addWidget(self.tab_widget)
 
@@ -472,6 +117,19 @@ class DownloaderGUI(QWidget):
         
         self.setGeometry(x, y, width, height)
 
+    def update_accelerations(self, capabilities):
+        """ Grey out the acceleration choices whose hardware encoder doesn't work on this computer """
+        available = capabilities.available_accelerations()
+        model = self.acceleration_combo.model()
+        for index in range(self.acceleration_combo.count()):
+            if self.acceleration_combo.itemText(index) not in available:
+                model.item(index).setEnabled(False)
+                model.item(index).setToolTip("此电脑上的 FFmpeg 无法使用这种硬件编码")
+        if self.acceleration_combo.currentText() not in available:
+            self.acceleration_combo.setCurrentText(ACCELERATIONS['cpu'])
+        hardware = [label for label in available if label != ACCELERATIONS['cpu']]
+        self.acceleration_status.setText(f"可用的硬件编码: {'、'.join(hardware)}" if hardware else "没有可用的硬件编码，将使用 CPU")
+
     def openProgramDirectory(self):
         if getattr(sys, 'frozen', False):
             # 如果是打包后的 exe
@@ -479,13 +137,15 @@ class DownloaderGUI(QWidget):
         else:
             # 如果是在开发环境中
             program_dir = os.path.dirname(os.path.abspath(__file__))
-    
+        self.open_directory(program_dir)
+
+    def open_directory(self, directory):
         if sys.platform == 'win32':
-            os.startfile(program_dir)
+            os.startfile(directory)
         elif sys.platform == 'darwin':
-            subprocess.Popen(['open', program_dir])
+            subprocess.Popen(['open', directory])
         else:
-            subprocess.Popen(['xdg-open', program_dir])
+            subprocess.Popen(['xdg-open', directory])
 
     def showAbout(self):
         about_text = """本程序用于自贡市第一中学校校园电视台新闻采集
@@ -511,10 +171,29 @@ Github: https://github.com/zigongyizhong/broadcast
         cdn_layout = QHBoxLayout()
         cdn_layout.addWidget(QLabel('央视CDN:'))
         self.cdn_combo = QComboBox()
-        self.cdn_combo.addItems(list(self.cdn_urls.keys()))
+        self.cdn_combo.addItems([CDN_AUTO_LABEL] + list(self.cdn_urls.keys()))
         cdn_layout.addWidget(self.cdn_combo)
         layout.addLayout(cdn_layout)
 
+        concurrency_layout = QHBoxLayout()
+        concurrency_layout.addWidget(QLabel('同时下载数:'))
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, 16)
+        self.concurrency_spin.setValue(DEFAULT_MAX_CONCURRENT_DOWNLOADS)
+        concurrency_layout.addWidget(self.concurrency_spin)
+        layout.addLayout(concurrency_layout)
+
+        self.pipeline_checkbox = QCheckBox('下载后自动合并并转换 (流水线模式，使用另外两页的设置)')
+        layout.addWidget(self.pipeline_checkbox)
+
+        ingest_layout = QHBoxLayout()
+        self.ingest_checkbox = QCheckBox('边下载边处理 (央视视频直接输出播出规格，流水线模式有效)')
+        ingest_layout.addWidget(self.ingest_checkbox)
+        self.keep_raw_checkbox = QCheckBox('同时保存原始文件')
+        self.keep_raw_checkbox.setChecked(True)
+        ingest_layout.addWidget(self.keep_raw_checkbox)
+        layout.addLayout(ingest_layout)
+
         self.download_btn = QPushButton('开始下载')
         self.download_btn.clicked.connect(self.start_download)
         layout.addWidget(self.download_btn)
@@ -554,10 +233,49 @@ Github: https://github.com/zigongyizhong/broadcast
         self.add_ending_checkbox.setChecked(True)
         layout.addWidget(self.add_ending_checkbox)
 
+        self.smart_copy_checkbox = QCheckBox('智能复制 (已符合播出规格的视频不重新编码)')
+        self.smart_copy_checkbox.setChecked(True)
+        layout.addWidget(self.smart_copy_checkbox)
+
+        merge_mode_layout = QHBoxLayout()
+        merge_mode_layout.addWidget(QLabel('合并方式:'))
+        self.merge_mode_combo = QComboBox()
+        self.merge_mode_combo.addItems(list(MERGE_MODES.keys()))
+        merge_mode_layout.addWidget(self.merge_mode_combo)
+        layout.addLayout(merge_mode_layout)
+
+        merge_output_layout = QHBoxLayout()
+        merge_output_layout.addWidget(QLabel('输出格式:'))
+        self.merge_output_combo = QComboBox()
+        self.merge_output_combo.addItems(list(MERGE_OUTPUTS.keys()))
+        self.merge_output_combo.setToolTip('分片 MP4 和 MPEG-TS 按播出顺序边处理边写入，第一个片段写好后就可以开始播放')
+        merge_output_layout.addWidget(self.merge_output_combo)
+        layout.addLayout(merge_output_layout)
+
+        jobs_layout = QHBoxLayout()
+        jobs_layout.addWidget(QLabel('并行处理数:'))
+        self.merge_jobs_spin = QSpinBox()
+        self.merge_jobs_spin.setRange(1, os.cpu_count() or 1)
+        self.merge_jobs_spin.setValue(DEFAULT_MERGE_JOBS)
+        jobs_layout.addWidget(self.merge_jobs_spin)
+        layout.addLayout(jobs_layout)
+
+        deadline_layout = QHBoxLayout()
+        self.deadline_checkbox = QCheckBox('按时完成 (按实测速度选择编码预设，逐个处理时有效):')
+        deadline_layout.addWidget(self.deadline_checkbox)
+        self.deadline_edit = QTimeEdit(QTime(7, 30))
+        self.deadline_edit.setDisplayFormat('HH:mm')
+        deadline_layout.addWidget(self.deadline_edit)
+        layout.addLayout(deadline_layout)
+
         self.merge_btn = QPushButton('合并视频')
         self.merge_btn.clicked.connect(self.merge_videos)
         layout.addWidget(self.merge_btn)
 
+        self.merge_cancel_btn = QPushButton('取消合并')
+        self.merge_cancel_btn.clicked.connect(self.cancel_merge)
+        layout.addWidget(self.merge_cancel_btn)
+
         self.merge_progress_bar = QProgressBar()
         layout.addWidget(self.merge_progress_bar)
 
@@ -595,10 +313,34 @@ Github: https://github.com/zigongyizhong/broadcast
         format_layout.addWidget(self.format_combo)
         layout.addLayout(format_layout)
 
+        self.multi_target_checkbox = QCheckBox('多格式输出 (只解码一次，同时生成下面勾选的格式，不使用上面的分辨率和格式)')
+        layout.addWidget(self.multi_target_checkbox)
+        targets_layout = QHBoxLayout()
+        self.target_checkboxes = {}
+        for label, target in MULTI_TARGET_OPTIONS.items():
+            checkbox = QCheckBox(label)
+            checkbox.setChecked(target in CAMPUS_TARGETS)
+            targets_layout.addWidget(checkbox)
+            self.target_checkboxes[label] = checkbox
+        layout.addLayout(targets_layout)
+
+        chunks_layout = QHBoxLayout()
+        chunks_layout.addWidget(QLabel('分段并行转换 (1 为整体转换):'))
+        self.conversion_chunks_spin = QSpinBox()
+        self.conversion_chunks_spin.setRange(1, os.cpu_count() or 1)
+        self.conversion_chunks_spin.setValue(DEFAULT_CONVERSION_CHUNKS)
+        self.conversion_chunks_spin.setToolTip('把长视频在关键帧处切成几段同时编码，拼接后检查时长和音画同步，不一致时自动改为整体转换')
+        chunks_layout.addWidget(self.conversion_chunks_spin)
+        layout.addLayout(chunks_layout)
+
         self.convert_btn = QPushButton('开始转换')
         self.convert_btn.clicked.connect(self.start_conversion)
         layout.addWidget(self.convert_btn)
 
+        self.convert_cancel_btn = QPushButton('取消转换')
+        self.convert_cancel_btn.clicked.connect(self.cancel_conversion)
+        layout.addWidget(self.convert_cancel_btn)
+
         self.conversion_progress_bar = QProgressBar()
         layout.addWidget(self.conversion_progress_bar)
 
@@ -609,6 +351,60 @@ Github: https://github.com/zigongyizhong/broadcast
         conversion_widget.setLayout(layout)
         return conversion_widget
 
+    def create_telemetry_tab(self):
+        telemetry_widget = QWidget()
+        layout = QVBoxLayout()
+
+        layout.addWidget(QLabel('本次运行中每个视频各环节的耗时，耗时最长的环节就是瓶颈；完整记录保存在统计日志中'))
+
+        self.telemetry_table = QTableWidget(0, len(TELEMETRY_COLUMNS))
+        self.telemetry_table.setHorizontalHeaderLabels(TELEMETRY_COLUMNS)
+        self.telemetry_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.telemetry_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.telemetry_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        layout.addWidget(self.telemetry_table)
+
+        self.telemetry_dir_btn = QPushButton('打开统计日志目录')
+        self.telemetry_dir_btn.clicked.connect(self.open_telemetry_directory)
+        layout.addWidget(self.telemetry_dir_btn)
+
+        telemetry_widget.setLayout(layout)
+        return telemetry_widget
+
+    def open_telemetry_directory(self):
+        directory = os.path.dirname(TELEMETRY_PATH)
+        os.makedirs(directory, exist_ok=True)
+        self.open_directory(directory)
+
+    def add_telemetry_row(self, record):
+        summary = summarize_telemetry(record)
+        megabytes = lambda value: f"{value / 1024 / 1024:.1f} MB" if value else ''
+        rate = lambda value: f"{value / 1024 / 1024:.2f} MB/s" if value else ''
+        speed = ' / '.join(part for part in (f"{summary['speed']:.2f}x" if summary['speed'] else '', f"{summary['fps']:.0f} fps" if summary['fps'] else '') if part)
+        subject = record.get('subject') or ''
+        bottleneck = summary['bottleneck']
+        cells = [
+            record.get('time', '').replace('T', ' '),
+            TELEMETRY_JOB_LABELS.get(record.get('job'), record.get('job')),
+            subject if record.get('job') == 'download' else os.path.basename(subject.rstrip('/\\')) or subject,
+            TELEMETRY_STATUS_LABELS.get(record.get('status'), record.get('status')),
+            f"{summary['seconds']:.1f}s" if summary['seconds'] is not None else '',
+            f"{TELEMETRY_STAGE_LABELS.get(bottleneck, bottleneck)} ({record['stages'][bottleneck]['seconds']:.1f}s)" if bottleneck else '',
+            megabytes(summary['bytes']),
+            rate(summary['avg_rate']),
+            rate(summary['min_rate']),
+            speed,
+            str(summary['retries']) if summary['retries'] else '',
+        ]
+        row = self.telemetry_table.rowCount()
+        self.telemetry_table.insertRow(row)
+        details = json.dumps(record, ensure_ascii=False, indent=2)
+        for column, text in enumerate(cells):
+            item = QTableWidgetItem(text)
+            item.setToolTip(details)
+            self.telemetry_table.setItem(row, column, item)
+        self.telemetry_table.scrollToBottom()
+
     def select_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "选择文件夹")
         if folder:
@@ -625,33 +421,43 @@ Github: https://github.com/zigongyizhong/broadcast
             self.merge_status_text.setText("请选择有效的文件夹")
             return
 
+        self.merge_thread = self.create_merge_thread(folder)
+        if not self.merge_thread:
+            return
+        self.merge_thread.start()
+
+        self.merge_btn.setEnabled(False)
+        self.merge_status_text.setText("开始处理视频...")
+
+    def create_merge_thread(self, folder):
+        """ Build a MergeThread from the merge tab's settings, or return None if an asset is missing """
         add_intro = self.add_intro_checkbox.isChecked()
         add_watermark = self.add_watermark_checkbox.isChecked()
         add_ending = self.add_ending_checkbox.isChecked()
 
         watermark_image = logo_path if add_watermark else None
-        if add_watermark and not os.path.exists(watermark_image):
-            self.merge_status_text.setText("找不到水印图片(logo.png)")
-            return
-
-        if add_intro and not os.path.exists(intro_path):
-            self.merge_status_text.setText("找不到片头视频 (intro.mp4)")
-            return
-
-        if add_ending and not os.path.exists(outro_path):
-            self.merge_status_text.setText("找不到片尾视频 (outro.mp4)")
-            return
+        missing = missing_merge_asset(add_watermark, add_intro, add_ending)
+        if missing:
+            self.merge_status_text.setText(missing)
+            return None
 
         acceleration = self.acceleration_combo.currentText()
 
-        self.merge_thread = MergeThread(folder, watermark_image, add_intro, add_ending, acceleration)
-        self.merge_thread.progress_update.connect(self.update_merge_progress)
-        self.merge_thread.merge_complete.connect(self.merge_finished)
-        self.merge_thread.error_occurred.connect(self.show_merge_error)
-        self.merge_thread.start()
+        # 已经过了的时间表示明天的这个时间
+        deadline = deadline_from_clock(self.deadline_edit.time().toString('HH:mm')) if self.deadline_checkbox.isChecked() else None
 
-        self.merge_btn.setEnabled(False)
-        self.merge_status_text.setText("开始处理视频...")
+        merge_thread = MergeThread(folder, watermark_image, add_intro, add_ending, acceleration, self.merge_jobs_spin.value(), self.smart_copy_checkbox.isChecked(),
+                                   MERGE_MODES[self.merge_mode_combo.currentText()], deadline=deadline, output_mode=MERGE_OUTPUTS[self.merge_output_combo.currentText()])
+        merge_thread.progress_update.connect(self.update_merge_progress)
+        merge_thread.merge_complete.connect(self.merge_finished)
+        merge_thread.error_occurred.connect(self.show_merge_error)
+        merge_thread.telemetry_recorded.connect(self.add_telemetry_row)
+        return merge_thread
+
+    def cancel_merge(self):
+        merge_thread = getattr(self, 'merge_thread', None)
+        if merge_thread and merge_thread.isRunning():
+            merge_thread.cancel()
 
     def update_merge_progress(self, current, total, message):
         self.merge_progress_bar.setValue(current)
@@ -670,24 +476,55 @@ Github: https://github.com/zigongyizhong/broadcast
         urls = self.url_input.toPlainText().split('\n')
         urls = [url.strip() for url in urls if url.strip()]
         cdn_name = self.cdn_combo.currentText()
-        cdnurl = self.cdn_urls[cdn_name]
+        # 自动选择时为 None，由下载线程测速决定
+        cdnurl = self.cdn_urls.get(cdn_name)
         if not urls:
             self.status_text.setText("请输入至少一个 URL")
             return
 
-        self.download_thread = DownloadThread(urls, cdnurl)
+        self.download_progress = {}
+        self.download_thread = DownloadThread(urls, cdnurl, self.concurrency_spin.value(), cdn_hosts=list(self.cdn_urls.values()))
         self.download_thread.progress_update.connect(self.update_progress)
         self.download_thread.download_complete.connect(self.download_finished)
         self.download_thread.all_downloads_complete.connect(self.all_downloads_finished)
         self.download_thread.error_occurred.connect(self.show_error)
-        self.download_thread.start()
+        self.download_thread.status_message.connect(self.status_text.append)
+        self.download_thread.telemetry_recorded.connect(self.add_telemetry_row)
+
+        if self.pipeline_checkbox.isChecked():
+            # 流水线模式：使用合并和格式转换页面的设置，下载完一个就处理一个
+            merge_thread = self.create_merge_thread(self.download_thread.base_dir)
+            if not merge_thread:
+                self.status_text.setText("合并设置有误，请查看合并视频页面")
+                return
+            targets = self.conversion_targets()
+            if not targets:
+                self.status_text.setText("请在格式转换页面至少勾选一种输出格式")
+                return
+            (resolution, format), extra_targets = targets[0], targets[1:]
+            self.pipeline_thread = PipelineThread(self.download_thread, merge_thread, resolution, format, extra_targets, self.conversion_chunks_spin.value(),
+                                                  self.ingest_checkbox.isChecked(), self.keep_raw_checkbox.isChecked())
+            self.pipeline_thread.converter.progress_update.connect(self.update_conversion_progress)
+            self.pipeline_thread.converter.conversion_complete.connect(self.conversion_finished)
+            self.pipeline_thread.stage_changed.connect(self.status_text.append)
+            self.pipeline_thread.pipeline_complete.connect(self.pipeline_finished)
+            self.pipeline_thread.error_occurred.connect(self.show_pipeline_error)
+            self.pipeline_thread.telemetry_recorded.connect(self.add_telemetry_row)
+            self.pipeline_thread.converter.telemetry_recorded.connect(self.add_telemetry_row)
+            self.pipeline_thread.start()
+            self.merge_btn.setEnabled(False)
+            self.convert_btn.setEnabled(False)
+        else:
+            self.download_thread.start()
 
         self.download_btn.setEnabled(False)
         self.status_text.setText("下载中...")
         self.progress_bar.setValue(0)  # 重置进度条
 
     def update_progress(self, current_video, total_videos, current_segment, total_segments):
-        progress = int((current_video - 1) / total_videos * 100 + (current_segment / total_segments) * (100 / total_videos))
+        # 多个视频同时下载，总进度取各视频进度的平均值
+        self.download_progress[current_video] = current_segment / total_segments if total_segments else 0
+        progress = int(sum(self.download_progress.values()) / total_videos * 100)
         self.progress_bar.setValue(progress)
         self.status_text.setText(f"下载视频 {current_video}/{total_videos}，当前视频进度 {current_segment}/{total_segments}")
 
@@ -697,41 +534,74 @@ Github: https://github.com/zigongyizhong/broadcast
     def all_downloads_finished(self):
         self.progress_bar.setValue(100)  # 确保进度条显示100%
         self.status_text.append("所有视频下载完成")
+        # 流水线模式下还要合并和转换，等流水线结束再恢复按钮
+        pipeline_thread = getattr(self, 'pipeline_thread', None)
+        if pipeline_thread and pipeline_thread.isRunning():
+            return
         self.download_btn.setEnabled(True)
 
     def show_error(self, error_message):
+        # 单个视频失败时其余视频仍在下载，等 all_downloads_complete 再恢复按钮
+        self.status_text.append(error_message)
+
+    def pipeline_finished(self, output_file):
+        self.status_text.append(f"流水线完成: {output_file}")
+        self.download_btn.setEnabled(True)
+        self.merge_btn.setEnabled(True)
+        self.convert_btn.setEnabled(True)
+
+    def show_pipeline_error(self, error_message):
         self.status_text.append(error_message)
         self.download_btn.setEnabled(True)
+        self.merge_btn.setEnabled(True)
+        self.convert_btn.setEnabled(True)
 
 
+    def conversion_targets(self):
+        """ Return the (resolution, format) pairs to produce, the first one being the main output """
+        if self.multi_target_checkbox.isChecked():
+            return [MULTI_TARGET_OPTIONS[label] for label, checkbox in self.target_checkboxes.items() if checkbox.isChecked()]
+        return [(self.resolution_combo.currentText().split()[0], self.format_combo.currentText())]
+
     def start_conversion(self):
         input_file = self.file_input.toPlainText()
         if not input_file or not os.path.isfile(input_file):
             self.conversion_status_text.setText("请选择有效的视频文件")
             return
 
-        resolution = self.resolution_combo.currentText().split()[0]
-        format = self.format_combo.currentText()
+        targets = self.conversion_targets()
+        if not targets:
+            self.conversion_status_text.setText("请至少勾选一种输出格式")
+            return
+        (resolution, format), extra_targets = targets[0], targets[1:]
         acceleration = self.acceleration_combo.currentText()
 
-        output_file = os.path.splitext(input_file)[0] + f"_{resolution}.{format}"
+        output_file = conversion_output_file(input_file, resolution, format)
 
-        self.conversion_thread = ConversionThread(input_file, output_file, resolution, format, acceleration)
+        self.conversion_thread = ConversionThread(input_file, output_file, resolution, format, acceleration, extra_targets=extra_targets,
+                                                  chunks=self.conversion_chunks_spin.value())
         self.conversion_thread.progress_update.connect(self.update_conversion_progress)
         self.conversion_thread.conversion_complete.connect(self.conversion_finished)
         self.conversion_thread.error_occurred.connect(self.show_conversion_error)
+        self.conversion_thread.telemetry_recorded.connect(self.add_telemetry_row)
         self.conversion_thread.start()
 
         self.convert_btn.setEnabled(False)
         self.conversion_status_text.setText("开始转换...")
 
+    def cancel_conversion(self):
+        conversion_thread = getattr(self, 'conversion_thread', None)
+        if conversion_thread and conversion_thread.isRunning():
+            conversion_thread.cancel()
+
     def update_conversion_progress(self, current, total, message):
         self.conversion_progress_bar.setValue(current)
         self.conversion_status_text.setText(message)
 
     def conversion_finished(self, output_file):
         self.conversion_progress_bar.setValue(100)
-        self.conversion_status_text.setText(f"转换完成: {output_file}")
+        # 多格式输出时每个文件各通知一次
+        self.conversion_status_text.append(f"转换完成: {output_file}")
         self.convert_btn.setEnabled(True)
 
     def show_conversion_error(self, error_message):
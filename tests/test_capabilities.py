@@ -0,0 +1,128 @@
+""" FFmpeg capability probe and CPU fallback, run against a stub ffmpeg so no graphics card is needed
+
+The stub lists NVENC, AMF and CUDA like a real FFmpeg build does on a machine without the hardware,
+but every command that uses them fails.
+"""
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import engine
+from engine import ACCELERATIONS, CPU_FALLBACK_PRESET, FFmpegCapabilities, FFmpegJob, encoding_plan, run_with_cpu_fallback
+
+STUB_FFMPEG = textwrap.dedent('''\
+    #!{python}
+    import sys
+    args = sys.argv[1:]
+    if '-encoders' in args:
+        print('Encoders:')
+        print(' V..... = Video')
+        print(' ------')
+        print(' V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC')
+        print(' V....D h264_nvenc           NVIDIA NVENC H.264 encoder')
+        print(' V....D h264_amf             AMD AMF H.264 Encoder')
+        print(' A....D aac                  AAC (Advanced Audio Coding)')
+        sys.exit(0)
+    if '-hwaccels' in args:
+        print('Hardware acceleration methods:')
+        print('cuda')
+        sys.exit(0)
+    if any(name in args for name in ('h264_nvenc', 'h264_amf', '-hwaccel')):
+        sys.stderr.write('No capable devices found\\n')
+        sys.exit(1)
+    output = args[-1]
+    if output != '-':
+        open(output, 'wb').close()
+    if '-progress' in args:
+        print('progress=end')
+    sys.exit(0)
+''')
+
+@unittest.skipIf(sys.platform == 'win32', 'the stub ffmpeg is a script with a shebang line')
+class CapabilitiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ffmpeg = os.path.join(self.temp_dir.name, 'ffmpeg')
+        with open(self.ffmpeg, 'w') as f:
+            f.write(STUB_FFMPEG.format(python=sys.executable))
+        os.chmod(self.ffmpeg, os.stat(self.ffmpeg).st_mode | stat.S_IXUSR)
+        self.saved = (FFmpegCapabilities._loaded, engine.cache_dir)
+        engine.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+
+    def tearDown(self):
+        FFmpegCapabilities._loaded, engine.cache_dir = self.saved
+        self.temp_dir.cleanup()
+
+    def use(self, capabilities):
+        FFmpegCapabilities._loaded = capabilities
+        return capabilities
+
+    def test_probe_rejects_listed_hardware_that_does_not_work(self):
+        capabilities = FFmpegCapabilities.probe(self.ffmpeg)
+        self.assertTrue(capabilities.has_encoder('libx264'))
+        self.assertFalse(capabilities.has_encoder('h264_nvenc'))
+        self.assertFalse(capabilities.has_encoder('h264_amf'))
+        self.assertFalse(capabilities.has_hwaccel('cuda'))
+        self.assertEqual(capabilities.available_accelerations(), [ACCELERATIONS['cpu']])
+
+    def test_probe_without_ffmpeg_finds_nothing(self):
+        capabilities = FFmpegCapabilities.probe(os.path.join(self.temp_dir.name, 'missing'))
+        self.assertEqual(capabilities.encoders, {})
+        self.assertIsNone(capabilities.fingerprint)
+
+    def test_encoding_plan_uses_the_cpu_when_the_hardware_is_unavailable(self):
+        self.use(FFmpegCapabilities.probe(self.ffmpeg))
+        self.assertEqual(encoding_plan(ACCELERATIONS['nvidia']), (None, 'libx264', CPU_FALLBACK_PRESET))
+        self.assertEqual(encoding_plan(ACCELERATIONS['cpu']), (None, 'libx264', 'medium'))
+
+    def test_encoding_plan_uses_working_hardware(self):
+        self.use(FFmpegCapabilities({'libx264': True, 'h264_nvenc': True}, {'cuda': True}))
+        self.assertEqual(encoding_plan(ACCELERATIONS['nvidia']), ('cuda', 'h264_nvenc', 'medium'))
+        self.assertEqual(encoding_plan(ACCELERATIONS['nvidia'], hardware=False), (None, 'libx264', CPU_FALLBACK_PRESET))
+
+    def build(self, acceleration, output):
+        def build(hardware):
+            hwaccel, encoder, _ = encoding_plan(acceleration, hardware)
+            return [self.ffmpeg, '-y', *(['-hwaccel', hwaccel] if hwaccel else []), '-i', 'input.mp4', '-c:v', encoder, output]
+        return build
+
+    def test_failed_hardware_encode_is_retried_on_the_cpu(self):
+        # 检测时显卡可用，编码时却失败
+        capabilities = self.use(FFmpegCapabilities({'libx264': True, 'h264_nvenc': True}, {'cuda': True}))
+        output = os.path.join(self.temp_dir.name, 'out.mp4')
+        commands = []
+        messages = []
+
+        def run(command):
+            commands.append(command)
+            return FFmpegJob(command).run()
+
+        _, hardware = run_with_cpu_fallback(run, self.build(ACCELERATIONS['nvidia'], output), ACCELERATIONS['nvidia'], messages.append)
+        self.assertFalse(hardware)
+        self.assertEqual(len(commands), 2)
+        self.assertIn('h264_nvenc', commands[0])
+        self.assertIn('libx264', commands[1])
+        self.assertNotIn('-hwaccel', commands[1])
+        self.assertTrue(os.path.exists(output))
+        self.assertEqual(len(messages), 1)
+        self.assertIn('No capable devices found', messages[0])
+        # 本进程之后的任务直接使用 CPU
+        self.assertFalse(capabilities.has_encoder('h264_nvenc'))
+        self.assertFalse(capabilities.has_hwaccel('cuda'))
+
+    def test_cpu_errors_are_not_retried(self):
+        self.use(FFmpegCapabilities({'libx264': True}))
+        messages = []
+        build = lambda hardware: [self.ffmpeg, '-hwaccel', 'none', '-i', 'input.mp4', 'out.mp4']
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_with_cpu_fallback(lambda command: FFmpegJob(command).run(), build, ACCELERATIONS['cpu'], messages.append)
+        self.assertEqual(messages, [])
+
+if __name__ == '__main__':
+    unittest.main()
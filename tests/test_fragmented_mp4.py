@@ -0,0 +1,57 @@
+""" MP4 box helpers used to append clips to a fragmented MP4 and finalize it, on hand-built boxes so FFmpeg is not needed """
+import io
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import (FRAGMENT_DURATION_SIZE, copy_mp4_boxes, fragment_duration_box, mp4_box, mp4_children, mp4_fragment_index,
+                    read_mp4_box, read_mp4_fragment_index, reserve_fragment_duration)
+
+def movie_header(timescale):
+    return mp4_box(b'mvhd', struct.pack('>B3xIII', 0, 0, 0, timescale) + bytes(84))
+
+def track_extends(track_id):
+    return mp4_box(b'trex', struct.pack('>B3xIIIII', 0, track_id, 1, 0, 0, 0))
+
+class FragmentedMp4Test(unittest.TestCase):
+
+    def test_duration_placeholder_is_replaced_in_place(self):
+        moov = mp4_box(b'moov', movie_header(1000) + mp4_box(b'trak', b'') + mp4_box(b'mvex', track_extends(1) + track_extends(2)))
+        patched, placeholder, timescale = reserve_fragment_duration(moov)
+        self.assertEqual(timescale, 1000)
+        self.assertEqual(len(patched), len(moov) + FRAGMENT_DURATION_SIZE)
+        self.assertEqual(patched[placeholder + 4:placeholder + 8], b'free')
+
+        duration = fragment_duration_box(19760)
+        self.assertEqual(len(duration), FRAGMENT_DURATION_SIZE)
+        final = patched[:placeholder] + duration + patched[placeholder + len(duration):]
+        mvex = dict(mp4_children(final))[b'mvex']
+        self.assertEqual([box_type for box_type, _ in mp4_children(mvex)], [b'mehd', b'trex', b'trex'])
+        self.assertEqual(struct.unpack_from('>Q', mp4_children(mvex)[0][1], 12)[0], 19760)
+
+    def test_fragment_index_round_trip(self):
+        index = {1: [(2560, 1298, 1, 1, 1), (86016, 2061755, 1, 1, 1)], 2: [(8576, 1298, 1, 1, 1)]}
+        source = io.BytesIO(mp4_box(b'mdat', bytes(32)) + mp4_fragment_index(index))
+        self.assertEqual(read_mp4_fragment_index(source), index)
+
+    def test_file_without_index(self):
+        self.assertEqual(read_mp4_fragment_index(io.BytesIO(mp4_box(b'mdat', bytes(32)))), {})
+
+    def test_copy_reports_where_fragments_moved(self):
+        ftyp, moov = mp4_box(b'ftyp', b'isom'), mp4_box(b'moov', movie_header(1000))
+        moof, mdat = mp4_box(b'moof', bytes(8)), mp4_box(b'mdat', bytes(100))
+        source = io.BytesIO(ftyp + moov + moof + mdat + moof + mdat + mp4_fragment_index({1: []}))
+        self.assertEqual(read_mp4_box(source), (b'ftyp', ftyp))
+        source.seek(0)
+        target = io.BytesIO()
+        target.write(bytes(1000))
+        moved = copy_mp4_boxes(source, target, (b'moof', b'mdat'))
+        first = len(ftyp) + len(moov)
+        second = first + len(moof) + len(mdat)
+        self.assertEqual(moved, {first: 1000, second: 1000 + second - first})
+        self.assertEqual(target.getvalue()[1000:], (moof + mdat) * 2)
+
+if __name__ == '__main__':
+    unittest.main()